@@ -0,0 +1,117 @@
+# amfi.py
+import numpy as np
+import pandas as pd
+
+import config
+from utils import load_data
+
+RELEASE_COLUMNS = ["published", "release_date", "published_at"]  # optional actual release date
+
+# ---------------------------------------------------------------------
+# Helper: monthly AMFI flows
+# ---------------------------------------------------------------------
+def synthetic_amfi(categories, months=36, seed=None):
+    """One net flow per category per month-end, for runs without amfi_flows.csv."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=pd.Timestamp.today(), periods=months, freq="ME")
+    return pd.DataFrame({
+        "Date": dates.repeat(len(categories)),
+        "category": np.tile(categories, months),
+        "flow": rng.uniform(-100, 100, months * len(categories)),
+    })
+
+
+def load_amfi(path=config.AMFI_FILE):
+    """Monthly flows (Date, category, flow[, published]) or None when the file is missing."""
+    amfi = load_data(path)
+    if amfi is None:
+        return None
+    amfi.columns = [str(c).strip() for c in amfi.columns]
+    lower = {c.lower(): c for c in amfi.columns}
+    rename = {lower[k]: k.capitalize() if k == "date" else k for k in ("date", "category", "flow") if k in lower}
+    release = next((lower[c] for c in RELEASE_COLUMNS if c in lower), None)
+    if release is not None:
+        rename[release] = "published"
+    return amfi.rename(columns=rename)
+
+
+def instrument_map(categories, mapping=None):
+    """
+    category → instrument pairs. `mapping` values may be one instrument or a list;
+    None maps every category to the instrument of the same name.
+    """
+    if mapping is None:
+        return pd.DataFrame({"category": categories, "index": categories})
+    pairs = [(c, i) for c, target in mapping.items()
+             for i in ([target] if isinstance(target, str) else target)]
+    return pd.DataFrame(pairs, columns=["category", "index"])
+
+
+def monthly_flows(amfi, mapping=None, lag_days=None):
+    """
+    Net flow per (instrument, month) with the moment it became public.
+    A month is published `lag_days` after month-end (or on its `published` date when
+    the file has one) and counts from the end of that day. Categories mapped to the
+    same instrument are summed and the sum is public once every part is.
+    """
+    lag_days = config.AMFI_PUBLICATION_LAG_DAYS if lag_days is None else lag_days
+    flows = amfi.assign(
+        category=amfi["category"].astype(str),
+        month=pd.to_datetime(amfi["Date"]).dt.normalize() + pd.offsets.MonthEnd(0),
+        flow=pd.to_numeric(amfi["flow"], errors="coerce"),
+    ).dropna(subset=["month", "flow"])
+    # a re-sent (category, month) replaces the earlier row
+    flows = flows.drop_duplicates(["category", "month"], keep="last")
+
+    released = flows["month"] + pd.Timedelta(lag_days, "D")
+    if "published" in flows:
+        released = pd.to_datetime(flows["published"], errors="coerce").dt.normalize().fillna(released)
+    flows["available_at"] = released + pd.Timedelta(1, "D")
+
+    pairs = instrument_map(flows["category"].unique(), mapping)
+    flows = flows.merge(pairs, on="category", how="inner")
+    flows = flows.groupby(["index", "month"], sort=False).agg(
+        flow=("flow", "sum"), available_at=("available_at", "max")).reset_index()
+    return flows.sort_values("available_at", kind="stable").reset_index(drop=True)
+
+# ---------------------------------------------------------------------
+# Point-in-time join
+# ---------------------------------------------------------------------
+def decision_times(dates, cutoff=config.PUBLICATION_TIME):
+    """Weekly decision moment of each row: its date at the cut-off (timestamps with a time are kept)."""
+    dates = pd.to_datetime(dates)
+    day = dates.dt.normalize()
+    return dates.where(dates != day, day + pd.to_timedelta(f"{cutoff}:00"))
+
+
+def join_flows(panel, flows, cutoff=config.PUBLICATION_TIME):
+    """
+    As-of join: each long panel row gets, as flow_pressure, the latest monthly flow of
+    its instrument that was public at the row's decision time, and flow_month = the month
+    it belongs to. One sorted merge over all instruments; rows with no published flow
+    yet (or no mapped category) get 0.
+    """
+    index = panel["index"]
+    if isinstance(index.dtype, pd.CategoricalDtype):
+        codes, uniques = index.cat.codes.to_numpy(np.int64), index.cat.categories.astype(str)
+    else:
+        codes, uniques = pd.factorize(index.astype(str))
+    right = flows.assign(code=pd.Index(uniques).get_indexer(flows["index"].astype(str)))
+    right = right.loc[right["code"] >= 0, ["available_at", "code", "flow", "month"]]
+
+    left = pd.DataFrame({
+        "decision": decision_times(panel["Date"]).to_numpy(),
+        "code": codes,
+        "row": np.arange(len(panel)),
+    }).sort_values("decision", kind="stable")
+    joined = pd.merge_asof(left, right, left_on="decision", right_on="available_at",
+                           by="code", direction="backward").sort_values("row")
+
+    matched = joined["flow"].notna().to_numpy()
+    out = panel.assign(
+        flow_pressure=joined["flow"].fillna(0.0).to_numpy(),
+        flow_month=joined["month"].to_numpy(),
+    )
+    print(f"[amfi] joined flows for {matched.mean():.1%} of rows "
+          f"({len(uniques) - right['code'].nunique()} instruments without a mapped category)")
+    return out
@@ -3,6 +3,11 @@ import pandas as pd
 import numpy as np
 import joblib
 from pathlib import Path
+from store import load_frame, dataset_path, open_matrix, MATRIX_PATH
+from features import target_column
+from train import model_name
+import config
+import inference
 
 # -----------------------------------------------------------------------------
 # 🎨 Page configuration and custom styling
@@ -46,31 +51,116 @@ st.markdown(
 )
 
 # -----------------------------------------------------------------------------
-# 🧠 Utility loader
+# 🧠 Cached loaders (keyed on file mtime/size, so reruns only reload changed files)
 # -----------------------------------------------------------------------------
-def safe_load(path, kind="csv"):
+DATA_PATH = Path("./data/features.parquet")
+PRED_PATH = Path("./data/predictions.parquet")
+MODEL_PATH = Path("./models")
+BACKTEST_PATH = Path("./data/backtest_results.csv")
+PORTFOLIO_PATH = Path("./data/backtest_portfolio_avg.csv")
+
+FEATURE_COLS = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]
+MODELS = {"ElasticNet": "elasticnet", "LightGBM": "lgbm"}
+HORIZONS = {f"{h} week{'s' if h > 1 else ''}": h for h in config.TARGET_HORIZONS}
+MAX_POINTS = 1000  # points per line chart after downsampling
+
+
+def file_token(*paths):
+    """Cheap cache key: (mtime_ns, size) of each file, or of every file under a directory."""
+    token = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.rglob("*.parquet")) if path.is_dir() else [path]
+        for f in files:
+            if f.exists():
+                stat = f.stat()
+                token.append((str(f), stat.st_mtime_ns, stat.st_size))
+    return tuple(token)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_table(name, fallback, columns, token):
+    """Shared, read-only frame from the store (or its single-file export)."""
     try:
-        if not Path(path).exists():
-            st.warning(f"⚠️ File not found: {path}")
-            return None
-        if kind == "csv":
-            return pd.read_csv(path)
-        elif kind == "parquet":
-            return pd.read_parquet(path)
-        elif kind == "pkl":
-            return joblib.load(path)
+        return load_frame(name, fallback, columns=list(columns) if columns else None)
+    except Exception as e:
+        st.error(f"Error loading {name}: {e}")
+        return None
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_model(path, token):
+    try:
+        return inference.compile_model(joblib.load(path)) if Path(path).exists() else None
     except Exception as e:
         st.error(f"Error loading {path}: {e}")
         return None
 
 
-# -----------------------------------------------------------------------------
-# 🏗️ Load core data and models
-# -----------------------------------------------------------------------------
-DATA_PATH = Path("./data/features.parquet")
-MODEL_PATH = Path("./models")
-BACKTEST_PATH = Path("./data/backtest_results.csv")
+@st.cache_data(show_spinner=False, max_entries=8)
+def load_csv(path, token):
+    return pd.read_csv(path) if Path(path).exists() else None
+
 
+def downsample(frame, max_points=MAX_POINTS):
+    """Min/max of each bucket for every column, so peaks survive while the chart stays small."""
+    if len(frame) <= max_points:
+        return frame
+    buckets = max(1, max_points // (2 * max(1, frame.shape[1])))
+    ids = np.arange(len(frame)) * buckets // len(frame)
+    values = frame.to_numpy(dtype=float)
+    keep = {0, len(frame) - 1}
+    for j in range(values.shape[1]):
+        col = pd.Series(values[:, j]).groupby(ids)
+        keep.update(col.idxmin().dropna().astype(int))
+        keep.update(col.idxmax().dropna().astype(int))
+    return frame.iloc[sorted(keep)]
+
+
+def features_view(token, target="target"):
+    return load_table("features", str(DATA_PATH), ("Date", "index", *FEATURE_COLS, target), token)
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def prediction_view(model_key, horizon, pred_token, feat_token, model_token):
+    """
+    Chart series, correlation with its horizon's target and latest rows for one
+    model x horizon column, from precomputed predictions.
+    """
+    target, column = target_column(horizon), f"{horizon}w_fwd_predicted_return"
+    preds = load_table("predictions", str(PRED_PATH), None, pred_token)
+    if preds is None or model_key not in preds.columns:
+        # Fallback: predict once per file version, then cache
+        model = load_model(str(MODEL_PATH / f"{model_key}.pkl"), model_token)
+        if model is None or not hasattr(model, "predict"):
+            return None
+        fm = open_matrix(newer_than=[DATA_PATH]) if config.LOW_MEMORY else None
+        if fm is not None and set(FEATURE_COLS) <= set(fm.columns) and target in fm.targets:
+            # low-memory mode: straight from the shared float32 memory map, no per-session copy
+            preds = fm.meta().assign(**{target: fm.label(target)})
+            preds[model_key] = inference.predict(model, fm.features(FEATURE_COLS))
+        else:
+            feats = features_view(feat_token, target)
+            if feats is None:
+                return None
+            cols = [c for c in FEATURE_COLS if c in feats.columns]
+            preds = feats[["Date", "index", target]].copy()
+            preds[model_key] = inference.predict(model, inference.feature_matrix(feats, cols))
+
+    preds = preds.rename(columns={model_key: column})
+    chart = preds.groupby("Date")[[column]].mean()
+    corr = None
+    if target in preds.columns:
+        both = preds[[target, column]].dropna()
+        if len(both) > 1:
+            corr = float(np.corrcoef(both[target], both[column])[0, 1])
+    latest = preds[["Date", "index", column]].sort_values("Date").tail(10)
+    return {"chart": downsample(chart), "corr": corr, "latest": latest}
+
+
+# -----------------------------------------------------------------------------
+# 🏗️ Page header
+# -----------------------------------------------------------------------------
 st.title("📈 Open-Data Signals for Indian Equity Timing")
 st.markdown(
     """
@@ -84,7 +174,9 @@ st.divider()
 # -----------------------------------------------------------------------------
 # 🧩 Load feature data
 # -----------------------------------------------------------------------------
-feats = safe_load(DATA_PATH, "parquet")
+feat_token = file_token(DATA_PATH, dataset_path("features"), MATRIX_PATH)
+fm = open_matrix(newer_than=[DATA_PATH]) if config.LOW_MEMORY else None
+feats = fm.frame(rows=slice(0, 5)) if fm is not None else features_view(feat_token)
 if feats is None or feats.empty:
     st.error("❌ Feature file not found or empty. Please run `python features.py` first.")
     st.stop()
@@ -93,58 +185,47 @@ st.subheader("🧩 Feature Sample")
 st.dataframe(feats.head(), use_container_width=True)
 
 # Check missing feature columns
-required_cols = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]
-missing = [c for c in required_cols if c not in feats.columns]
+missing = [c for c in FEATURE_COLS if c not in feats.columns]
 if missing:
     st.warning(f"⚠️ Missing columns: {missing}")
-    required_cols = [c for c in required_cols if c in feats.columns]
-
-if not required_cols:
+if len(missing) == len(FEATURE_COLS):
     st.error("No usable feature columns found. Please rebuild features.")
     st.stop()
 
-X = feats[required_cols].values
-y = feats["target"].values if "target" in feats.columns else np.zeros(len(feats))
-
 # -----------------------------------------------------------------------------
 # ⚙️ Model selection
 # -----------------------------------------------------------------------------
-elastic_model = safe_load(MODEL_PATH / "elasticnet.pkl", "pkl")
-lgbm_model = safe_load(MODEL_PATH / "lgbm.pkl", "pkl")
-
-if elastic_model is None and lgbm_model is None:
+pred_token = file_token(PRED_PATH, dataset_path("predictions"))
+if not pred_token and not any((MODEL_PATH / f"{k}.pkl").exists() for k in MODELS.values()):
     st.error("⚠️ No trained models found. Please run `python train.py` first.")
     st.stop()
 
 st.sidebar.header("⚙️ Model Settings")
-model_choice = st.sidebar.selectbox("Select Model", ["ElasticNet", "LightGBM"])
-model = elastic_model if model_choice == "ElasticNet" else lgbm_model
+model_choice = st.sidebar.selectbox("Select Model", list(MODELS))
+horizon_choice = st.sidebar.selectbox("Forecast Horizon", list(HORIZONS))
+horizon = HORIZONS[horizon_choice]
+model_key = model_name(MODELS[model_choice], horizon)  # prediction column, e.g. "lgbm_4w"
 
 # -----------------------------------------------------------------------------
-# 🤖 Generate predictions
+# 🤖 Predictions (precomputed by predict.py)
 # -----------------------------------------------------------------------------
-if model is not None and hasattr(model, "predict"):
-    try:
-        preds = model.predict(X)
-        feats["1w_fwd_predicted_return"] = preds
-    except Exception as e:
-        st.error(f"Prediction failed: {e}")
-        st.stop()
+view = prediction_view(model_key, horizon, pred_token, feat_token,
+                       file_token(MODEL_PATH / f"{model_key}.pkl"))
+if view is None:
+    st.error(f"Prediction failed: no predictions or model available for {model_choice} ({horizon_choice}).")
+    st.stop()
 
-    st.subheader(f"📊 Predictions using {model_choice}")
+st.subheader(f"📊 {horizon_choice} predictions using {model_choice}")
 
-    col1, col2 = st.columns([3, 1])
-    with col1:
-        st.line_chart(feats.set_index("Date")["1w_fwd_predicted_return"].tail(50), height=250, use_container_width=True)
-    with col2:
-        if "target" in feats.columns:
-            corr = np.corrcoef(feats["target"], feats["1w_fwd_predicted_return"])[0, 1]
-            st.metric("Correlation (Pred vs Target)", f"{corr:.2f}")
+col1, col2 = st.columns([3, 1])
+with col1:
+    st.line_chart(view["chart"], height=250, use_container_width=True)
+with col2:
+    if view["corr"] is not None:
+        st.metric("Correlation (Pred vs Target)", f"{view['corr']:.2f}")
 
-    st.markdown("#### 🔍 Latest Predictions")
-    preview_cols = ["Date", "index", "1w_fwd_predicted_return"]
-    preview_cols = [c for c in preview_cols if c in feats.columns]
-    st.dataframe(feats[preview_cols].tail(10), use_container_width=True)
+st.markdown("#### 🔍 Latest Predictions")
+st.dataframe(view["latest"], use_container_width=True)
 
 # -----------------------------------------------------------------------------
 # 📉 Backtest results
@@ -152,10 +233,10 @@ if model is not None and hasattr(model, "predict"):
 st.divider()
 st.subheader("💼 Backtest Performance")
 
-backtest = safe_load("./data/backtest_portfolio_avg.csv", "csv")
+backtest = load_csv(str(PORTFOLIO_PATH), file_token(PORTFOLIO_PATH))
 if backtest is not None and not backtest.empty:
     st.line_chart(
-        backtest.set_index("Date")[["Portfolio_Smooth"]],
+        downsample(backtest.set_index("Date")[["Portfolio_Smooth"]]),
         height=300,
         use_container_width=True
     )
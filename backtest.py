@@ -1,14 +1,23 @@
 # backtest.py
+import argparse
 import pandas as pd
 import numpy as np
-import joblib
 from pathlib import Path
 from utils import load_data, save_data
+from store import load_frame, write_dataset, open_matrix
+import config
+import inference
+import telemetry
 
 FEAT_PATH = "./data/features.parquet"
+FEAT_DATASET = "features"
 MODEL_PATH = "./models/lgbm.pkl"   # adjust if you want elasticnet
+OOS_PATH = "./data/oos_predictions.parquet"  # written by train.py --walk-forward
+PRED_PATH = "./data/predictions.parquet"     # written by predict.py: one column per model x horizon
 OUT_PATH = "./data/backtest_results.csv"
 OUT_PORTFOLIO = "./data/backtest_portfolio_avg.csv"
+TOPK_OUT_PATH = "./data/topk_portfolio.csv"
+TOPK_WEIGHTS_PATH = "./data/topk_weights.parquet"
 
 # Tuneable params
 EMA_SPAN = 8                # smoothing window
@@ -19,9 +28,9 @@ TRANSACTION_COST = 0.001    # per flip cost
 # Helper: robust model prediction
 # ---------------------------------------------------------------------
 def safe_predict(model, X):
-    """Unified predict that covers sklearn estimators and LightGBM boosters."""
+    """Unified predict that covers compiled models, sklearn estimators and LightGBM boosters."""
     try:
-        return model.predict(X)
+        return inference.predict(model, X)
     except Exception as e:
         raise RuntimeError(f"Model prediction failed: {e}")
 
@@ -55,11 +64,118 @@ def build_position_for_group(df_group, upper, lower):
     return pd.Series(pos, index=df_group.index)
 
 # ---------------------------------------------------------------------
-# Core Backtest Function
+# Helper: vectorized regime engine
 # ---------------------------------------------------------------------
-def run_backtest():
-    print("[backtest] Loading features...")
-    df = load_data(FEAT_PATH)
+def group_starts(keys):
+    """Position of each row's first row within its run of equal, sorted keys."""
+    keys = np.asarray(keys)
+    pos = np.arange(len(keys))
+    new_group = np.r_[True, keys[1:] != keys[:-1]] if len(keys) else np.zeros(0, dtype=bool)
+    return np.maximum.accumulate(np.where(new_group, pos, 0))
+
+
+def regime_states(signal, upper, lower, group_start):
+    """
+    Same hysteresis as build_position_for_group (unshifted), for a flat, group-sorted
+    signal covering many instruments. Only threshold crossings can change state, so the
+    state is solved on the compressed sequence of crossings and forward-filled:
+    - a run of same-side crossings ends in that side, unless it is a single crossing
+      that only flattened an opposite position
+    - the first crossing of a run enters its side if the previous run ended neutral
+    """
+    signal = np.asarray(signal, dtype=float)
+    n = len(signal)
+    pos = np.arange(n)
+    upper = np.broadcast_to(upper, n)
+    lower = np.broadcast_to(lower, n)
+    event = np.where(signal > upper, 1, np.where(signal < lower, -1, 0)).astype(np.int8)
+
+    states = np.zeros(n, dtype=np.int8)
+    idx = np.flatnonzero(event)
+    if len(idx):
+        ev = event[idx]
+        grp = group_start[idx]
+        new_grp = np.r_[True, grp[1:] != grp[:-1]]
+        run_start = new_grp | np.r_[True, ev[1:] != ev[:-1]]
+        run_pos = np.flatnonzero(run_start)
+        run_len = np.diff(np.r_[run_pos, len(ev)])
+        run_sign = ev[run_pos]
+        first_in_grp = new_grp[run_pos]
+
+        # Consecutive single-crossing runs alternate between flattening and entering
+        single = run_len == 1
+        block_start = single & (first_in_grp | ~np.r_[False, single[:-1]])
+        r = np.arange(len(run_pos))
+        block_first = np.maximum.accumulate(np.where(block_start, r, 0))
+        parity = (r - block_first) % 2
+        ends_neutral = single & np.where(first_in_grp[block_first], parity == 1, parity == 0)
+
+        prev_neutral = first_in_grp | np.r_[True, ends_neutral[:-1]]
+        ev_state = ev.copy()
+        ev_state[run_pos] = np.where(prev_neutral, run_sign, 0)
+        states[idx] = ev_state
+
+    # Hold state between crossings; every group starts neutral
+    src = np.maximum.accumulate(np.where((event != 0) | (pos == group_start), pos, 0))
+    return states[src]
+
+
+def regime_step(state, signal, upper, lower):
+    """One more week of build_position_for_group's hysteresis for many instruments at once."""
+    state = np.asarray(state)
+    up, down = signal > upper, signal < lower
+    entered = np.where(up, 1, np.where(down, -1, 0))
+    flattened = ((state == 1) & down) | ((state == -1) & up)
+    return np.where(state == 0, entered, np.where(flattened, 0, state)).astype(np.int8)
+
+
+def shift_positions(states, group_start):
+    """Trade on the previous period's state: shift(1) within group, first row flat."""
+    positions = np.zeros(len(states), dtype=np.int64)
+    positions[1:] = states[:-1]
+    positions[np.arange(len(states)) == group_start] = 0
+    return positions
+
+
+def build_positions(signal, upper, lower):
+    """
+    Shifted long/short/neutral positions for a (dates x instruments) signal matrix,
+    with scalar or per-instrument thresholds. Leading/trailing NaN padding holds state.
+    """
+    signal = np.asarray(signal, dtype=float)
+    n_dates, n_inst = signal.shape
+    group_start = np.repeat(np.arange(n_inst) * n_dates, n_dates)
+    upper = np.repeat(np.broadcast_to(upper, n_inst), n_dates)
+    lower = np.repeat(np.broadcast_to(lower, n_inst), n_dates)
+    states = regime_states(signal.ravel(order="F"), upper, lower, group_start)
+    return shift_positions(states, group_start).reshape((n_dates, n_inst), order="F")
+
+# ---------------------------------------------------------------------
+# Building blocks (shared by run_backtest and sweep.py)
+# ---------------------------------------------------------------------
+FEATURE_COLS = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]
+PERIODS_PER_YEAR = 52
+
+
+def load_backtest_frame():
+    """
+    Rows sorted by (index, Date) with complete features, the feature list and the
+    contiguous feature matrix X. In low-memory mode, when the memory-mapped float32
+    matrix is current, X is a read-only view of it and the frame only carries the
+    columns the simulation reads.
+    """
+    fm = open_matrix(newer_than=[FEAT_PATH]) if config.LOW_MEMORY else None
+    if fm is not None and set(FEATURE_COLS) <= set(fm.columns):
+        X = fm.features(FEATURE_COLS)
+        df = fm.meta()
+        for c in ("r_1w", "vol_4w"):
+            df[c] = fm.column(c)
+        complete = ~np.isnan(X).any(axis=1)
+        if not complete.all():
+            df, X = df[complete].reset_index(drop=True), X[complete]
+        return df, list(FEATURE_COLS), X
+
+    df = load_frame(FEAT_DATASET, FEAT_PATH, columns=["Date", "index", *FEATURE_COLS])
     if df is None:
         raise FileNotFoundError(f"❌ features not found at {FEAT_PATH}")
 
@@ -68,58 +184,249 @@ def run_backtest():
     df = df.dropna(subset=["Date"]).sort_values(["index", "Date"]).reset_index(drop=True)
 
     # Feature selection
-    feature_cols = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]
-    available_feats = [c for c in feature_cols if c in df.columns]
+    available_feats = [c for c in FEATURE_COLS if c in df.columns]
     if not available_feats:
         raise ValueError("❌ No feature columns available for prediction")
+    if "r_1w" not in df.columns:
+        raise ValueError("❌ Missing r_1w (weekly return) column.")
 
     df = df.dropna(subset=available_feats).reset_index(drop=True)
+    return df, available_feats, inference.feature_matrix(df, available_feats)
 
-    # Load model
-    model_path = Path(MODEL_PATH)
-    if not model_path.exists():
-        raise FileNotFoundError(f"❌ Model file not found: {MODEL_PATH}")
-    model = joblib.load(model_path)
-    if isinstance(model, dict):
-        model = model.get("model", model)
 
-    print("[backtest] Running model predictions...")
-    X = df[available_feats].values
+def predict_returns(X, model_path=MODEL_PATH):
+    model = inference.load_model(model_path)  # loaded and compiled once per file version
     preds = safe_predict(model, X)
-    preds = np.asarray(preds).reshape(-1)
-    df["predicted_return"] = preds
+    return np.asarray(preds).reshape(-1)
+
+
+def attach_oos_predictions(df, model_name, path=OOS_PATH):
+    """Use walk-forward predictions instead of in-sample ones; keeps only rows that have one."""
+    oos = load_data(path, columns=["Date", "index", model_name])
+    if oos is None:
+        raise FileNotFoundError(f"❌ Out-of-sample predictions not found: {path}. Run train.py --walk-forward.")
+    oos["Date"] = pd.to_datetime(oos["Date"])
+    oos = oos.rename(columns={model_name: "predicted_return"})
+    df = df.merge(oos, on=["Date", "index"], how="inner")
+    return df.sort_values(["index", "Date"]).reset_index(drop=True)
+
+
+def attach_predictions(df, column, path=PRED_PATH):
+    """Trade on one scored column of the predictions table (e.g. lgbm_4w); keeps rows that have it."""
+    preds = load_frame("predictions", path, columns=["Date", "index", column])
+    if preds is None or column not in preds.columns:
+        raise FileNotFoundError(f"❌ Prediction column {column!r} not found in {path}. Run predict.py.")
+    preds = preds.assign(Date=pd.to_datetime(preds["Date"]), index=preds["index"].astype(str))
+    preds = preds.rename(columns={column: "predicted_return"}).dropna(subset=["predicted_return"])
+    df = df.assign(index=df["index"].astype(str)).merge(preds, on=["Date", "index"], how="inner")
+    return df.sort_values(["index", "Date"]).reset_index(drop=True)
+
+
+def simulate(group, r_1w, predicted, ema_span=EMA_SPAN,
+             threshold_scale=THRESHOLD_SCALE, transaction_cost=TRANSACTION_COST):
+    """
+    Strategy arrays for rows sorted by `group` (one key per instrument).
+    Returns signal_smooth, position, turnover, strategy_return and Portfolio_Value.
+    """
+    group = np.asarray(group)
+    r_1w = np.asarray(r_1w, dtype=float)
 
     # Smoothed signal
-    df["signal_smooth"] = df.groupby("index")["predicted_return"].transform(
-        lambda s: s.ewm(span=EMA_SPAN, adjust=False).mean()
+    signal = (
+        pd.Series(predicted).groupby(group, sort=False)
+        .ewm(span=ema_span, adjust=False).mean().to_numpy()
     )
 
-    # Position building
-    df["position"] = 0
-    for name, group in df.groupby("index"):
-        s = group["signal_smooth"]
-        std = s.std(ddof=0)
-        threshold = THRESHOLD_SCALE * (std if np.isfinite(std) and std > 0 else 1e-6)
-        upper, lower = threshold, -threshold
-        pos_series = build_position_for_group(group, upper, lower)
-        df.loc[group.index, "position"] = pos_series.shift(1).fillna(0).astype(int)
+    # Position building (all indices at once)
+    std = pd.Series(signal).groupby(group, sort=False).transform("std", ddof=0).to_numpy()
+    threshold = threshold_scale * np.where(np.isfinite(std) & (std > 0), std, 1e-6)
+    group_start = group_starts(group)
+    position = shift_positions(regime_states(signal, threshold, -threshold, group_start), group_start)
 
     # Strategy returns + cost
-    if "r_1w" not in df.columns:
-        raise ValueError("❌ Missing r_1w (weekly return) column.")
-    df["turnover"] = df.groupby("index")["position"].diff().abs().fillna(0)
-    df["strategy_return"] = df["position"] * df["r_1w"] - TRANSACTION_COST * df["turnover"]
+    turnover = np.zeros(len(position))
+    turnover[1:] = np.abs(np.diff(position))
+    turnover[np.arange(len(position)) == group_start] = 0.0
+    strategy_return = position * r_1w - transaction_cost * turnover
 
     # Portfolio compounding per index
-    df["Portfolio_Value"] = df.groupby("index")["strategy_return"].transform(
-        lambda s: (1 + s).cumprod().fillna(1.0)
-    )
-    df["buy_hold"] = df.groupby("index")["r_1w"].transform(
+    value = pd.Series(1 + strategy_return).groupby(group, sort=False).cumprod().fillna(1.0)
+    return {
+        "signal_smooth": signal,
+        "position": position,
+        "turnover": turnover,
+        "strategy_return": strategy_return,
+        "Portfolio_Value": value.to_numpy(),
+    }
+
+
+def summarize(dates, portfolio_value, turnover):
+    """Final value, annualised Sharpe, max drawdown and mean turnover of the equal-weight portfolio."""
+    avg = pd.Series(portfolio_value).groupby(np.asarray(dates)).mean()
+    rets = avg.pct_change().dropna()
+    vol = rets.std()
+    sharpe = rets.mean() / vol * np.sqrt(PERIODS_PER_YEAR) if vol > 0 else np.nan
+    drawdown = avg / np.maximum.accumulate(avg) - 1
+    return {
+        "final_value": avg.iloc[-1],
+        "sharpe": sharpe,
+        "max_drawdown": drawdown.min(),
+        "turnover": float(np.mean(turnover)),
+    }
+
+# ---------------------------------------------------------------------
+# Cross-sectional Top-K engine
+# ---------------------------------------------------------------------
+WEIGHTINGS = ["equal", "score", "inverse_vol"]
+
+
+def dense_matrices(df, cols):
+    """(dates, instruments, {col: dates x instruments matrix}) from one row per (Date, index)."""
+    when, dates = pd.factorize(df["Date"], sort=True)
+    inst, instruments = pd.factorize(df["index"], sort=True)
+    matrices = {}
+    for c in cols:
+        mat = np.full((len(dates), len(instruments)), np.nan)
+        mat[when, inst] = df[c].to_numpy(dtype=float)
+        matrices[c] = mat
+    return dates.to_numpy(), np.asarray(instruments.astype(str), dtype=object), matrices
+
+
+def top_k_weights(scores, k, weighting="equal", vol=None):
+    """
+    Long-only target weights for a (dates x instruments) score matrix: each row holds
+    its k highest finite scores (fewer when fewer instruments have a score) with
+    weights summing to 1. "score" weights by the positive part of the score and
+    "inverse_vol" by 1 / vol; a row where that gives no weight falls back to equal.
+    """
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f"Unknown weighting {weighting!r}; choose from {WEIGHTINGS}")
+    scores = np.asarray(scores, dtype=float)
+    n_dates, n_inst = scores.shape
+    valid = np.isfinite(scores)
+    held = valid.copy()
+    k = int(k)
+    if k <= 0:
+        held[:] = False
+    elif k < n_inst:
+        ranked = np.where(valid, scores, -np.inf)
+        top = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+        held[:] = False
+        np.put_along_axis(held, top, True, axis=1)
+        held &= valid
+
+    if weighting == "score":
+        raw = np.where(held, np.clip(scores, 0, None), 0.0)
+    elif weighting == "inverse_vol":
+        vol = np.asarray(vol, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            raw = np.where(held & (vol > 0), 1.0 / vol, 0.0)
+    else:
+        raw = held.astype(float)
+    raw = np.where((raw.sum(axis=1) > 0)[:, None], raw, held)
+    total = raw.sum(axis=1, keepdims=True)
+    return np.divide(raw, total, out=np.zeros_like(raw), where=total > 0)
+
+
+def rebalance(weights, returns, cost_bps=config.TRANSACTION_COST_BPS):
+    """
+    Trade to each week's target weights at the close and hold them over the next
+    week's returns (the same one-period lag as shift_positions). Costs are charged in
+    bps on the weight actually traded: the target minus the previous weights after
+    they drifted with that week's returns. Missing returns count as flat.
+    Returns per-date arrays gross_return, turnover, cost, net_return, Portfolio_Value.
+    """
+    weights = np.asarray(weights, dtype=float)
+    returns = np.nan_to_num(np.asarray(returns, dtype=float), nan=0.0)
+    held = np.zeros_like(weights)
+    held[1:] = weights[:-1]
+
+    gross = (held * returns).sum(axis=1)
+    growth = 1.0 + gross
+    drifted = held * (1.0 + returns)
+    drifted = np.divide(drifted, growth[:, None], out=np.zeros_like(drifted), where=growth[:, None] > 0)
+    turnover = np.abs(weights - drifted).sum(axis=1)
+    cost = turnover * cost_bps / 1e4
+    net = (1.0 + gross) * (1.0 - cost) - 1.0
+    return {
+        "gross_return": gross,
+        "turnover": turnover,
+        "cost": cost,
+        "net_return": net,
+        "Portfolio_Value": np.cumprod(1.0 + net),
+    }
+
+
+@telemetry.instrument("topk_backtest")
+def run_topk_backtest(use_oos=False, k=None, weighting=None, cost_bps=None, signal=None):
+    """
+    Rank instruments by predicted return each week and hold the top K (config.TOP_K).
+    `signal` ranks on a column of the predictions table instead of MODEL_PATH.
+    """
+    k = config.TOP_K if k is None else k
+    weighting = weighting or config.TOP_K_WEIGHTING
+    cost_bps = config.TRANSACTION_COST_BPS if cost_bps is None else cost_bps
+
+    print("[backtest] Loading features...")
+    df, available_feats, X = load_backtest_frame()
+    if use_oos:
+        print("[backtest] Using walk-forward out-of-sample predictions...")
+        df = attach_oos_predictions(df, Path(MODEL_PATH).stem)
+    elif signal:
+        print(f"[backtest] Using scored predictions: {signal}")
+        df = attach_predictions(df, signal)
+    else:
+        print("[backtest] Running model predictions...")
+        df["predicted_return"] = predict_returns(X, MODEL_PATH)
+
+    cols = ["predicted_return", "r_1w"] + (["vol_4w"] if weighting == "inverse_vol" else [])
+    dates, instruments, m = dense_matrices(df, cols)
+    print(f"[backtest] Top-{k} {weighting}-weighted portfolio over {len(instruments)} instruments "
+          f"x {len(dates)} weeks, {cost_bps} bps costs")
+    weights = top_k_weights(m["predicted_return"], k, weighting, m.get("vol_4w"))
+    res = rebalance(weights, m["r_1w"], cost_bps)
+
+    portfolio = pd.DataFrame({"Date": dates, "holdings": (weights > 0).sum(axis=1), **res})
+    save_data(portfolio, TOPK_OUT_PATH)
+    d, i = np.nonzero(weights)
+    save_data(pd.DataFrame({"Date": dates[d], "index": instruments[i], "weight": weights[d, i]}),
+              TOPK_WEIGHTS_PATH)
+    stats = summarize(dates, res["Portfolio_Value"], res["turnover"])
+    print(f"[backtest] ✅ Saved Top-K portfolio → {TOPK_OUT_PATH}, weights → {TOPK_WEIGHTS_PATH}")
+    print(f"[backtest] Final value {stats['final_value']:.3f}, Sharpe {stats['sharpe']:.2f}, "
+          f"max drawdown {stats['max_drawdown']:.1%}, mean turnover {stats['turnover']:.3f}")
+    return portfolio
+
+# ---------------------------------------------------------------------
+# Core Backtest Function
+# ---------------------------------------------------------------------
+@telemetry.instrument("backtest")
+def run_backtest(use_oos=False, signal=None):
+    print("[backtest] Loading features...")
+    df, available_feats, X = load_backtest_frame()
+
+    if use_oos:
+        print("[backtest] Using walk-forward out-of-sample predictions...")
+        df = attach_oos_predictions(df, Path(MODEL_PATH).stem)
+    elif signal:
+        print(f"[backtest] Using scored predictions: {signal}")
+        df = attach_predictions(df, signal)
+    else:
+        print("[backtest] Running model predictions...")
+        with telemetry.span("predict"):
+            df["predicted_return"] = predict_returns(X, MODEL_PATH)
+
+    with telemetry.span("simulate"):
+        sim = simulate(df["index"].to_numpy(), df["r_1w"].to_numpy(), df["predicted_return"].to_numpy())
+    for name, values in sim.items():
+        df[name] = values
+
+    df["buy_hold"] = df.groupby("index", observed=True)["r_1w"].transform(
         lambda s: (1 + s).cumprod().fillna(1.0)
     )
 
     # Rolling high-watermark (removes sawtooth)
-    df["Portfolio_Smooth"] = df.groupby("index")["Portfolio_Value"].transform(
+    df["Portfolio_Smooth"] = df.groupby("index", observed=True)["Portfolio_Value"].transform(
         lambda x: np.maximum.accumulate(x)
     )
 
@@ -139,14 +446,30 @@ def run_backtest():
         "turnover", "strategy_return", "Portfolio_Value", "Portfolio_Smooth", "buy_hold"
     ]
     save_data(df[out_cols], OUT_PATH)
+    write_dataset(df[out_cols], "backtest_results")
     print(f"[backtest] ✅ Saved detailed results → {OUT_PATH}")
 
     # Summary
-    final_vals = df.groupby("index")["Portfolio_Value"].last()
+    final_vals = df.groupby("index", observed=True)["Portfolio_Value"].last()
     print("\n[backtest] 📊 Final Portfolio Value per Index:")
     print(final_vals.round(3))
     print(f"\n[backtest] Overall Average Final Portfolio: {agg['Portfolio_Avg'].iloc[-1]:.2f}")
 
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
-    run_backtest()
+    parser = argparse.ArgumentParser(description="Backtest the model signal.")
+    parser.add_argument("--oos", action="store_true",
+                        help="trade on walk-forward predictions from train.py --walk-forward")
+    parser.add_argument("--top-k", type=int, nargs="?", const=config.TOP_K, default=None, metavar="K",
+                        help="cross-sectional mode: hold the K best-ranked instruments (default config.TOP_K)")
+    parser.add_argument("--weighting", choices=WEIGHTINGS, default=None,
+                        help="Top-K weighting (default config.TOP_K_WEIGHTING)")
+    parser.add_argument("--cost-bps", type=float, default=None,
+                        help="Top-K cost per unit of traded weight (default config.TRANSACTION_COST_BPS)")
+    parser.add_argument("--signal", default=None, metavar="COLUMN",
+                        help="trade on a column of predict.py's table (e.g. lgbm_4w) instead of MODEL_PATH")
+    args = parser.parse_args()
+    if args.top_k is not None:
+        run_topk_backtest(args.oos, args.top_k, args.weighting, args.cost_bps, args.signal)
+    else:
+        run_backtest(use_oos=args.oos, signal=args.signal)
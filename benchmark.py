@@ -0,0 +1,355 @@
+# benchmark.py
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from telemetry import PeakRSS
+from backtest import build_position_for_group, build_positions, THRESHOLD_SCALE
+
+# ---------------------------------------------------------------------
+# Helper: timing
+# ---------------------------------------------------------------------
+def timed(fn, *args, repeat=1, **kwargs):
+    """Best wall time over `repeat` runs, plus the last result."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+# ---------------------------------------------------------------------
+# Position builder: per-index loop vs vectorized regime engine
+# ---------------------------------------------------------------------
+def synthetic_signal(n_instruments, n_weeks, seed=42):
+    """EMA-smoothed noise, so signals cross thresholds in realistic runs."""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, 0.02, size=(n_weeks, n_instruments))
+    return pd.DataFrame(noise).ewm(span=8, adjust=False).mean().to_numpy()
+
+
+def positions_reference(signal, upper, lower):
+    out = np.zeros(signal.shape, dtype=np.int64)
+    for j in range(signal.shape[1]):
+        group = pd.DataFrame({"signal_smooth": signal[:, j]})
+        pos_series = build_position_for_group(group, upper[j], lower[j])
+        out[:, j] = pos_series.shift(1).fillna(0).astype(int).to_numpy()
+    return out
+
+
+def bench_positions(n_instruments=1000, n_weeks=1040):
+    signal = synthetic_signal(n_instruments, n_weeks)
+    threshold = THRESHOLD_SCALE * signal.std(axis=0)
+    upper, lower = threshold, -threshold
+
+    t_ref, ref = timed(positions_reference, signal, upper, lower)
+    t_vec, vec = timed(build_positions, signal, upper, lower, repeat=3)
+    if not np.array_equal(ref, vec):
+        raise AssertionError("vectorized positions differ from build_position_for_group")
+
+    print(f"[benchmark] positions {n_instruments} instruments x {n_weeks} weeks")
+    print(f"[benchmark]   loop       {t_ref:8.3f}s")
+    print(f"[benchmark]   vectorized {t_vec:8.3f}s  ({t_ref / t_vec:.0f}x, identical)")
+    return {"reference_s": t_ref, "vectorized_s": t_vec}
+
+
+# ---------------------------------------------------------------------
+# Inference: Booster.predict / ElasticNet.predict vs inference.py
+# ---------------------------------------------------------------------
+def bench_inference(n_instruments=1000, n_weeks=520, workers=4, seed=42):
+    """Latency on one week of rows and throughput on the full history, float32 features."""
+    import inference
+    from train import train_elastic, train_lgb
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 0.03, size=(n_instruments * n_weeks, 5)).astype(np.float32)
+    y = X @ np.array([0.5, 0.2, -0.3, 0.1, 0.0]) + 0.01 * np.sin(50 * X[:, 1]) + rng.normal(0, 0.01, len(X))
+    with contextlib.redirect_stdout(io.StringIO()):
+        booster = train_lgb(X, y)
+        elastic = train_elastic(X, y)
+    flat = inference.compile_model(booster, tree_engine="flat")
+    linear = inference.compile_model(elastic)
+    week = X[-n_instruments:]
+
+    cases = [
+        ("Booster.predict", booster.predict),
+        ("flat trees", lambda A: inference.predict(flat, A)),
+        (f"flat trees x{workers}", lambda A: inference.predict(flat, A, workers=workers)),
+        ("ElasticNet.predict", elastic.predict),
+        ("coefficient matmul", lambda A: inference.predict(linear, A)),
+    ]
+    print(f"[benchmark] inference {n_instruments} instruments x {n_weeks} weeks, "
+          f"{flat.n_trees} trees (max depth {flat.depth})")
+    results = {}
+    for name, fn in cases:
+        t_week, _ = timed(fn, week, repeat=20)
+        t_full, pred = timed(fn, X, repeat=3)
+        ref = booster.predict(X) if "tree" in name or "Booster" in name else elastic.predict(X)
+        diff = float(np.max(np.abs(pred - ref)))
+        results[name] = {"week_ms": t_week * 1e3, "rows_per_s": len(X) / t_full, "max_abs_diff": diff}
+        print(f"[benchmark]   {name:<20} week {t_week * 1e3:8.2f} ms   "
+              f"history {len(X) / t_full / 1e6:7.2f} M rows/s   max diff {diff:.1e}")
+    return results
+
+
+# ---------------------------------------------------------------------
+# Synthetic universe
+# ---------------------------------------------------------------------
+SIZE_LADDER = [4, 100, 5000]
+DEFAULT_WEEKS = 520
+REGRESSION_RATIO = 1.25  # flag stages this much slower than the baseline file
+
+
+def synthetic_universe(n_instruments, n_weeks, missing_rate=0.0, seed=42):
+    """
+    Deterministic weekly prices (geometric random walks) for n_instruments, with a
+    fraction missing_rate of rows dropped at random, plus matching monthly AMFI flows.
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array([f"SYN{i:05d}" for i in range(n_instruments)])
+    dates = pd.date_range(end="2025-12-26", periods=n_weeks, freq="W-FRI")
+
+    log_ret = rng.normal(0.001, 0.02, size=(n_weeks, n_instruments))
+    prices = 100 * np.exp(np.cumsum(log_ret, axis=0))
+    idx = pd.DataFrame({
+        "Date": np.repeat(dates.values, n_instruments),
+        "index": np.tile(names, n_weeks),
+        "price": prices.ravel(),
+    })
+    if missing_rate > 0:
+        idx = idx[rng.random(len(idx)) >= missing_rate]
+
+    months = pd.date_range(dates[0], dates[-1], freq="ME")
+    amfi = pd.DataFrame({
+        "Date": np.repeat(months.values, n_instruments),
+        "category": np.tile(names, len(months)),
+        "flow": rng.uniform(-100, 100, len(months) * n_instruments),
+    })
+    return idx.sort_values(["index", "Date"]).reset_index(drop=True), amfi
+
+# ---------------------------------------------------------------------
+# Stage benchmarks
+# ---------------------------------------------------------------------
+def measure(fn):
+    """
+    Wall time, CPU time and peak process RSS of one call. RSS comes from telemetry's
+    sampler thread: tracemalloc hooks crash alongside LightGBM's OpenMP threads.
+    """
+    with PeakRSS() as rss:
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = fn()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return {"seconds": round(wall, 4), "cpu_seconds": round(cpu, 4), "peak_mb": round(rss.peak_rss_mb, 2)}, result
+
+
+def bench_pipeline(n_instruments, n_weeks, missing_rate=0.0, seed=42, verbose=False, low_memory=False):
+    """Run build_dataset → build_features → train.main → run_backtest in a scratch directory."""
+    import config, data_pipeline, features, train, backtest
+
+    idx, amfi = synthetic_universe(n_instruments, n_weeks, missing_rate, seed)
+    results = []
+    cwd, saved_mode = os.getcwd(), config.LOW_MEMORY
+    config.LOW_MEMORY = low_memory
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            Path("data").mkdir()
+            idx.to_csv("data/index_prices.csv", index=False)
+            amfi.to_csv("data/amfi_flows.csv", index=False)
+            out = sys.stdout if verbose else io.StringIO()
+
+            def feature_stage():
+                feats = features.build_features(features.load_panel())
+                features.save_features(feats)
+                return feats
+
+            stages = [
+                ("build_dataset", data_pipeline.build_dataset, lambda r: len(pd.read_parquet("data/weekly_panel.parquet"))),
+                ("build_features", feature_stage, len),
+                ("train", train.main, lambda r: None),
+                ("run_backtest", backtest.run_backtest, lambda r: len(pd.read_csv("data/backtest_results.csv"))),
+            ]
+            for name, fn, count in stages:
+                with contextlib.redirect_stdout(out):
+                    stats, result = measure(fn)
+                    rows = count(result)
+                results.append({"instruments": n_instruments, "weeks": n_weeks, "missing_rate": missing_rate,
+                                "low_memory": low_memory, "stage": name, "rows": rows, **stats})
+                print(f"[benchmark] {n_instruments:>6} x {n_weeks} {name:<15} "
+                      f"{stats['seconds']:8.3f}s  cpu {stats['cpu_seconds']:8.3f}s  peak {stats['peak_mb']:9.1f} MB")
+        finally:
+            os.chdir(cwd)
+            config.LOW_MEMORY = saved_mode
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path, ratio=REGRESSION_RATIO):
+    """Print time/memory ratios against a previous results file; returns the regressions."""
+    baseline = json.loads(Path(baseline_path).read_text())
+    key = lambda r: (r["instruments"], r["weeks"], r["missing_rate"], r.get("low_memory", False), r["stage"])
+    before = {key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n[benchmark] vs {baseline_path} (commit {baseline.get('commit')})")
+    for r in results:
+        old = before.get(key(r))
+        if old is None:
+            continue
+        t = r["seconds"] / max(old["seconds"], 1e-9)
+        m = r["peak_mb"] / max(old["peak_mb"], 1e-9)
+        flag = "  ⚠️ regression" if t > ratio or m > ratio else ""
+        print(f"[benchmark] {r['instruments']:>6} {r['stage']:<15} time x{t:5.2f}  memory x{m:5.2f}{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+
+def run_suite(sizes=SIZE_LADDER, weeks=DEFAULT_WEEKS, missing_rate=0.0, out_path=None,
+              baseline_path=None, verbose=False, low_memory=False):
+    results = []
+    for n in sizes:
+        results.extend(bench_pipeline(n, weeks, missing_rate, verbose=verbose, low_memory=low_memory))
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    if out_path:
+        Path(out_path).write_text(json.dumps(report, indent=2))
+        print(f"[benchmark] ✅ Saved results → {out_path}")
+    regressions = compare(results, baseline_path) if baseline_path else []
+    return report, regressions
+
+
+# ---------------------------------------------------------------------
+# Startup: launch time of the entry points
+# ---------------------------------------------------------------------
+ROOT = Path(__file__).resolve().parent
+HEAVY_MODULES = ["numpy", "pandas", "pyarrow", "joblib", "sklearn", "lightgbm"]
+STARTUP_COMMANDS = [
+    ("interpreter", ["-c", "pass"]),
+    ("cli --help", ["cli.py", "--help"]),
+    ("run --help", ["run.py", "--help"]),
+    ("train --help", ["train.py", "--help"]),
+    ("features --help", ["features.py", "--help"]),
+    ("backtest --help", ["backtest.py", "--help"]),
+    # single-stage runs on the synthetic fallback data, in a scratch directory
+    ("stage dataset", ["run.py", "--stages", "dataset", "--force", "--no-app"]),
+    ("stage features", ["run.py", "--stages", "features", "--force", "--no-app"]),
+    ("stage dataset.py", ["data_pipeline.py"]),
+    ("stage features.py", ["features.py"]),
+]
+
+
+def _launch(args, root, cwd, importtime=False):
+    cmd = [sys.executable, *[str(root / a) if a.endswith(".py") else a for a in args]]
+    env = dict(os.environ, PYTHONPROFILEIMPORTTIME="1") if importtime else None
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, proc
+
+
+def bench_startup(repeat=5, root=ROOT, commands=STARTUP_COMMANDS):
+    """
+    Median wall time of launching each command in a fresh interpreter, plus the heavy
+    libraries it imported (from -X importtime). Commands that fail in `root`, e.g. an
+    older checkout without them, are reported and skipped.
+    """
+    root = Path(root).resolve()
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, args in commands:
+            cwd = tmp if name.startswith("stage") else root
+            _, proc = _launch(args, root, cwd, importtime=True)
+            if proc.returncode != 0:
+                print(f"[benchmark]   {name:<18} failed (exit {proc.returncode}), skipped")
+                continue
+            loaded = {line.rsplit("|", 1)[-1].strip() for line in proc.stderr.splitlines()
+                      if line.startswith("import time:")}
+            heavy = [m for m in HEAVY_MODULES if m in loaded]
+            times = [_launch(args, root, cwd)[0] for _ in range(repeat)]
+            results.append({"command": name, "seconds": round(float(np.median(times)), 4),
+                            "min_seconds": round(min(times), 4), "imports": heavy})
+            print(f"[benchmark]   {name:<18} {np.median(times):7.3f}s  (min {min(times):.3f}s)  "
+                  f"imports {', '.join(heavy) or '-'}")
+    return results
+
+
+def compare_startup(results, baseline_path):
+    baseline = json.loads(Path(baseline_path).read_text())
+    before = {r["command"]: r for r in baseline["results"]}
+    print(f"\n[benchmark] vs {baseline_path} (commit {baseline.get('commit')})")
+    for r in results:
+        old = before.get(r["command"])
+        if old is not None:
+            print(f"[benchmark]   {r['command']:<18} {old['seconds']:7.3f}s → {r['seconds']:7.3f}s  "
+                  f"(x{old['seconds'] / max(r['seconds'], 1e-9):.2f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pipeline kernels and stages.")
+    sub = parser.add_subparsers(dest="command")
+
+    pos = sub.add_parser("positions", help="per-index loop vs vectorized position builder")
+    pos.add_argument("--instruments", type=int, default=1000)
+    pos.add_argument("--weeks", type=int, default=1040, help="default: 20 years")
+
+    inf = sub.add_parser("inference", help="Booster/ElasticNet predict vs the inference module")
+    inf.add_argument("--instruments", type=int, default=1000)
+    inf.add_argument("--weeks", type=int, default=520)
+    inf.add_argument("--workers", type=int, default=4)
+
+    pipe = sub.add_parser("pipeline", help="time and memory of each stage over a size ladder")
+    pipe.add_argument("--sizes", type=int, nargs="+", default=SIZE_LADDER)
+    pipe.add_argument("--weeks", type=int, default=DEFAULT_WEEKS)
+    pipe.add_argument("--missing-rate", type=float, default=0.0)
+    pipe.add_argument("--out", default="benchmark_results.json")
+    pipe.add_argument("--compare", default=None, help="previous results JSON to compare against")
+    pipe.add_argument("--verbose", action="store_true", help="show stage output")
+    pipe.add_argument("--low-memory", action="store_true", help="run the stages in low-memory mode")
+
+    start = sub.add_parser("startup", help="launch time of --help and single-stage runs")
+    start.add_argument("--repeat", type=int, default=5)
+    start.add_argument("--root", default=str(ROOT), help="checkout whose entry points are timed")
+    start.add_argument("--out", default=None, help="save results JSON")
+    start.add_argument("--compare", default=None, help="previous startup results JSON")
+
+    args = parser.parse_args()
+    if args.command == "startup":
+        print(f"[benchmark] startup of {Path(args.root).resolve()} (median of {args.repeat})")
+        results = bench_startup(args.repeat, args.root)
+        if args.out:
+            Path(args.out).write_text(json.dumps({"commit": git_commit(), "python": platform.python_version(),
+                                                  "results": results}, indent=2))
+            print(f"[benchmark] ✅ Saved results → {args.out}")
+        if args.compare:
+            compare_startup(results, args.compare)
+    elif args.command == "pipeline":
+        _, regressions = run_suite(args.sizes, args.weeks, args.missing_rate, args.out,
+                                   args.compare, args.verbose, args.low_memory)
+        sys.exit(1 if regressions else 0)
+    elif args.command == "inference":
+        bench_inference(args.instruments, args.weeks, args.workers)
+    else:
+        bench_positions(getattr(args, "instruments", 1000), getattr(args, "weeks", 1040))
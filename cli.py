@@ -0,0 +1,57 @@
+# cli.py
+import sys
+import runpy
+import argparse
+import subprocess
+
+# command -> (module run as __main__, summary). Nothing here imports pandas or the
+# model libraries: a command's module, and only its own imports, load when it runs.
+COMMANDS = {
+    "run": ("run", "whole pipeline through the cached runner (--stages for a subset)"),
+    "dataset": ("data_pipeline", "build the weekly panel"),
+    "vix": ("vix", "update the weekly India VIX series"),
+    "features": ("features", "build or incrementally update the feature table"),
+    "train": ("train", "fit ElasticNet and LightGBM (--walk-forward for folds)"),
+    "tune": ("tune", "hyperparameter search"),
+    "predict": ("predict", "score every trained model"),
+    "backtest": ("backtest", "regime backtest (--top-k for the cross-sectional portfolio)"),
+    "sweep": ("sweep", "backtest parameter grid"),
+    "robustness": ("robustness", "bootstrap and signal-noise robustness of the backtest"),
+    "serve": ("serve", "local scoring daemon"),
+    "fetch": ("fetch_yahoo_indices", "download index prices"),
+    "benchmark": ("benchmark", "kernel, pipeline, inference and startup benchmarks"),
+    "app": (None, "launch the Streamlit dashboard"),
+}
+
+
+def build_parser():
+    width = max(map(len, COMMANDS))
+    listing = "\n".join(f"  {name:<{width}}  {summary}" for name, (_, summary) in COMMANDS.items())
+    parser = argparse.ArgumentParser(
+        prog="cli.py",
+        description="Open-Data Signals: every stage and tool from one command, in one process.",
+        epilog=f"commands:\n{listing}\n\n`cli.py <command> --help` shows a command's options.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        usage="%(prog)s <command> [options]",
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser()
+    if not argv or argv[0].startswith("-"):
+        parser.parse_args(argv[:1] or ["--help"])  # --help, or a usage error
+    command, rest = parser.parse_args(argv[:1]).command, argv[1:]
+
+    module = COMMANDS[command][0]
+    if module is None:
+        sys.exit(subprocess.run(["streamlit", "run", "app.py", *rest]).returncode)
+    # Same as `python <module>.py <rest>`, without starting another interpreter
+    sys.argv = [f"{module}.py", *rest]
+    runpy.run_module(module, run_name="__main__", alter_sys=True)
+
+
+if __name__ == "__main__":
+    main()
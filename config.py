@@ -1,10 +1,19 @@
 # config.py
 DATA_DIR = "./data"
 AMFI_FILE = f"{DATA_DIR}/amfi_flows.csv"            # (optional) monthly flows
-INDEX_PRICES_FILE = f"{DATA_DIR}/index_prices.csv"  # daily index prices (Date,index1,index2,...)
+AMFI_CATEGORY_MAP = None        # {AMFI category: instrument or [instruments]}; None = same names
+AMFI_PUBLICATION_LAG_DAYS = 10  # days after month-end a month's flows are public (if no published column)
+INDEX_PRICES_FILE = f"{DATA_DIR}/index_prices.csv"  # daily (or finer) prices: Date,index,price or Date,<index1>,<index2>,...
 VIX_FILE = f"/mnt/data/INDIA VIX_minute.csv"        # file you uploaded — pipeline tries to use it
 PUBLICATION_TIME = "15:30"  # 3:30 PM IST cut-off for weekly features
 RANDOM_SEED = 42
 WEEKDAY_CUTOFF = "FRIDAY"  # canonical weekly decision moment
 TOP_K = 3
+TARGET_HORIZONS = [1, 4, 12]  # forward-return targets (weeks); 1 = "target", else "target_<h>w"
 TRANSACTION_COST_BPS = 20  # 20 bps default
+TOP_K_WEIGHTING = "equal"  # Top-K weights: "equal", "score" or "inverse_vol"
+UNIVERSE = None  # instrument names to keep (list); None = every instrument in the data
+SYNTHETIC_UNIVERSE = ["Momentum", "Quality", "Value", "SmallCap"]  # used when no data files exist
+LOW_MEMORY = False     # float32 features, in-place transforms, intermediates freed early
+MODEL_REFRESH = False  # train stages warm-start from the saved models (train.py --refresh)
+MEMORY_CAP_MB = None   # RSS cap enforced while each run.py stage runs; setting it implies LOW_MEMORY
@@ -1,49 +1,179 @@
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from utils import load_data, save_data
+import config
+from utils import save_data, downcast_floats
+from vix import update_vix_weekly, join_vix, week_end
+from amfi import load_amfi, synthetic_amfi, monthly_flows, join_flows
+from store import write_dataset
+import telemetry
 
+PRICE_CHUNK_ROWS = 2_000_000   # price rows parsed per chunk; memory scales with weeks, not days
+WEEK = np.timedelta64(7, "D")
+
+# ---------------------------------------------------------------------
+# Helper: daily prices, streamed
+# ---------------------------------------------------------------------
+def synthetic_prices(names, days=756, seed=None):
+    """Business-day geometric random walks, for runs without index_prices.csv."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=days)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, size=(days, len(names))), axis=0))
+    return pd.DataFrame({
+        "Date": dates.repeat(len(names)),
+        "index": np.tile(names, days),
+        "price": prices.ravel(),
+    })
+
+
+def _long_prices(chunk):
+    """Long (Date, index, price) rows from a long or wide (Date, <instrument>...) chunk."""
+    if "index" not in chunk.columns:
+        chunk = chunk.melt(id_vars=["Date"], var_name="index", value_name="price")
+    return pd.DataFrame({
+        "Date": pd.to_datetime(chunk["Date"]),
+        "index": chunk["index"].astype(str),
+        "price": pd.to_numeric(chunk["price"], errors="coerce"),
+    })
+
+
+def iter_price_chunks(path, chunk_rows=PRICE_CHUNK_ROWS):
+    """Yield long price chunks of a CSV or Parquet file without loading it whole."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield _long_prices(batch.to_pandas())
+    else:
+        for chunk in pd.read_csv(path, chunksize=chunk_rows):
+            yield _long_prices(chunk)
+    telemetry.count(bytes_read=telemetry.path_bytes(path))
+
+# ---------------------------------------------------------------------
+# Weekly resampling
+# ---------------------------------------------------------------------
+def last_in_week(prices):
+    """
+    Last quote of each (index, week) in one pass: rows are keyed by the weekly
+    cut-off they fall into (config.WEEKDAY_CUTOFF at PUBLICATION_TIME, date-only rows
+    at that day's close), lexsorted by (instrument code, week, time), and the final
+    row of every run is kept. `last_trade` is the time of the quote used.
+    """
+    prices = prices.dropna(subset=["Date", "price"])
+    codes, names = pd.factorize(prices["index"])
+    ts = prices["Date"].to_numpy("datetime64[ns]")
+    week = week_end(prices["Date"]).to_numpy("datetime64[ns]")
+    order = np.lexsort((ts, week, codes))
+    c, w = codes[order], week[order]
+    last = order[np.r_[(c[1:] != c[:-1]) | (w[1:] != w[:-1]), True]] if len(order) else order
+    return pd.DataFrame({
+        "index": names.to_numpy()[codes[last]],
+        "Date": week[last],
+        "last_trade": ts[last],
+        "price": prices["price"].to_numpy(dtype=float)[last],
+    })
+
+
+def resample_weekly(chunks, universe=None):
+    """
+    True weekly bars from daily (or finer) price chunks in any order. Each chunk is
+    reduced to its last quote per (index, week) as it arrives, partials are reduced
+    again, and every instrument gets one row per week from its first bar to its last.
+    A week without quotes (holidays) carries the last trading day's price forward.
+    """
+    parts, n_rows = [], 0
+    for chunk in chunks:
+        if universe is not None:
+            chunk = chunk[chunk["index"].isin(universe)]
+        n_rows += len(chunk)
+        parts.append(last_in_week(chunk))
+    telemetry.count(rows_in=n_rows)
+    # partials re-reduce on their quote times, which fall into the same weeks
+    partials = pd.concat(parts, ignore_index=True).drop(columns="Date")
+    bars = last_in_week(partials.rename(columns={"last_trade": "Date"}))
+    if bars.empty:
+        return pd.DataFrame(columns=["Date", "index", "price", "last_trade", "return_1w"])
+
+    # Full weekly grid per instrument: rows (index, week) sorted, first week always quoted
+    codes, names = pd.factorize(bars["index"], sort=True)
+    week = bars["Date"].to_numpy("datetime64[ns]")
+    span = pd.Series(week).groupby(codes).agg(["min", "max"])
+    first = span["min"].to_numpy("datetime64[ns]")
+    n_weeks = ((span["max"].to_numpy("datetime64[ns]") - first) // WEEK).astype(np.int64) + 1
+    offset = np.r_[0, np.cumsum(n_weeks)[:-1]]
+
+    total = int(n_weeks.sum())
+    grid_code = np.repeat(np.arange(len(names)), n_weeks)
+    step = np.arange(total) - np.repeat(offset, n_weeks)
+    grid_week = np.repeat(first, n_weeks) + step * WEEK
+
+    slot = offset[codes] + (week - first[codes]) // WEEK
+    price = np.full(total, np.nan)
+    last_trade = np.full(total, np.datetime64("NaT"), dtype="datetime64[ns]")
+    price[slot] = bars["price"].to_numpy(dtype=float)
+    last_trade[slot] = bars["last_trade"].to_numpy("datetime64[ns]")
+    # holiday weeks: forward-fill within instrument (each instrument's first slot is quoted)
+    src = np.maximum.accumulate(np.where(np.isnan(price), 0, np.arange(total)))
+    filled = int(np.isnan(price).sum())
+    price, last_trade = price[src], last_trade[src]
+
+    prev = np.r_[np.nan, price[:-1]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r_1w = np.where(step > 0, price / prev - 1, 0.0)
+    print(f"[pipeline] Resampled {n_rows} price rows → {total} weekly bars "
+          f"({filled} holiday weeks carried forward)")
+    return pd.DataFrame({
+        "Date": grid_week,
+        "index": pd.Categorical.from_codes(grid_code, categories=names.astype(str)),
+        "price": price,
+        "last_trade": last_trade,
+        "return_1w": np.nan_to_num(r_1w, nan=0.0, posinf=0.0, neginf=0.0),
+    })
+
+# ---------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------
+@telemetry.instrument("build_dataset")
 def build_dataset():
     print("[pipeline] Building dataset...")
 
-    amfi = load_data("./data/amfi_flows.csv")
+    amfi = load_amfi(config.AMFI_FILE)
     if amfi is None:
         print("[pipeline] AMFI not found, generating synthetic AMFI.")
-        months = 36
-        rng = pd.date_range(end=pd.Timestamp.today(), periods=months, freq="ME")
-        amfi = pd.DataFrame({
-            "Date": rng,
-            "category": np.random.choice(["Momentum","Quality","Value","SmallCap"], months),
-            "flow": np.random.uniform(-100, 100, months)
-        })
-
-    idx = load_data("./data/index_prices.csv")
-    if idx is None:
+        amfi = synthetic_amfi(config.SYNTHETIC_UNIVERSE)
+
+    if Path(config.INDEX_PRICES_FILE).exists():
+        chunks = iter_price_chunks(config.INDEX_PRICES_FILE)
+    else:
         print("[pipeline] Index prices not found, generating synthetic prices.")
-        months = 36
-        rng = pd.date_range(end=pd.Timestamp.today(), periods=months, freq="ME")
-        idx = pd.DataFrame({
-            "Date": rng.repeat(4),
-            "index": np.tile(["Momentum","Quality","Value","SmallCap"], months),
-            "price": np.random.uniform(100, 200, months*4)
-        })
-
-    # ✅ FIX: ensure price column is numeric
-    idx["price"] = pd.to_numeric(idx["price"], errors="coerce")
-
-    weekly = idx.copy()
-    weekly["flow_pressure"] = np.random.normal(0, 1, len(weekly))
-    weekly["return_1w"] = weekly.groupby("index")["price"].pct_change().fillna(0)
-
-    panel = weekly.pivot_table(
-        index="Date",
-        columns="index",
-        values=["price", "flow_pressure", "return_1w"],
-        aggfunc="mean"
-    )
-
-    panel.columns = [f"{a}_{b}" for a, b in panel.columns]
-    panel = panel.sort_index()
+        chunks = [synthetic_prices(config.SYNTHETIC_UNIVERSE)]
+
+    # Weekly bars at the Friday cut-off; the universe comes from the data, optionally
+    # narrowed by config.UNIVERSE
+    with telemetry.span("resample"):
+        weekly = resample_weekly(chunks, config.UNIVERSE)
+    print(f"[pipeline] Universe: {weekly['index'].nunique()} instruments")
+
+    # Long (Date, index) rows throughout: no {metric}_{index} column per instrument
+    panel = weekly[["Date", "index", "price", "return_1w", "last_trade"]]
+
+    # Point-in-time AMFI flows: the latest month already published at each week's cut-off
+    with telemetry.span("amfi"):
+        flows = monthly_flows(amfi, config.AMFI_CATEGORY_MAP, config.AMFI_PUBLICATION_LAG_DAYS)
+        panel = join_flows(panel, flows)
+    panel = panel[["Date", "index", "price", "flow_pressure", "return_1w", "flow_month", "last_trade"]]
+    if config.LOW_MEMORY:
+        del weekly
+        downcast_floats(panel)
+
+    # Market-wide weekly VIX (Friday cut-off), parsed incrementally from the minute file
+    with telemetry.span("vix"):
+        vix_weekly = update_vix_weekly()
+        if vix_weekly is not None:
+            panel = join_vix(panel, vix_weekly)
+    panel = panel.sort_values(["index", "Date"], kind="stable").reset_index(drop=True)
+    # The partitioned copy (read first by features.load_panel) and the single file hold the same panel
+    write_dataset(panel, "weekly_panel")
 
     Path("./data").mkdir(exist_ok=True)
     save_data(panel, "./data/weekly_panel.parquet")
@@ -51,4 +181,6 @@ def build_dataset():
     print("[pipeline] ✅ Dataset build complete.")
 
 if __name__ == "__main__":
+    import argparse
+    argparse.ArgumentParser(description="Build the weekly (Date, index) panel.").parse_args()
     build_dataset()
@@ -1,40 +1,130 @@
+import re
+import argparse
 import pandas as pd
 import numpy as np
+import config
 from utils import load_data, save_data
+from store import dataset_exists, read_dataset, write_dataset, write_matrix
+import telemetry
 
 PANEL_PATH = "./data/weekly_panel.parquet"
 FEAT_PATH = "./data/features.parquet"
+STATE_PATH = "./data/features_state.parquet"
+PANEL_DATASET = "weekly_panel"   # partitioned store copies (store.py)
+FEAT_DATASET = "features"
+STATE_WINDOW = 12  # longest rolling window (r_12w, flow_z)
+MATRIX_COLS = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]  # model features in store.MATRIX_PATH
 
-def load_panel():
-    panel = load_data(PANEL_PATH)
+METRICS = ["flow", "price", "r_1w"]
+RENAMES = {"flow_pressure": "flow", "return_1w": "r_1w"}
+# Legacy wide panels name columns {metric}_{index}
+WIDE_COLUMN = re.compile(r"^(price|flow_pressure|return_1w|flow|r_1w)_(.+)$")
+
+def target_column(horizon):
+    """Forward-return target column for a horizon in weeks: "target" (1w) or "target_<h>w"."""
+    return "target" if horizon == 1 else f"target_{horizon}w"
+
+
+def target_columns(horizons=None):
+    return [target_column(h) for h in (config.TARGET_HORIZONS if horizons is None else horizons)]
+
+
+def forward_returns(r_1w, group_end, horizons):
+    """
+    Compounded h-week forward returns for flat, group-sorted r_1w rows: one cumulative
+    log-return pass, then one shifted difference per horizon. NaN where the window runs
+    past the instrument's last row (group_end = position of that row).
+    """
+    pos = np.arange(len(r_1w))
+    cum = np.cumsum(np.log1p(np.nan_to_num(np.asarray(r_1w, dtype=float))))
+    out = {}
+    for h in horizons:
+        end = pos + h
+        ok = end <= group_end
+        values = np.full(len(r_1w), np.nan)
+        values[ok] = np.expm1(cum[end[ok]] - cum[pos[ok]])
+        out[h] = values
+    return out
+
+
+def _group_end(new_group):
+    last_in_group = np.r_[new_group[1:], True]
+    n = len(new_group)
+    return np.minimum.accumulate(np.where(last_in_group, np.arange(n), n)[::-1])[::-1]
+
+
+def add_horizon_targets(feats, horizons=None):
+    """(Re)compute the multi-week targets of a (index, Date)-sorted frame in place; unknown stays NaN."""
+    horizons = [h for h in (config.TARGET_HORIZONS if horizons is None else horizons) if h != 1]
+    codes = feats["index"].cat.codes.to_numpy() if hasattr(feats["index"], "cat") else pd.factorize(feats["index"])[0]
+    new_group = np.r_[True, codes[1:] != codes[:-1]] if len(codes) else np.zeros(0, bool)
+    dtype = feats["target"].dtype if "target" in feats else float
+    for h, values in forward_returns(feats["r_1w"].to_numpy(), _group_end(new_group), horizons).items():
+        feats[target_column(h)] = values.astype(dtype, copy=False)
+    return feats
+
+
+def long_to_wide(long):
+    """Long (Date, index, metric...) rows → the wide {metric}_{index} panel."""
+    if long.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="Date"))
+    panel = long.pivot_table(
+        index="Date",
+        columns="index",
+        values=[m for m in METRICS if m in long.columns],
+        aggfunc="mean",
+        observed=True,
+    )
+    panel.columns = [f"{a}_{b}" for a, b in panel.columns]
+    return panel.sort_index()
+
+
+def wide_to_long(panel):
+    """Legacy wide {metric}_{index} panel → long (Date, index, metric...) rows."""
+    cols = {c: WIDE_COLUMN.match(str(c)) for c in panel.columns}
+    cols = {c: m.groups() for c, m in cols.items() if m}
+    long = panel.melt(id_vars=["Date"], value_vars=list(cols), var_name="column")
+    long["metric"] = long["column"].map(lambda c: cols[c][0])
+    long["index"] = long["column"].map(lambda c: cols[c][1])
+    long = long.pivot_table(index=["Date", "index"], columns="metric", values="value", aggfunc="mean")
+    long.columns.name = None
+    return long.reset_index()
+
+
+def load_panel(since=None):
+    """Load the long weekly panel, optionally only the weeks after `since`."""
+    if dataset_exists(PANEL_DATASET):
+        panel = read_dataset(PANEL_DATASET, start=since)
+    elif since is not None:
+        panel = load_data(PANEL_PATH, filters=[("Date", ">", pd.Timestamp(since))])
+    else:
+        panel = load_data(PANEL_PATH)
     if panel is None:
         raise FileNotFoundError(f"Panel file not found at {PANEL_PATH}")
 
-    panel = panel.reset_index()
+    if "index" not in panel.columns:
+        panel = wide_to_long(panel.reset_index())
 
     # Rename columns for consistency
-    renamed = []
-    for c in panel.columns:
-        if "return_1w" in c:
-            renamed.append(c.replace("return_1w", "r_1w"))
-        elif "flow_pressure" in c:
-            renamed.append(c.replace("flow_pressure", "flow"))
-        else:
-            renamed.append(c)
-    panel.columns = renamed
+    panel = panel.rename(columns=RENAMES)
 
     panel["Date"] = pd.to_datetime(panel["Date"])
-    print(f"[features] Loaded panel with {panel.shape[0]} rows and {panel.shape[1]} columns")
+    print(f"[features] Loaded panel with {panel.shape[0]} rows and {panel['index'].nunique()} instruments")
     return panel
 
 
-def build_features(panel: pd.DataFrame):
-    print("[features] Building features...")
+def build_features_reference(panel: pd.DataFrame):
+    """
+    Original groupby/apply implementation over the wide panel, kept as the reference
+    for build_features. Takes the long panel from load_panel.
+    """
+    print("[features] Building features (reference)...")
+    panel = long_to_wide(panel).reset_index()
 
     # Melt wide panel into long format
     long = panel.melt(id_vars=["Date"], var_name="metric", value_name="value")
-    long["index"] = long["metric"].str.extract(r"_(Momentum|Quality|Value|SmallCap)")[0]
-    long["metric_type"] = long["metric"].str.extract(r"^(price|flow|r_1w)")[0]
+    parts = long["metric"].str.extract(WIDE_COLUMN.pattern)
+    long["metric_type"], long["index"] = parts[0], parts[1]
     long = long.dropna(subset=["index", "metric_type"])
 
     long = long.pivot_table(
@@ -65,20 +155,370 @@ def build_features(panel: pd.DataFrame):
     long["is_future_prediction"] = long["target"].isna()
     long["prediction_date"] = long["Date"] + pd.to_timedelta(7, unit="D")
 
-    # Fill NaNs safely for model use
-    long = long.fillna(method="ffill").fillna(method="bfill")
+    # Fill NaNs safely for model use (within each instrument, as build_features;
+    # the original frame-wide fill carried values across instruments)
+    grouped = long.groupby("index", group_keys=False)
+    long = grouped.apply(lambda df: df.ffill().bfill()).reset_index(drop=True)
+    long[["r_4w", "r_12w", "vol_4w", "flow_z"]] = long[["r_4w", "r_12w", "vol_4w", "flow_z"]].fillna(0)
 
     print(f"[features] Final feature set shape: {long.shape}")
     print(f"[features] Keeping {long['is_future_prediction'].sum()} future rows for next-week prediction.")
     return long
 
 
-def save_features(feats):
-    save_data(feats, FEAT_PATH)
-    print(f"[features] Saved features → {FEAT_PATH}")
+# ---------------------------------------------------------------------
+# Vectorized engine
+# ---------------------------------------------------------------------
+def panel_cells(panel: pd.DataFrame):
+    """
+    Collapse the long panel to one row per (index, Date) cell in (index, Date) order,
+    averaging duplicates like pivot_table(aggfunc="mean") and dropping cells with no
+    metric. Returns (instruments, inst_codes, dates, date_codes, {metric: values}).
+    """
+    inst, instruments = pd.factorize(panel["index"], sort=True)
+    when, dates = pd.factorize(pd.to_datetime(panel["Date"]), sort=True)
+    values = {m: pd.to_numeric(panel[m], errors="coerce").to_numpy(dtype=float) for m in METRICS}
+
+    present = np.zeros(len(panel), dtype=bool)
+    for vals in values.values():
+        present |= ~np.isnan(vals)
+    key = inst[present].astype(np.int64) * len(dates) + when[present]
+    cells, cell = np.unique(key, return_inverse=True)
+
+    metrics = {}
+    for m, vals in values.items():
+        vals = vals[present]
+        ok = ~np.isnan(vals)
+        total = np.bincount(cell[ok], weights=vals[ok], minlength=len(cells))
+        count = np.bincount(cell[ok], minlength=len(cells))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            metrics[m] = np.where(count > 0, total / count, np.nan)
+    instruments = np.asarray(instruments.astype(str), dtype=object)
+    return instruments, cells // len(dates), dates.to_numpy(), cells % len(dates), metrics
+
+
+def panel_to_matrices(panel: pd.DataFrame):
+    """The long panel as one (dates x instruments) matrix per metric."""
+    instruments, inst, dates, when, metrics = panel_cells(panel)
+    matrices = {}
+    for m, vals in metrics.items():
+        mat = np.full((len(dates), len(instruments)), np.nan)
+        mat[when, inst] = vals
+        matrices[m] = mat
+    return dates, instruments, matrices
+
+
+def rolling_stats(x, group_start, window, with_std=False):
+    """
+    Rolling mean (and sample std) over a flat, group-sorted array, equivalent to
+    groupby(...).rolling(window, min_periods=1). Windows never cross group_start,
+    and every window is accumulated across all groups at once, one lag at a time.
+    """
+    n = len(x)
+    valid = ~np.isnan(x)
+    vals = np.where(valid, x, 0.0)
+    pos = np.arange(n)
+
+    count = valid.astype(float)
+    total = vals.copy()
+    lags = []
+    for k in range(1, window):
+        ok = (pos[k:] - k >= group_start[k:]) & valid[:-k]
+        count[k:] += ok
+        total[k:] += np.where(ok, vals[:-k], 0.0)
+        lags.append(ok)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+    if not with_std:
+        return mean
+
+    # second pass on deviations avoids sum-of-squares cancellation
+    ssq = np.where(valid, (vals - mean) ** 2, 0.0)
+    for k, ok in enumerate(lags, start=1):
+        ssq[k:] += np.where(ok, (vals[:-k] - mean[k:]) ** 2, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        std = np.where(count > 1, np.sqrt(np.maximum(ssq / (count - 1), 0.0)), np.nan)
+    return mean, std
+
+
+def window_features(r_1w, flow, group_start):
+    """Rolling features for flat, group-sorted r_1w / flow arrays."""
+    r_4w, vol_4w = rolling_stats(r_1w, group_start, 4, with_std=True)
+    r_12w = rolling_stats(r_1w, group_start, 12)
+    flow_mean, flow_std = rolling_stats(flow, group_start, 12, with_std=True)
+    return {
+        "r_4w": r_4w,
+        "r_12w": r_12w,
+        "vol_4w": vol_4w,
+        "flow_z": (flow - flow_mean) / (flow_std + 1e-6),
+    }
+
+
+def fill_gaps(long):
+    """
+    Fill NaNs of an (index, Date)-sorted frame in place from the same instrument's
+    neighbouring weeks: forward, then backward for each instrument's leading rows
+    (e.g. vol_4w / flow_z of its first week). Values never cross instruments, so a
+    row's fill does not change when another instrument gains weeks. A window feature
+    still missing (an instrument with a single week) is 0.
+    """
+    cols = [c for c in long.columns if c not in ("Date", "index") and long[c].isna().any()]
+    key = long["index"]
+    for c in cols:  # one column at a time keeps low-memory builds to one extra copy
+        long[c] = long[c].groupby(key, observed=True, sort=False).ffill()
+        long[c] = long[c].groupby(key, observed=True, sort=False).bfill()
+    for c in ("r_4w", "r_12w", "vol_4w", "flow_z"):
+        if c in cols:
+            long[c] = long[c].fillna(0)
+    return long
+
+
+def advance_windows(r_hist, flow_hist, r_new, flow_new):
+    """
+    Rolling features for one new week of many instruments, given each instrument's
+    last STATE_WINDOW raw r_1w / flow values (oldest first). Returns the feature
+    values and the windows shifted to end at the new week.
+    """
+    width = STATE_WINDOW + 1
+    r_win = np.column_stack([r_hist, r_new])
+    flow_win = np.column_stack([flow_hist, flow_new])
+    group_start = np.repeat(np.arange(len(r_win)) * width, width)
+    window = window_features(r_win.ravel(), flow_win.ravel(), group_start)
+    values = {name: v[width - 1::width] for name, v in window.items()}
+    return values, r_win[:, 1:], flow_win[:, 1:]
+
+
+def _state_columns(name):
+    # oldest -> newest
+    return [f"{name}_lag{k}" for k in reversed(range(STATE_WINDOW))]
+
+
+@telemetry.instrument("build_features")
+def build_features(panel: pd.DataFrame, return_state=False, low_memory=None):
+    """
+    Vectorized feature build; matches build_features_reference up to float rounding.
+    With return_state=True also returns the per-index rolling-window state used by
+    update_features. low_memory (default config.LOW_MEMORY) stores float32 columns,
+    drops the panel and intermediates as soon as they are used, and fills in place.
+    """
+    print("[features] Building features...")
+    low_memory = config.LOW_MEMORY if low_memory is None else low_memory
+    dtype = np.float32 if low_memory else float
+
+    with telemetry.span("panel_cells"):
+        instruments, inst_codes, dates, date_codes, metrics = panel_cells(panel)
+    del panel  # the caller may pass load_panel() straight in
+
+    long = pd.DataFrame({
+        "Date": dates[date_codes],
+        "index": pd.Categorical.from_codes(inst_codes, instruments),
+    })
+    del date_codes
+    for m, values in metrics.items():
+        long[m] = values.astype(dtype, copy=False)
+    long.columns.name = "metric_type"
+    r_1w, flow = metrics["r_1w"], metrics["flow"]  # rolling math stays float64
+    del metrics
+
+    # Position of each row's first row within its instrument
+    new_group = np.r_[True, inst_codes[1:] != inst_codes[:-1]]
+    group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(long)), 0))
+
+    with telemetry.span("window_features"):
+        for name, values in window_features(r_1w, flow, group_start).items():
+            long[name] = values.astype(dtype, copy=False)
+    del group_start
+
+    # Target = next week's return
+    last_in_group = np.r_[new_group[1:], True]
+    if return_state:
+        state = _extract_state(long, r_1w, flow, new_group, last_in_group)
+    target = np.full(len(long), np.nan)
+    target[:-1] = r_1w[1:]
+    target[last_in_group] = np.nan
+    long["target"] = target.astype(dtype, copy=False)
+    # Multi-week targets (config.TARGET_HORIZONS) in one pass; added after the fill so
+    # weeks whose horizon has not played out yet stay NaN
+    horizons = forward_returns(r_1w, _group_end(new_group), [h for h in config.TARGET_HORIZONS if h != 1])
+
+    # Keep last rows even if they have no target (future prediction)
+    long["is_future_prediction"] = np.isnan(target)
+    long["prediction_date"] = long["Date"] + pd.to_timedelta(7, unit="D")
+
+    # Fill NaNs safely for model use, within each instrument
+    with telemetry.span("fill"):
+        fill_gaps(long)
+    for h, values in horizons.items():
+        long[target_column(h)] = values.astype(dtype, copy=False)
+    del horizons
+
+    print(f"[features] Final feature set shape: {long.shape}")
+    print(f"[features] Keeping {long['is_future_prediction'].sum()} future rows for next-week prediction.")
+    if return_state:
+        return long, state
+    return long
+
+
+def _extract_state(long, r_1w, flow, new_group, last_in_group):
+    """Last STATE_WINDOW raw r_1w / flow values per index, plus its last Date and price."""
+    n = len(long)
+    pos = np.arange(n)
+    group_id = np.cumsum(new_group) - 1
+    group_end = np.minimum.accumulate(np.where(last_in_group, pos, n)[::-1])[::-1]
+    back = group_end - pos  # 0 = latest row of the index
+    keep = back < STATE_WINDOW
+
+    n_groups = int(new_group.sum())
+    state = pd.DataFrame({
+        "index": long["index"].to_numpy()[last_in_group],
+        "Date": long["Date"].to_numpy()[last_in_group],
+        "price": long["price"].to_numpy(dtype=float)[last_in_group],
+    })
+    for name, values in (("r_1w", r_1w), ("flow", flow)):
+        hist = np.full((n_groups, STATE_WINDOW), np.nan)
+        hist[group_id[keep], STATE_WINDOW - 1 - back[keep]] = values[keep]
+        state[_state_columns(name)] = hist
+    return state
+
+
+def update_features(new_panel: pd.DataFrame, feats: pd.DataFrame, state: pd.DataFrame):
+    """
+    Append feature rows for panel weeks newer than each index's saved state, without
+    recomputing history. Previous future-prediction rows get their target filled in.
+    Rolling values and gap fills (within each instrument) match a full build.
+    """
+    print("[features] Updating features incrementally...")
+    dates, instruments, mats = panel_to_matrices(new_panel)
+    state = state.set_index("index")
+    names = np.array(sorted(set(state.index) | set(instruments)), dtype=object)
+    cols = np.searchsorted(names, instruments)
+
+    def widen(mat):
+        out = np.full((len(dates), len(names)), np.nan)
+        out[:, cols] = mat
+        return out
+
+    mats = {m: widen(mat) for m, mat in mats.items()}
+    known = state.reindex(names)
+    r_hist = known[_state_columns("r_1w")].to_numpy(dtype=float)
+    flow_hist = known[_state_columns("flow")].to_numpy(dtype=float)
+    last_date = pd.to_datetime(known["Date"]).to_numpy()
+    last_price = known["price"].to_numpy(dtype=float) if "price" in known else np.full(len(names), np.nan)
+
+    new_rows = []
+    for t, date in enumerate(dates):
+        present = np.zeros(len(names), dtype=bool)
+        for mat in mats.values():
+            present |= ~np.isnan(mat[t])
+        present &= np.isnat(last_date) | (last_date < date)
+        j = np.flatnonzero(present)
+        if len(j) == 0:
+            continue
+
+        window, r_hist[j], flow_hist[j] = advance_windows(
+            r_hist[j], flow_hist[j], mats["r_1w"][t, j], mats["flow"][t, j]
+        )
+
+        rows = pd.DataFrame({"Date": np.repeat(date, len(j)), "index": names[j]})
+        for m, mat in mats.items():
+            rows[m] = mat[t, j]
+        for name, values in window.items():
+            rows[name] = values
+        new_rows.append(rows)
+
+        last_date[j] = date
+        last_price[j] = mats["price"][t, j]
+
+    if not new_rows:
+        print("[features] No new weeks to add.")
+        return feats, state.reset_index()
+
+    new = pd.concat(new_rows, ignore_index=True).sort_values(["index", "Date"], kind="stable")
+    new["target"] = new.groupby("index")["r_1w"].shift(-1)
+    new["is_future_prediction"] = new["target"].isna()
+    new["prediction_date"] = new["Date"] + pd.to_timedelta(7, unit="D")
+
+    # The previous last row of each index now has a realised target
+    feats = feats.copy()
+    first_new = new.drop_duplicates("index", keep="first").set_index("index")["r_1w"].dropna()
+    last_rows = feats.groupby("index", observed=True)["Date"].idxmax()
+    touched = last_rows.reindex(first_new.index).dropna().astype(int)
+    feats.loc[touched.values, "target"] = first_new.loc[touched.index].values.astype(feats["target"].dtype)
+    feats.loc[touched.values, "is_future_prediction"] = False
+
+    # Match the saved columns and dtypes (float32 in low-memory builds); the multi-week
+    # targets are not in `new` yet, add_horizon_targets fills them below
+    new = new.reindex(columns=feats.columns)
+    floats = [c for c in feats.columns if feats[c].dtype == np.float32]
+    new[floats] = new[floats].astype(np.float32)
+    feats = pd.concat([feats, new], ignore_index=True)
+    feats["index"] = feats["index"].astype(str).astype("category")
+    feats = feats.sort_values(["index", "Date"], kind="stable").reset_index(drop=True)
+    fill_gaps(feats)
+    add_horizon_targets(feats)  # the last weeks' multi-week targets are now (partly) realised
+
+    state = pd.DataFrame({"index": names, "Date": last_date, "price": last_price})
+    state[_state_columns("r_1w")] = r_hist
+    state[_state_columns("flow")] = flow_hist
+    state = state.dropna(subset=["Date"]).reset_index(drop=True)
+
+    print(f"[features] Added {len(new)} rows; final feature set shape: {feats.shape}")
+    return feats, state
+
+
+def save_features(feats, state=None, partial=False):
+    """
+    Full builds write features.parquet and the partitioned store. With partial=True,
+    feats only holds the (index, year) partitions that changed and only those are
+    rewritten in the store. Either way the memory-mapped feature matrix
+    (store.MATRIX_PATH) is rewritten from the full table.
+    """
+    if partial:
+        write_dataset(feats, FEAT_DATASET, mode="replace_partitions")
+        write_matrix(read_dataset(FEAT_DATASET, columns=["Date", "index", *MATRIX_COLS, *target_columns(),
+                                                         "is_future_prediction"]),
+                     MATRIX_COLS, target_columns())
+    else:
+        save_data(feats, FEAT_PATH)
+        write_dataset(feats, FEAT_DATASET)
+        write_matrix(feats, MATRIX_COLS, target_columns())
+        print(f"[features] Saved features → {FEAT_PATH}")
+    if state is not None:
+        save_data(state, STATE_PATH)
+
+
+def main(incremental=False):
+    feats = state = None
+    partial = False
+    if incremental:
+        state = load_data(STATE_PATH)
+        if state is not None and dataset_exists(FEAT_DATASET):
+            # Only years from the oldest saved last-row on can change, plus the weeks
+            # before it whose multi-week targets are realised by the new rows
+            lookback = pd.Timedelta(7 * max(config.TARGET_HORIZONS), "D")
+            first_year = (pd.to_datetime(state["Date"]).min() - lookback).year
+            feats = read_dataset(FEAT_DATASET, start=pd.Timestamp(first_year, 1, 1) - pd.Timedelta(1, "ns"))
+            partial = True
+        elif state is not None:
+            feats = load_data(FEAT_PATH)
+        if feats is not None and not set(target_columns()) <= set(feats.columns):
+            print("[features] Saved features lack the configured horizon targets, rebuilding.")
+            feats, partial = None, False
+        elif feats is None:
+            print("[features] No saved state, falling back to a full build.")
+
+    if feats is not None:
+        panel = load_panel(since=pd.to_datetime(state["Date"]).min())
+        feats, state = update_features(panel, feats, state)
+    else:
+        feats, state = build_features(load_panel(), return_state=True)
+    save_features(feats, state, partial)
 
 
 if __name__ == "__main__":
-    panel = load_panel()
-    feats = build_features(panel)
-    save_features(feats)
+    parser = argparse.ArgumentParser(description="Build model features from the weekly panel.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only append weeks newer than the saved rolling-window state")
+    args = parser.parse_args()
+    main(args.incremental)
@@ -1,6 +1,7 @@
-import yfinance as yf
+import argparse
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # -----------------------------------------------------------------------------
 # 🧭 Primary + fallback tickers
@@ -12,49 +13,126 @@ tickers = {
     "SmallCap": ["NIPPONSMALL.NS", "^RUT"],        # Nifty SmallCap ETF → Russell 2000
 }
 
-Path("data").mkdir(exist_ok=True)
-all_data = []
+START_DATE = "2018-01-01"
+INTERVAL = "1d"   # daily closes; data_pipeline resamples to weekly bars
+STORE_DIR = "data/prices"              # one file per symbol
+OUT_PATH = "data/index_prices.csv"
+MAX_WORKERS = 8
 
-def try_download(symbol):
-    """Try fetching one symbol safely."""
-    try:
-        df = yf.download(symbol, start="2018-01-01", interval="1mo", progress=False)
-        if not df.empty:
-            print(f"✅ Data fetched for {symbol} ({len(df)} rows)")
-            return df
-        print(f"⚠️ Empty data for {symbol}")
+# -----------------------------------------------------------------------------
+# 🔌 Price sources: anything with fetch(symbol, start) -> DataFrame[Date, price]
+# -----------------------------------------------------------------------------
+class YahooSource:
+    """Yahoo Finance via yfinance (imported only when a download happens)."""
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+
+    def fetch(self, symbol, start):
+        import yfinance as yf
+        df = yf.download(symbol, start=start, interval=self.interval, progress=False)
+        if df is None or df.empty:
+            return None
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+        df = df.reset_index()[["Date", "Close"]].rename(columns={"Close": "price"})
+        return df
+
+
+class CsvSource:
+    """Local <symbol>.csv files with Date,price columns — offline runs and tests."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def fetch(self, symbol, start):
+        path = self.directory / f"{symbol}.csv"
+        if not path.exists():
+            return None
+        df = pd.read_csv(path, parse_dates=["Date"])
+        df = df[df["Date"] >= pd.Timestamp(start)]
+        return df[["Date", "price"]] if not df.empty else None
+
+# -----------------------------------------------------------------------------
+# 💾 Per-symbol store
+# -----------------------------------------------------------------------------
+def store_path(symbol, store_dir=STORE_DIR):
+    return Path(store_dir) / f"{symbol}.csv"
+
+
+def load_stored(symbol, store_dir=STORE_DIR):
+    path = store_path(symbol, store_dir)
+    if not path.exists():
         return None
+    return pd.read_csv(path, parse_dates=["Date"])
+
+
+def update_symbol(source, symbol, store_dir=STORE_DIR, start=START_DATE):
+    """
+    Fetch bars from the last stored date on (that bar may still be forming) and merge
+    them into the symbol's store. Returns the full stored series, or None.
+    """
+    stored = load_stored(symbol, store_dir)
+    since = stored["Date"].max() if stored is not None and len(stored) else pd.Timestamp(start)
+    try:
+        fresh = source.fetch(symbol, since)
     except Exception as e:
         print(f"❌ Error fetching {symbol}: {e}")
-        return None
+        fresh = None
 
+    if fresh is None or fresh.empty:
+        if stored is None:
+            print(f"⚠️ Empty data for {symbol}")
+        return stored
 
-# -----------------------------------------------------------------------------
-# 🌐 Try each ticker with fallback
-# -----------------------------------------------------------------------------
-for label, options in tickers.items():
-    print(f"\n📈 Fetching {label} ...")
-    df = None
-    for sym in options:
-        df = try_download(sym)
-        if df is not None:
-            df = df.reset_index()[["Date", "Close"]]
-            df["index"] = label
-            df.rename(columns={"Close": "price"}, inplace=True)
-            all_data.append(df)
-            break
-    if df is None:
-        print(f"🚫 Failed all sources for {label}")
+    fresh = fresh.assign(Date=pd.to_datetime(fresh["Date"]))
+    merged = fresh if stored is None else pd.concat([stored, fresh])
+    merged = merged.drop_duplicates("Date", keep="last").sort_values("Date")
+    store_path(symbol, store_dir).parent.mkdir(parents=True, exist_ok=True)
+    merged.to_csv(store_path(symbol, store_dir), index=False)
+    print(f"✅ {symbol}: {len(fresh)} bar(s) fetched since {since.date()} ({len(merged)} stored)")
+    return merged
 
-if not all_data:
-    raise RuntimeError("❌ No data fetched! Check connection or symbols.")
+
+def update_label(source, label, options, store_dir=STORE_DIR):
+    """Try each symbol for a label in order; the first one with data wins."""
+    for sym in options:
+        df = update_symbol(source, sym, store_dir)
+        if df is not None and not df.empty:
+            return df.assign(index=label)[["Date", "price", "index"]]
+    print(f"🚫 Failed all sources for {label}")
+    return None
 
 # -----------------------------------------------------------------------------
-# 💾 Save results
+# 🌐 Fetch all labels concurrently
 # -----------------------------------------------------------------------------
-merged = pd.concat(all_data)
-merged.sort_values(["index", "Date"], inplace=True)
-merged.to_csv("data/index_prices.csv", index=False)
+def fetch_all(source=None, ticker_map=tickers, store_dir=STORE_DIR, out_path=OUT_PATH,
+              max_workers=MAX_WORKERS):
+    source = source or YahooSource()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ticker_map)))) as pool:
+        results = list(pool.map(
+            lambda item: update_label(source, item[0], item[1], store_dir), ticker_map.items()
+        ))
+
+    all_data = [df for df in results if df is not None]
+    if not all_data:
+        raise RuntimeError("❌ No data fetched! Check connection or symbols.")
+
+    merged = pd.concat(all_data)
+    merged.sort_values(["index", "Date"], inplace=True)
+    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+    merged.to_csv(out_path, index=False)
+
+    print(f"\n✅ Saved → {out_path} with {len(merged)} rows")
+    print("🧱 Index breakdown:\n", merged.groupby("index").size())
+    return merged
+
 
-print(f"\n✅ Saved → data/index_prices.csv with {len(merged)} rows")
-print("🧱 Index breakdown:\n", merged.groupby("index").size())
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download index prices with fallbacks.")
+    parser.add_argument("--source-dir", default=None,
+                        help="read <symbol>.csv files from this directory instead of Yahoo")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    args = parser.parse_args()
+    source = CsvSource(args.source_dir) if args.source_dir else YahooSource()
+    fetch_all(source, max_workers=args.workers)
@@ -0,0 +1,230 @@
+# inference.py
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_CELLS = 4_000_000  # rows x trees traversed per chunk; bounds the node-index matrix
+MISSING_TYPES = {"None": 0, "Zero": 1, "NaN": 2}
+IDENTITY_OBJECTIVES = {"regression", "regression_l1", "huber", "fair", "quantile", "mape"}
+ZERO_THRESHOLD = 1e-35    # LightGBM's kZeroThreshold
+# "booster" keeps LightGBM's own predictor, "flat" uses TreeEnsemble. The compiled
+# C++ traversal wins on CPU time (python benchmark.py inference); the flat arrays
+# need no LightGBM at predict time.
+TREE_ENGINE = "booster"
+
+_CACHE = {}  # (path, tree_engine) -> (mtime_ns, compiled model)
+
+# ---------------------------------------------------------------------
+# Compiled models
+# ---------------------------------------------------------------------
+class LinearModel:
+    """A fitted linear model (ElasticNet) as a coefficient vector: one matmul per batch."""
+
+    def __init__(self, coef, intercept):
+        self.coef = np.asarray(coef).reshape(-1)  # keeps the fitted dtype, like the estimator
+        self.intercept = np.asarray(intercept, dtype=self.coef.dtype).reshape(-1)[0]
+
+    @classmethod
+    def from_estimator(cls, model):
+        return cls(model.coef_, model.intercept_)
+
+    def predict_chunk(self, X):
+        return X @ self.coef + self.intercept
+
+    def predict(self, X):
+        return predict(self, X)
+
+
+class TreeEnsemble:
+    """
+    A LightGBM booster flattened into node arrays. Every (row, tree) cell of a chunk
+    still on an internal node advances one level per step, and cells drop out as they
+    reach a leaf; the leaf values of each row are then summed.
+    """
+
+    def __init__(self, feature, threshold, left, right, default_left, missing, value, roots, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.missing = missing
+        self.value = value
+        self.roots = roots
+        self.depth = depth
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Flatten the trees Booster.predict would use (best_iteration when set)."""
+        dump = booster.dump_model()
+        objective = str(dump.get("objective", "regression")).split()
+        if dump.get("num_class", 1) != 1 or objective[0] not in IDENTITY_OBJECTIVES or "sqrt" in objective:
+            raise ValueError(f"Only single-output raw-score objectives are supported, got {dump.get('objective')}")
+
+        nodes = {k: [] for k in ("feature", "threshold", "left", "right", "default_left", "missing", "value")}
+        roots, depth = [], 0
+
+        def add(node, level):
+            nonlocal depth
+            i = len(nodes["feature"])
+            for k in nodes:
+                nodes[k].append(0)
+            if "leaf_value" in node:
+                nodes["left"][i] = nodes["right"][i] = i
+                nodes["threshold"][i] = np.inf
+                nodes["value"][i] = node["leaf_value"]
+                depth = max(depth, level)
+                return i
+            if node.get("decision_type", "<=") != "<=":
+                raise ValueError("Categorical splits are not supported")
+            nodes["feature"][i] = node["split_feature"]
+            nodes["threshold"][i] = node["threshold"]
+            nodes["default_left"][i] = node["default_left"]
+            nodes["missing"][i] = MISSING_TYPES[node.get("missing_type", "None")]
+            nodes["left"][i] = add(node["left_child"], level + 1)
+            nodes["right"][i] = add(node["right_child"], level + 1)
+            return i
+
+        for tree in dump["tree_info"]:
+            roots.append(add(tree["tree_structure"], 0))
+
+        return cls(
+            feature=np.array(nodes["feature"], dtype=np.int32),
+            threshold=np.array(nodes["threshold"], dtype=np.float64),
+            left=np.array(nodes["left"], dtype=np.int32),
+            right=np.array(nodes["right"], dtype=np.int32),
+            default_left=np.array(nodes["default_left"], dtype=bool),
+            missing=np.array(nodes["missing"], dtype=np.int8),
+            value=np.array(nodes["value"], dtype=np.float64),
+            roots=np.array(roots, dtype=np.int32),
+            depth=depth,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict_chunk(self, X):
+        n, n_features = X.shape
+        if n == 0 or self.n_trees == 0:
+            return np.zeros(n)
+        flat = X.ravel()
+        node = np.tile(self.roots, n)  # cell c = (row c // n_trees, tree c % n_trees)
+        is_leaf = self.left == np.arange(len(self.left))
+        active = np.flatnonzero(~is_leaf[node])
+        cur = node[active]
+        base = active // self.n_trees * n_features
+        exact = not ((self.missing == 1).any() or np.isnan(flat).any())
+
+        for _ in range(self.depth):
+            if len(active) == 0:
+                break
+            x = flat[base + self.feature[cur]]
+            if exact:
+                go_left = x <= self.threshold[cur]
+            else:
+                go_left = self._decide(x.astype(np.float64), cur)
+            cur = np.where(go_left, self.left[cur], self.right[cur])
+            # Cells that reached a leaf drop out of the active set
+            done = is_leaf[cur]
+            node[active[done]] = cur[done]
+            keep = ~done
+            active, cur, base = active[keep], cur[keep], base[keep]
+        return self.value[node].reshape(n, self.n_trees).sum(axis=1)
+
+    def _decide(self, x, cur):
+        """Go-left mask with LightGBM's NumericalDecision rules for NaN and zero."""
+        missing = self.missing[cur]
+        nan = np.isnan(x)
+        x[nan & (missing != 2)] = 0.0
+        to_default = ((missing == 1) & (np.abs(x) <= ZERO_THRESHOLD)) | ((missing == 2) & nan)
+        return np.where(to_default, self.default_left[cur], x <= self.threshold[cur])
+
+    def chunk_rows(self):
+        return max(1024, CHUNK_CELLS // max(1, self.n_trees))
+
+    def predict(self, X, workers=None):
+        return predict(self, X, workers)
+
+# ---------------------------------------------------------------------
+# Loading and prediction
+# ---------------------------------------------------------------------
+def compile_model(model, tree_engine=TREE_ENGINE):
+    """Compiled form of a trained model; models of other types are returned unchanged."""
+    if isinstance(model, dict):
+        model = model.get("model", model)
+    if hasattr(model, "dump_model"):
+        return TreeEnsemble.from_booster(model) if tree_engine == "flat" else model
+    if hasattr(model, "coef_") and hasattr(model, "intercept_") and np.ndim(model.coef_) <= 1:
+        return LinearModel.from_estimator(model)
+    return model
+
+
+def load_model(path, tree_engine=TREE_ENGINE):
+    """Load and compile a pickled model once per file version."""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"❌ Model file not found: {path}")
+    mtime = path.stat().st_mtime_ns
+    key = (str(path.resolve()), tree_engine)
+    cached = _CACHE.get(key)
+    if cached is None or cached[0] != mtime:
+        import joblib
+        cached = (mtime, compile_model(joblib.load(path), tree_engine))
+        _CACHE[key] = cached
+    return cached[1]
+
+
+def feature_matrix(df, cols):
+    """Contiguous feature matrix; float32 stays float32 (low-memory features), else float64."""
+    dtype = np.float32 if all(df[c].dtype == np.float32 for c in cols) else np.float64
+    return np.ascontiguousarray(df[cols].to_numpy(dtype=dtype))
+
+
+def predict(model, X, workers=None, chunk_rows=None):
+    """
+    Predict a 2-D feature matrix in row chunks, optionally on a thread pool
+    (NumPy releases the GIL inside the large array operations).
+    """
+    if not hasattr(model, "predict_chunk"):
+        return np.asarray(model.predict(X), dtype=np.float64).reshape(-1)
+    X = np.ascontiguousarray(X)
+    if chunk_rows is None:
+        chunk_rows = model.chunk_rows() if hasattr(model, "chunk_rows") else len(X) or 1
+    bounds = [(s, min(s + chunk_rows, len(X))) for s in range(0, len(X), chunk_rows)]
+    out = np.empty(len(X))
+
+    def run(bound):
+        start, stop = bound
+        out[start:stop] = model.predict_chunk(X[start:stop])
+
+    if workers and workers > 1 and len(bounds) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, bounds))
+    else:
+        for bound in bounds:
+            run(bound)
+    return out
+
+
+def predict_batch(models, X, workers=None):
+    """
+    {name: predictions} of several compiled models on one feature matrix. Linear
+    models (every horizon's ElasticNet) are stacked into one coefficient matrix and
+    scored with a single matmul; the others are predicted one by one.
+    """
+    linear = {name: m for name, m in models.items() if isinstance(m, LinearModel)}
+    out = {}
+    if linear:
+        X = np.ascontiguousarray(X)
+        coef = np.column_stack([m.coef for m in linear.values()])
+        intercept = np.array([m.intercept for m in linear.values()])
+        scores = np.empty((len(X), len(linear)))
+        step = max(1, CHUNK_CELLS // len(linear))
+        for start in range(0, len(X), step):
+            scores[start:start + step] = X[start:start + step] @ coef + intercept
+        out.update(zip(linear, scores.T))
+    for name, model in models.items():
+        if name not in linear:
+            out[name] = predict(model, X, workers)
+    return {name: out[name] for name in models}
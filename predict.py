@@ -0,0 +1,68 @@
+# predict.py
+import numpy as np
+from pathlib import Path
+
+import config
+from utils import save_data
+from store import load_frame, write_dataset, open_matrix
+from features import target_columns
+from train import model_name
+import inference
+
+FEAT_PATH = "./data/features.parquet"
+PRED_PATH = "./data/predictions.parquet"
+FEATURE_COLS = ["r_1w", "r_4w", "r_12w", "flow_z", "vol_4w"]
+MODEL_TYPES = ["elasticnet", "lgbm"]
+
+def model_paths(horizons=None):
+    """Prediction column -> saved model for every registered model x target horizon."""
+    horizons = config.TARGET_HORIZONS if horizons is None else horizons
+    return {name: f"./models/{name}.pkl"
+            for name in (model_name(m, h) for h in horizons for m in MODEL_TYPES)}
+
+MODELS = model_paths()  # every model x horizon in config.TARGET_HORIZONS (serve.py scores these)
+
+def score_models(models=None):
+    """
+    Predict every feature row with each trained model x horizon in one batch and save
+    one table (Date, index, target, target_4w, ..., <model>, <model>_4w, ...) so the
+    backtest and dashboard pick columns and never have to load a model.
+    """
+    models = model_paths() if models is None else models
+    targets = target_columns()
+    fm = open_matrix(newer_than=[FEAT_PATH]) if config.LOW_MEMORY else None
+    if fm is not None and set(FEATURE_COLS) <= set(fm.columns) and set(targets) <= set(fm.targets):
+        # low-memory mode, memory-mapped float32 rows: X is a view, only Date / index / targets are materialized
+        X = fm.features(FEATURE_COLS)
+        out = fm.meta().assign(**{t: fm.label(t) for t in targets})
+        complete = ~np.isnan(X).any(axis=1)
+        if not complete.all():
+            out, X = out[complete].reset_index(drop=True), X[complete]
+    else:
+        df = load_frame("features", FEAT_PATH, columns=["Date", "index", *FEATURE_COLS, *targets])
+        if df is None:
+            raise FileNotFoundError(f"❌ features not found at {FEAT_PATH}")
+        feats = [c for c in FEATURE_COLS if c in df.columns]
+        df = df.dropna(subset=feats).reset_index(drop=True)
+        X = inference.feature_matrix(df, feats)
+        out = df[["Date", "index", *[t for t in targets if t in df.columns]]].copy()
+
+    loaded = {}
+    for name, path in models.items():
+        if not Path(path).exists():
+            print(f"[predict] skipping {name}: {path} not found")
+            continue
+        loaded[name] = inference.load_model(path)
+    for name, values in inference.predict_batch(loaded, X).items():
+        out[name] = values
+    print(f"[predict] scored {len(out)} rows with {len(loaded)} model(s): {', '.join(loaded) or 'none'}")
+
+    save_data(out, PRED_PATH)
+    write_dataset(out, "predictions")
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    argparse.ArgumentParser(description="Score every trained model on the feature table.").parse_args()
+    score_models()
@@ -0,0 +1,191 @@
+# robustness.py
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+from store import load_frame
+from utils import save_data
+
+RESULTS_PATH = backtest.OUT_PATH
+OUT_PATH = "./data/robustness_paths.csv"
+SUMMARY_PATH = "./data/robustness_summary.csv"
+
+N_BOOTSTRAP = 10_000
+N_NOISE = 200
+BLOCK_WEEKS = 8            # mean block length of the bootstrap, in weeks
+NOISE_SCALE = 0.5          # noise std as a multiple of each instrument's prediction std
+MAX_CELLS = 5_000_000      # (paths x rows) simulated per noise batch
+PERCENTILES = [5, 25, 50, 75, 95]
+SEED = 42
+
+# ---------------------------------------------------------------------
+# Path metrics (one row per path)
+# ---------------------------------------------------------------------
+def path_metrics(returns, periods_per_year=backtest.PERIODS_PER_YEAR):
+    """CAGR, annualised Sharpe and max drawdown of each row of a (paths x weeks) return array."""
+    returns = np.atleast_2d(np.asarray(returns, dtype=float))
+    n = returns.shape[1]
+    value = np.cumprod(1.0 + returns, axis=1)
+    peak = np.maximum.accumulate(np.maximum(value, 1.0), axis=1)  # the start value counts as a peak
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cagr = np.where(value[:, -1] > 0, value[:, -1] ** (periods_per_year / n) - 1, -1.0)
+        vol = returns.std(axis=1, ddof=1)
+        sharpe = np.where(vol > 0, returns.mean(axis=1) / vol * np.sqrt(periods_per_year), np.nan)
+    return {
+        "cagr": cagr,
+        "sharpe": sharpe,
+        "max_drawdown": (value / peak - 1).min(axis=1),
+        "final_value": value[:, -1],
+    }
+
+# ---------------------------------------------------------------------
+# Resampling
+# ---------------------------------------------------------------------
+def block_bootstrap(returns, n_paths, block=BLOCK_WEEKS, seed=SEED):
+    """
+    Stationary block bootstrap of a weekly return series: every path is a
+    (n_paths x weeks) row stitched from circular blocks with geometric lengths
+    (mean `block`), so short-range autocorrelation and volatility clustering survive.
+    """
+    returns = np.asarray(returns, dtype=float)
+    n = len(returns)
+    rng = np.random.default_rng(seed)
+    restart = rng.random((n_paths, n)) < 1.0 / max(block, 1)
+    restart[:, 0] = True
+    starts = rng.integers(0, n, size=(n_paths, n))
+    # position within the current block, then the block's random start
+    col = np.arange(n)
+    block_start = np.maximum.accumulate(np.where(restart, col, 0), axis=1)
+    origin = np.take_along_axis(starts, block_start, axis=1)
+    return returns[(origin + col - block_start) % n]
+
+
+def _noise_batch(task):
+    """Strategy returns per (path, date) after re-simulating with noisy predictions."""
+    inst, when, n_dates, r_1w, predicted, pred_std, n_paths, noise_scale, seed = task
+    rng = np.random.default_rng(seed)
+    rows = len(inst)
+    noisy = predicted + noise_scale * pred_std * rng.standard_normal((n_paths, rows))
+    n_inst = int(inst.max()) + 1
+    group = (np.arange(n_paths)[:, None] * n_inst + inst).ravel()  # rows stay (index, Date)-sorted per path
+    sim = backtest.simulate(group, np.tile(r_1w, n_paths), noisy.ravel())
+    cell = (np.arange(n_paths)[:, None] * n_dates + when).ravel()
+    total = np.bincount(cell, weights=sim["strategy_return"], minlength=n_paths * n_dates)
+    count = np.bincount(cell, minlength=n_paths * n_dates)
+    return np.divide(total, count, out=np.zeros_like(total), where=count > 0).reshape(n_paths, n_dates)
+
+
+def signal_noise(frame, n_paths, noise_scale=NOISE_SCALE, seed=SEED, workers=1):
+    """
+    (n_paths x weeks) equal-weight portfolio returns of the regime strategy re-run on
+    predictions plus Gaussian noise. Paths are simulated in batches of stacked copies
+    of the panel (each copy its own set of groups), split across processes if asked.
+    """
+    inst = pd.factorize(frame["index"])[0]
+    when, dates = pd.factorize(frame["Date"], sort=True)
+    predicted = frame["predicted_return"].to_numpy(dtype=float)
+    pred_std = frame.groupby("index", observed=True)["predicted_return"].transform("std", ddof=0).fillna(0).to_numpy()
+    r_1w = frame["r_1w"].to_numpy(dtype=float)
+
+    per_batch = max(1, MAX_CELLS // max(len(frame), 1))
+    sizes = [min(per_batch, n_paths - s) for s in range(0, n_paths, per_batch)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(inst, when, len(dates), r_1w, predicted, pred_std, size, noise_scale, s)
+             for size, s in zip(sizes, seeds)]
+    if workers and workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            batches = list(pool.map(_noise_batch, tasks))
+    else:
+        batches = [_noise_batch(t) for t in tasks]
+    return np.vstack(batches) if batches else np.zeros((0, len(dates)))
+
+# ---------------------------------------------------------------------
+# Helper: saved backtest results
+# ---------------------------------------------------------------------
+def load_results(path=RESULTS_PATH, with_returns=False):
+    """Saved per-instrument backtest rows, (index, Date)-sorted; r_1w is joined from features if asked."""
+    cols = ["Date", "index", "predicted_return", "strategy_return"]
+    df = load_frame("backtest_results", path, columns=cols)
+    if df is None:
+        raise FileNotFoundError(f"❌ backtest results not found at {path}. Run backtest.py first.")
+    df["Date"] = pd.to_datetime(df["Date"])
+    if with_returns:
+        feats = load_frame(backtest.FEAT_DATASET, backtest.FEAT_PATH, columns=["Date", "index", "r_1w"])
+        if feats is None:
+            raise FileNotFoundError(f"❌ features not found at {backtest.FEAT_PATH}")
+        feats["Date"] = pd.to_datetime(feats["Date"])
+        df = df.assign(index=df["index"].astype(str)).merge(
+            feats.assign(index=feats["index"].astype(str)), on=["Date", "index"], how="inner")
+    return df.sort_values(["index", "Date"], kind="stable").reset_index(drop=True)
+
+
+def portfolio_returns(df):
+    """Weekly return of the equal-weight portfolio across instruments (rebalanced weekly)."""
+    return df.groupby("Date")["strategy_return"].mean().sort_index()
+
+# ---------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------
+def summarize_paths(paths, observed):
+    """Percentiles of each metric across paths next to the observed value."""
+    rows = []
+    for method, group in paths.groupby("method", sort=False):
+        for metric in ("cagr", "sharpe", "max_drawdown", "final_value"):
+            values = group[metric].dropna().to_numpy()
+            row = {"method": method, "metric": metric, "observed": observed[metric][0],
+                   "mean": values.mean() if len(values) else np.nan}
+            for p in PERCENTILES:
+                row[f"p{p}"] = np.percentile(values, p) if len(values) else np.nan
+            row["share_below_observed"] = float(np.mean(values < observed[metric][0])) if len(values) else np.nan
+            rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def run_robustness(n_bootstrap=N_BOOTSTRAP, n_noise=N_NOISE, block=BLOCK_WEEKS,
+                   noise_scale=NOISE_SCALE, seed=SEED, workers=1, path=RESULTS_PATH):
+    df = load_results(path, with_returns=n_noise > 0)
+    weekly = portfolio_returns(df)
+    observed = path_metrics(weekly.to_numpy())
+    print(f"[robustness] {df['index'].nunique()} instruments x {len(weekly)} weeks; observed "
+          f"CAGR {observed['cagr'][0]:.2%}, Sharpe {observed['sharpe'][0]:.2f}, "
+          f"max drawdown {observed['max_drawdown'][0]:.1%}")
+
+    parts = []
+    if n_bootstrap:
+        start = time.perf_counter()
+        metrics = path_metrics(block_bootstrap(weekly.to_numpy(), n_bootstrap, block, seed))
+        parts.append(pd.DataFrame({"method": "bootstrap", "path": np.arange(n_bootstrap), **metrics}))
+        print(f"[robustness] {n_bootstrap} block-bootstrap paths in {time.perf_counter() - start:.2f}s")
+    if n_noise:
+        start = time.perf_counter()
+        workers = workers or os.cpu_count() or 1
+        metrics = path_metrics(signal_noise(df, n_noise, noise_scale, seed, workers))
+        parts.append(pd.DataFrame({"method": "signal_noise", "path": np.arange(n_noise), **metrics}))
+        print(f"[robustness] {n_noise} signal-noise paths in {time.perf_counter() - start:.2f}s")
+    if not parts:
+        raise ValueError("Nothing to do: both n_bootstrap and n_noise are 0")
+
+    paths = pd.concat(parts, ignore_index=True)
+    summary = summarize_paths(paths, observed)
+    save_data(paths, OUT_PATH)
+    save_data(summary, SUMMARY_PATH)
+    print("\n[robustness] 📊 Distribution across paths:")
+    print(summary.set_index(["method", "metric"]).round(4).to_string())
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bootstrap and signal-noise robustness of the backtest.")
+    parser.add_argument("--paths", type=int, default=N_BOOTSTRAP, help="block-bootstrap paths")
+    parser.add_argument("--noise-paths", type=int, default=N_NOISE, help="signal-noise paths (0 to skip)")
+    parser.add_argument("--block", type=float, default=BLOCK_WEEKS, help="mean bootstrap block length (weeks)")
+    parser.add_argument("--noise-scale", type=float, default=NOISE_SCALE,
+                        help="noise std as a multiple of each instrument's prediction std")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workers", type=int, default=1, help="processes for the signal-noise paths")
+    args = parser.parse_args()
+    run_robustness(args.paths, args.noise_paths, args.block, args.noise_scale, args.seed, args.workers)
@@ -1,14 +1,12 @@
-import os
+import argparse
 import subprocess
-import time
 
-steps = [
-    ("🧱 Building dataset", "python data_pipeline.py"),
-    ("🧩 Generating features", "python features.py"),
-    ("🤖 Training models", "python train.py"),
-    ("📊 Running backtest", "python backtest.py"),
-    ("🌐 Launching Streamlit app", "streamlit run app.py")
-]
+import config
+import telemetry
+
+from runner import run_pipeline, STAGES
+
+APP_COMMAND = "streamlit run app.py"
 
 def run_command(name, command):
     print(f"\n{'='*80}")
@@ -19,11 +17,39 @@ def run_command(name, command):
         print(f"❌ {name} failed. Stopping pipeline.")
         exit(result.returncode)
     print(f"✅ {name} completed successfully.")
-    time.sleep(1)
 
 if __name__ == "__main__":
-    print("🚀 Starting full Open-Data Signals workflow...")
-    for step_name, cmd in steps[:-1]:
-        run_command(step_name, cmd)
-    print("\n🎯 All preprocessing and training done! Launching dashboard...\n")
-    run_command("🌐 Streamlit app", steps[-1][1])
+    parser = argparse.ArgumentParser(description="Run the Open-Data Signals workflow.")
+    parser.add_argument("--force", action="store_true", help="rerun every stage, ignoring the cache")
+    parser.add_argument("--no-app", action="store_true", help="do not launch the dashboard")
+    parser.add_argument("--stages", nargs="+", choices=[s.name for s in STAGES], default=None,
+                        help="run only these stages (their inputs must exist); implies --no-app")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="float32 features and in-place transforms (config.LOW_MEMORY)")
+    parser.add_argument("--memory-cap", type=float, default=None, metavar="MB",
+                        help="stop a stage once its RSS exceeds MB; implies --low-memory")
+    parser.add_argument("--refresh", action="store_true",
+                        help="warm-start the models from the saved ones instead of refitting (config.MODEL_REFRESH)")
+    parser.add_argument("--profile", nargs="?", const="all", default=None, metavar="STAGES",
+                        help="cProfile stages (all, or comma-separated names) into ./data/metrics/profiles")
+    args = parser.parse_args()
+    if args.low_memory:
+        config.LOW_MEMORY = True
+    if args.refresh:
+        config.MODEL_REFRESH = True
+    if args.profile:
+        telemetry.PROFILE = args.profile
+
+    stages = [s for s in STAGES if s.name in args.stages] if args.stages else STAGES
+    print("🚀 Starting " + (f"stage(s) {', '.join(args.stages)}..." if args.stages
+                           else "full Open-Data Signals workflow..."))
+    try:
+        run_pipeline(stages, force=args.force, memory_cap_mb=args.memory_cap)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        exit(1)
+    if args.no_app or args.stages:
+        print("\n🎯 All preprocessing and training done!")
+    else:
+        print("\n🎯 All preprocessing and training done! Launching dashboard...\n")
+        run_command("🌐 Streamlit app", APP_COMMAND)
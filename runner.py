@@ -0,0 +1,223 @@
+# runner.py
+import json
+import hashlib
+import importlib
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+import telemetry
+
+MANIFEST_PATH = "./data/runner_manifest.json"
+MAX_WORKERS = 2  # model fits, then predict + backtest, can run side by side
+
+# ---------------------------------------------------------------------
+# Stage declarations
+# ---------------------------------------------------------------------
+@dataclass
+class Stage:
+    name: str
+    target: str                    # "module:function", imported only when the stage runs
+    inputs: list
+    outputs: list
+    code: list                     # source files whose content is part of the fingerprint
+    params: list = field(default_factory=list)  # "module.CONSTANT" values in the fingerprint
+
+
+def _models(model):
+    """Saved model file per target horizon (train.model_name, without importing train)."""
+    return [f"./models/{model}.pkl" if h == 1 else f"./models/{model}_{h}w.pkl"
+            for h in config.TARGET_HORIZONS]
+
+
+STAGES = [
+    Stage("dataset", "data_pipeline:build_dataset",
+          inputs=[config.AMFI_FILE, config.INDEX_PRICES_FILE, config.VIX_FILE],
+          outputs=["./data/weekly_panel.parquet"],
+          code=["data_pipeline.py", "amfi.py", "vix.py", "store.py", "utils.py"],
+          params=["config.UNIVERSE", "config.SYNTHETIC_UNIVERSE", "config.AMFI_CATEGORY_MAP",
+                  "config.AMFI_PUBLICATION_LAG_DAYS", "config.WEEKDAY_CUTOFF", "config.PUBLICATION_TIME"]),
+    Stage("features", "features:main",
+          inputs=["./data/weekly_panel.parquet"],
+          outputs=["./data/features.parquet", "./data/features_state.parquet", "./data/features.fmat"],
+          code=["features.py", "store.py", "utils.py"],
+          params=["config.TARGET_HORIZONS"]),
+    Stage("train_elastic", "train:fit_elastic",
+          inputs=["./data/features.parquet", "./data/tune/best_params.json"],
+          outputs=_models("elasticnet"),
+          code=["train.py", "utils.py"],
+          params=["config.MODEL_REFRESH", "config.TARGET_HORIZONS"]),
+    Stage("train_lgbm", "train:fit_lgbm",
+          inputs=["./data/features.parquet", "./data/tune/best_params.json"],
+          outputs=_models("lgbm"),
+          code=["train.py", "utils.py"],
+          params=["config.MODEL_REFRESH", "config.TARGET_HORIZONS"]),
+    Stage("predict", "predict:score_models",
+          inputs=["./data/features.parquet", *_models("elasticnet"), *_models("lgbm")],
+          outputs=["./data/predictions.parquet"],
+          code=["predict.py", "inference.py", "store.py", "utils.py"]),
+    Stage("backtest", "backtest:run_backtest",
+          inputs=["./data/features.parquet", "./models/lgbm.pkl"],
+          outputs=["./data/backtest_results.csv", "./data/backtest_portfolio_avg.csv"],
+          code=["backtest.py", "inference.py", "utils.py"],
+          params=["backtest.MODEL_PATH", "backtest.EMA_SPAN",
+                  "backtest.THRESHOLD_SCALE", "backtest.TRANSACTION_COST"]),
+    Stage("backtest_topk", "backtest:run_topk_backtest",
+          inputs=["./data/features.parquet", "./models/lgbm.pkl"],
+          outputs=["./data/topk_portfolio.csv", "./data/topk_weights.parquet"],
+          code=["backtest.py", "inference.py", "utils.py"],
+          params=["backtest.MODEL_PATH"]),
+]
+
+# ---------------------------------------------------------------------
+# Helper: fingerprints
+# ---------------------------------------------------------------------
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        return json.loads(Path(path).read_text())
+    except (FileNotFoundError, ValueError):
+        return {"files": {}, "stages": {}}
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def file_hash(path, files):
+    """sha256 of a file's content, reusing the cached digest while size and mtime are unchanged."""
+    p = Path(path)
+    if not p.exists():
+        return "missing"
+    st = p.stat()
+    cached = files.get(str(path))
+    if cached and cached["size"] == st.st_size and cached["mtime_ns"] == st.st_mtime_ns:
+        return cached["sha256"]
+    digest = hashlib.sha256()
+    with open(p, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    files[str(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def config_values():
+    return {k: getattr(config, k) for k in dir(config) if k.isupper()}
+
+
+def param_value(ref):
+    module, attr = ref.rsplit(".", 1)
+    return getattr(importlib.import_module(module), attr)
+
+
+def stage_fingerprint(stage, files):
+    payload = {
+        "stage": stage.name,
+        "target": stage.target,
+        "inputs": {p: file_hash(p, files) for p in stage.inputs},
+        "code": {p: file_hash(p, files) for p in stage.code},
+        "config": config_values(),
+        "params": {ref: param_value(ref) for ref in stage.params},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def is_fresh(stage, fingerprint, manifest):
+    record = manifest["stages"].get(stage.name)
+    if not record or record["fingerprint"] != fingerprint:
+        return False
+    return all(file_hash(p, manifest["files"]) == h for p, h in record["outputs"].items())
+
+# ---------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------
+def upstream(stages):
+    """Stage name -> names of the stages producing its inputs."""
+    producer = {out: s.name for s in stages for out in s.outputs}
+    return {s.name: {producer[i] for i in s.inputs if i in producer} for s in stages}
+
+
+def run_stage(stage, memory_cap_mb=None):
+    """
+    Run one stage; returns (seconds, peak process RSS in MB while it ran). With a cap,
+    the stage is stopped with telemetry.MemoryCapExceeded once sampled RSS goes over it.
+    """
+    module, func = stage.target.split(":")
+    with telemetry.span(stage.name, stage=True, rss_limit_mb=memory_cap_mb) as span:
+        getattr(importlib.import_module(module), func)()
+    return span.wall_s, span.peak_rss_mb
+
+
+def run_pipeline(stages=STAGES, force=False, workers=MAX_WORKERS, manifest_path=MANIFEST_PATH,
+                 memory_cap_mb=None):
+    """
+    Run stages in dependency order, in-process. A stage is skipped when the hash of its
+    inputs, code, config and params matches the manifest and its outputs are intact;
+    stages whose upstream stages are done run concurrently.
+
+    With a memory cap (default config.MEMORY_CAP_MB) stages run one at a time in
+    low-memory mode. The RSS sampler checks the cap while a stage runs and stops the
+    stage as soon as process RSS goes over it, which fails the pipeline. A single
+    numpy or LightGBM call is not interrupted, so the stop lands when it returns; a
+    final check on the stage's peak catches overruns between samples.
+    """
+    memory_cap_mb = config.MEMORY_CAP_MB if memory_cap_mb is None else memory_cap_mb
+    if memory_cap_mb is not None:
+        config.LOW_MEMORY = True
+        workers = 1  # concurrent stages would share the budget
+        print(f"[runner] Memory cap {memory_cap_mb:.0f} MB: low-memory mode, one stage at a time.")
+    manifest = load_manifest(manifest_path)
+    deps = upstream(stages)
+    pending = {s.name: s for s in stages}
+    done, running, failed = set(), {}, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for name in [n for n in pending if deps[n] <= done and failed is None]:
+                stage = pending.pop(name)
+                fingerprint = stage_fingerprint(stage, manifest["files"])
+                if not force and is_fresh(stage, fingerprint, manifest):
+                    print(f"[runner] ⏭️  {name}: up to date, skipped.")
+                    done.add(name)
+                    continue
+                print(f"[runner] ▶️  {name}: running...")
+                running[pool.submit(run_stage, stage, memory_cap_mb)] = (stage, fingerprint)
+
+            if not running:
+                if failed is None and any(deps[n] <= done for n in pending):
+                    continue  # stages unblocked by skipped upstream stages
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, fingerprint = running.pop(future)
+                try:
+                    elapsed, peak_mb = future.result()
+                except telemetry.MemoryCapExceeded:
+                    print(f"[runner] ❌ {stage.name} stopped: RSS went over the "
+                          f"{memory_cap_mb:.0f} MB cap.")
+                    failed = failed or stage.name
+                    continue
+                except Exception as e:
+                    print(f"[runner] ❌ {stage.name} failed: {e}")
+                    failed = failed or stage.name
+                    continue
+                if memory_cap_mb is not None and peak_mb > memory_cap_mb:
+                    print(f"[runner] ❌ {stage.name} peaked at {peak_mb:.0f} MB, "
+                          f"over the {memory_cap_mb:.0f} MB cap.")
+                    failed = failed or stage.name
+                    continue
+                manifest["stages"][stage.name] = {
+                    "fingerprint": fingerprint,
+                    "outputs": {p: file_hash(p, manifest["files"]) for p in stage.outputs},
+                    "seconds": round(elapsed, 3),
+                    "peak_rss_mb": round(peak_mb, 1),
+                }
+                save_manifest(manifest, manifest_path)
+                print(f"[runner] ✅ {stage.name} completed in {elapsed:.1f}s (peak RSS {peak_mb:.0f} MB).")
+                done.add(stage.name)
+
+    if failed:
+        raise RuntimeError(f"Pipeline stopped: stage '{failed}' failed.")
+    return done
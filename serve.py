@@ -0,0 +1,241 @@
+# serve.py
+import json
+import time
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import inference
+from utils import load_data
+from store import load_frame
+from predict import MODELS
+from features import STATE_PATH, advance_windows, _state_columns
+from backtest import FEATURE_COLS, EMA_SPAN, THRESHOLD_SCALE, MODEL_PATH, regime_step
+
+HOST = "127.0.0.1"
+PORT = 8765
+RESULTS_PATH = "./data/backtest_results.csv"
+
+# ---------------------------------------------------------------------
+# In-memory scoring state
+# ---------------------------------------------------------------------
+class Scorer:
+    """
+    Per-instrument rolling windows, last price, smoothed signal and regime, held in
+    memory so a new week is scored without rebuilding features. Models are fetched
+    through inference.load_model on every call, so new pickles from train.py are
+    picked up as soon as they are written; the state reloads when the pipeline
+    rewrites the features state file.
+    """
+
+    def __init__(self, state_path=STATE_PATH, models=MODELS, signal_model=MODEL_PATH,
+                 results_path=RESULTS_PATH):
+        self.state_path = Path(state_path)
+        self.models = models
+        self.signal_name = Path(signal_model).stem
+        self.results_path = results_path
+        self.lock = threading.Lock()
+        self.token = None
+        self.reload()
+
+    def reload(self):
+        state = load_data(str(self.state_path))
+        if state is None:
+            raise FileNotFoundError(f"❌ features state not found at {self.state_path}. Run features.py first.")
+        self.token = self.state_path.stat().st_mtime_ns
+        self.names = state["index"].astype(str).to_numpy(dtype=object)
+        self.slot = {name: i for i, name in enumerate(self.names)}
+        self.r_hist = state[_state_columns("r_1w")].to_numpy(dtype=float)
+        self.flow_hist = state[_state_columns("flow")].to_numpy(dtype=float)
+        self.last_date = pd.to_datetime(state["Date"]).to_numpy()
+        self.last_price = state["price"].to_numpy(dtype=float) if "price" in state else np.full(len(state), np.nan)
+
+        # Signal state continues the backtest: EMA of predictions and hysteresis regime
+        n = len(self.names)
+        self.signal = np.full(n, np.nan)
+        self.regime = np.zeros(n, dtype=np.int8)
+        self.threshold = np.full(n, np.inf)  # no trades until an instrument has history
+        results = load_frame("backtest_results", self.results_path,
+                             columns=["Date", "index", "signal_smooth", "position"])
+        if results is not None and len(results):
+            results = results.assign(index=results["index"].astype(str))
+            results = results.sort_values(["index", "Date"], kind="stable")
+            groups = results.groupby("index", sort=False)
+            std = groups["signal_smooth"].std(ddof=0)
+            last = groups.last()
+            j = last.index.map(self.slot).to_numpy(dtype=float)
+            known = ~np.isnan(j)
+            j = j[known].astype(int)
+            std = std.to_numpy()[known]
+            self.threshold[j] = THRESHOLD_SCALE * np.where(np.isfinite(std) & (std > 0), std, 1e-6)
+            self.signal[j] = last["signal_smooth"].to_numpy(dtype=float)[known]
+            # the last row's position is the state before its own signal
+            self.regime[j] = regime_step(last["position"].to_numpy()[known], self.signal[j],
+                                         self.threshold[j], -self.threshold[j])
+        print(f"[serve] Loaded state for {n} instruments")
+
+    def _maybe_reload(self):
+        if self.state_path.exists() and self.state_path.stat().st_mtime_ns != self.token:
+            print("[serve] features state changed on disk, reloading...")
+            self.reload()
+
+    def _slots(self, names):
+        new = [n for n in dict.fromkeys(names) if n not in self.slot]
+        if new:
+            k = len(new)
+            self.names = np.r_[self.names, np.array(new, dtype=object)]
+            self.slot.update({n: len(self.slot) + i for i, n in enumerate(new)})
+            self.r_hist = np.vstack([self.r_hist, np.full((k, self.r_hist.shape[1]), np.nan)])
+            self.flow_hist = np.vstack([self.flow_hist, np.full((k, self.flow_hist.shape[1]), np.nan)])
+            self.last_date = np.r_[self.last_date, np.full(k, np.datetime64("NaT"), dtype=self.last_date.dtype)]
+            self.last_price = np.r_[self.last_price, np.full(k, np.nan)]
+            self.signal = np.r_[self.signal, np.full(k, np.nan)]
+            self.regime = np.r_[self.regime, np.zeros(k, dtype=np.int8)]
+            self.threshold = np.r_[self.threshold, np.full(k, np.inf)]
+        return np.array([self.slot[n] for n in names], dtype=int)
+
+    def score(self, rows, commit=True):
+        """
+        Score one newly published week per instrument. Each row needs index, Date,
+        flow and either price or r_1w. With commit=True the in-memory state advances;
+        rows not newer than an instrument's last week are returned as skipped.
+        """
+        frame = pd.DataFrame(rows)
+        missing = {"index", "Date", "flow"} - set(frame.columns)
+        if missing or not ({"price", "r_1w"} & set(frame.columns)):
+            raise ValueError(f"rows need index, Date, flow and price or r_1w; missing {sorted(missing) or ['price']}")
+        frame["index"] = frame["index"].astype(str)
+        frame["Date"] = pd.to_datetime(frame["Date"])
+        frame = frame.drop_duplicates("index", keep="last").reset_index(drop=True)
+        for col in ("price", "r_1w", "flow"):
+            frame[col] = pd.to_numeric(frame.get(col, np.nan), errors="coerce")
+
+        with self.lock:
+            self._maybe_reload()
+            j = self._slots(frame["index"].tolist())
+            stale = ~np.isnat(self.last_date[j]) & (self.last_date[j] >= frame["Date"].to_numpy())
+            skipped = frame.loc[stale, ["index", "Date"]]
+            frame, j = frame[~stale].reset_index(drop=True), j[~stale]
+
+            price = frame["price"].to_numpy(dtype=float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                r_1w = np.where(frame["r_1w"].notna(), frame["r_1w"], price / self.last_price[j] - 1)
+            r_1w = np.nan_to_num(r_1w, nan=0.0, posinf=0.0, neginf=0.0)  # as data_pipeline's fillna(0)
+            flow = frame["flow"].to_numpy(dtype=float)
+            values, r_hist, flow_hist = advance_windows(self.r_hist[j], self.flow_hist[j], r_1w, flow)
+            values["r_1w"] = r_1w
+            X = np.column_stack([values[c] for c in FEATURE_COLS])
+
+            preds = {}
+            for name, path in self.models.items():
+                if Path(path).exists():
+                    preds[name] = inference.predict(inference.load_model(path), X)
+
+            signal = regime = None
+            if self.signal_name in preds:
+                p = preds[self.signal_name]
+                alpha = 2 / (EMA_SPAN + 1)
+                prev = self.signal[j]
+                signal = np.where(np.isnan(prev), p, alpha * p + (1 - alpha) * prev)
+                regime = regime_step(self.regime[j], signal, self.threshold[j], -self.threshold[j])
+
+            if commit:
+                self.r_hist[j], self.flow_hist[j] = r_hist, flow_hist
+                self.last_date[j] = frame["Date"].to_numpy()
+                self.last_price[j] = np.where(np.isnan(price), self.last_price[j], price)
+                if signal is not None:
+                    self.signal[j], self.regime[j] = signal, regime
+
+        out = frame[["index", "Date"]].assign(Date=frame["Date"].dt.strftime("%Y-%m-%d"))
+        for c in FEATURE_COLS:
+            out[c] = values[c]
+        for name, p in preds.items():
+            out[name] = p
+        if signal is not None:
+            out["signal_smooth"] = signal
+            out["position"] = regime.astype(int)  # target position for the coming week
+        return {
+            "rows": _records(out),
+            "skipped": _records(skipped.assign(Date=skipped["Date"].dt.strftime("%Y-%m-%d"))),
+            "committed": bool(commit),
+        }
+
+    def health(self):
+        return {
+            "status": "ok",
+            "instruments": len(self.names),
+            "last_date": str(pd.Series(self.last_date).max().date()) if len(self.names) else None,
+            "models": {name: Path(path).stat().st_mtime_ns if Path(path).exists() else None
+                       for name, path in self.models.items()},
+        }
+
+
+def _records(frame):
+    """JSON-safe records at full precision (NaN → null)."""
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+# ---------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------
+class Handler(BaseHTTPRequestHandler):
+    scorer = None
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.scorer.health())
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/score":
+                start = time.perf_counter()
+                result = self.scorer.score(payload.get("rows", []), commit=payload.get("commit", True))
+                result["elapsed_ms"] = round((time.perf_counter() - start) * 1e3, 3)
+                self._send(200, result)
+            elif self.path == "/reload":
+                with self.scorer.lock:
+                    self.scorer.reload()
+                self._send(200, self.scorer.health())
+            else:
+                self._send(404, {"error": f"unknown path {self.path}"})
+        except (ValueError, KeyError) as e:
+            self._send(400, {"error": str(e)})
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+
+    def log_message(self, fmt, *args):
+        print(f"[serve] {self.address_string()} {fmt % args}")
+
+
+def make_server(host=HOST, port=PORT, scorer=None):
+    """HTTP server bound to host:port (port 0 picks a free one); call serve_forever()."""
+    handler = type("ScoringHandler", (Handler,), {"scorer": scorer or Scorer()})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve weekly scores from warm models and feature state.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port)
+    print(f"[serve] Listening on http://{args.host}:{server.server_address[1]} (POST /score, GET /health)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[serve] Stopped.")
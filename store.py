@@ -0,0 +1,287 @@
+# store.py
+import os
+import json
+import zlib
+import uuid
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from utils import load_data
+import telemetry
+
+STORE_DIR = "./data/store"
+PARTITION_COLS = ["bucket", "year"]
+STORE_BUCKETS = 32  # instruments hash into this many partitions, not one directory each
+MATRIX_PATH = "./data/features.fmat"
+MATRIX_MAGIC = b"ODSFMAT1"
+MATRIX_ALIGN = 64   # every array starts on a 64-byte boundary
+
+_MATRICES = {}  # path -> ((mtime_ns, size), FeatureMatrix)
+
+# ---------------------------------------------------------------------
+# Partitioned Parquet datasets: <STORE_DIR>/<name>/bucket=<b>/year=<yyyy>/*.parquet
+# ---------------------------------------------------------------------
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([("bucket", pa.int16()), ("year", pa.int32())]), flavor="hive")
+
+
+def instrument_bucket(names, buckets=STORE_BUCKETS):
+    """Stable partition bucket per instrument name (crc32, unlike Python's salted hash)."""
+    codes, uniques = pd.factorize(pd.Series(names).astype(str))
+    table = np.array([zlib.crc32(n.encode()) % buckets for n in uniques], dtype=np.int16)
+    return table[codes]
+
+
+def dataset_path(name, store_dir=STORE_DIR):
+    return Path(store_dir) / name
+
+
+def dataset_exists(name, store_dir=STORE_DIR):
+    path = dataset_path(name, store_dir)
+    if any(path.glob("index=*")):
+        return False  # old per-index layout; rebuilt by the next full write
+    return path.exists() and any(path.rglob("*.parquet"))
+
+
+def write_dataset(df: pd.DataFrame, name, mode="overwrite", store_dir=STORE_DIR):
+    """
+    Write a long (Date, index, ...) frame partitioned by instrument bucket and year.
+    mode="overwrite" replaces the dataset, "replace_partitions" rewrites only the
+    (bucket, year) partitions present in df (so df must hold every instrument of
+    those years), and "append" adds files next to the existing ones.
+    """
+    with telemetry.span("write_dataset", dataset=name, mode=mode):
+        _write_dataset(df, name, mode, store_dir)
+
+
+def _write_dataset(df, name, mode, store_dir):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = dataset_path(name, store_dir)
+    if path.exists() and (mode == "overwrite" or any(path.glob("index=*"))):
+        shutil.rmtree(path)
+    behavior = "overwrite_or_ignore" if mode == "append" else "delete_matching"
+
+    df = df.assign(
+        bucket=instrument_bucket(df["index"]),
+        year=pd.to_datetime(df["Date"]).dt.year.astype("int32"),
+    )
+    df["index"] = df["index"].astype(str)  # Parquet dictionary-encodes the names
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    n_parts = len(df[PARTITION_COLS].drop_duplicates())
+    token = uuid.uuid4().hex[:12]
+    ds.write_dataset(
+        table, path, format="parquet", partitioning=_partitioning(),
+        existing_data_behavior=behavior, max_partitions=max(n_parts, 1024),
+        basename_template=f"part-{token}-{{i}}.parquet",
+    )
+    telemetry.count(rows_out=len(df), bytes_written=sum(f.stat().st_size for f in path.rglob(f"part-{token}-*")))
+    print(f"[store] wrote {len(df)} rows → {path} ({mode})")
+
+
+def read_dataset(name, columns=None, start=None, end=None, indices=None, store_dir=STORE_DIR):
+    """
+    Read a dataset with column projection and predicate pushdown: only partitions for
+    the requested indices' buckets and years are opened, and Date filters use Parquet
+    statistics. `start` is exclusive and `end` inclusive; `index` comes back as a
+    categorical. Returns None if the dataset is missing.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    path = dataset_path(name, store_dir)
+    if not dataset_exists(name, store_dir):
+        print(f"[store] dataset not found: {path}")
+        return None
+    dataset = ds.dataset(path, format="parquet", partitioning=_partitioning())
+
+    filt = None
+    def both(a, b):
+        return b if a is None else a & b
+    if start is not None:
+        start = pd.Timestamp(start)
+        filt = both(filt, (ds.field("year") >= start.year) & (ds.field("Date") > pa.scalar(start, pa.timestamp("ns"))))
+    if end is not None:
+        end = pd.Timestamp(end)
+        filt = both(filt, (ds.field("year") <= end.year) & (ds.field("Date") <= pa.scalar(end, pa.timestamp("ns"))))
+    if indices is not None:
+        indices = [str(i) for i in indices]
+        buckets = sorted(set(instrument_bucket(indices).tolist()))
+        filt = both(filt, ds.field("bucket").isin(buckets) & ds.field("index").isin(indices))
+
+    if columns is None:
+        columns = [c for c in dataset.schema.names if c not in PARTITION_COLS]
+    columns = [c for c in columns if c in dataset.schema.names]
+    with telemetry.span("read_dataset", dataset=name):
+        df = dataset.to_table(columns=list(columns), filter=filt).to_pandas()
+        # files left after partition pruning (projection may read less of each)
+        telemetry.count(rows_in=len(df), bytes_read=sum(
+            telemetry.path_bytes(f.path) for f in dataset.get_fragments(filter=filt)))
+    if "index" in df.columns:
+        df["index"] = df["index"].astype("category")
+    sort_cols = [c for c in ["index", "Date"] if c in df.columns]
+    if sort_cols:
+        df = df.sort_values(sort_cols, kind="stable").reset_index(drop=True)
+    print(f"[store] read {len(df)} rows x {len(df.columns)} cols from {path}")
+    return df
+
+
+def load_frame(name, fallback_path, columns=None, start=None, end=None, indices=None):
+    """Read from the partitioned store when present, else from the single-file export."""
+    if dataset_exists(name):
+        return read_dataset(name, columns=columns, start=start, end=end, indices=indices)
+    df = load_data(fallback_path)
+    if df is None:
+        return None
+    if columns is not None:
+        df = df[[c for c in columns if c in df.columns]]
+    if "Date" in df.columns and (start is not None or end is not None):
+        dates = pd.to_datetime(df["Date"])
+        keep = pd.Series(True, index=df.index)
+        if start is not None:
+            keep &= dates > pd.Timestamp(start)
+        if end is not None:
+            keep &= dates <= pd.Timestamp(end)
+        df = df[keep]
+    if indices is not None and "index" in df.columns:
+        df = df[df["index"].isin(indices)]
+    return df
+
+# ---------------------------------------------------------------------
+# Memory-mapped feature matrix: one file, read-only views for every reader
+#   MATRIX_MAGIC | header length (uint64) | JSON header | aligned arrays
+# ---------------------------------------------------------------------
+def write_matrix(df, columns, targets=("target",), path=MATRIX_PATH):
+    """
+    Write rows of a long (Date, index, <columns>, <targets>, is_future_prediction)
+    frame as a contiguous float32 matrix X plus one float32 array per target and
+    per-row date, instrument code and future flag, sorted by (instrument name, Date).
+    The header lists the columns, targets, instrument names and where each array
+    lives. The file is replaced atomically, so readers that still map the old one
+    keep a consistent view.
+    """
+    names = df["index"].astype(str).to_numpy()
+    codes, instruments = pd.factorize(names, sort=True)
+    dates = pd.to_datetime(df["Date"]).to_numpy("datetime64[ns]")
+    order = np.lexsort((dates, codes))
+
+    X = np.empty((len(df), len(columns)), dtype=np.float32)
+    for j, c in enumerate(columns):
+        X[:, j] = df[c].to_numpy()[order]
+    targets = [t for t in targets if t in df]
+    future = (df["is_future_prediction"].to_numpy(dtype=bool)[order] if "is_future_prediction" in df
+              else np.zeros(len(df), bool))
+    arrays = {"X": X, "date": dates[order], "code": codes[order].astype(np.int32), "future": future}
+    for t in targets:
+        arrays[t] = df[t].to_numpy(dtype=np.float32)[order]
+
+    specs, offset = {}, 0
+    for name, a in arrays.items():
+        specs[name] = {"offset": offset, "dtype": a.dtype.str, "shape": list(a.shape)}
+        offset += -(-a.nbytes // MATRIX_ALIGN) * MATRIX_ALIGN
+    header = json.dumps({"version": 1, "rows": len(df), "columns": list(columns), "targets": targets,
+                         "instruments": [str(n) for n in instruments], "arrays": specs}).encode()
+    start = -(-(len(MATRIX_MAGIC) + 8 + len(header)) // MATRIX_ALIGN) * MATRIX_ALIGN
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with telemetry.span("write_matrix", path=str(path)):
+        with open(tmp, "wb") as f:
+            f.write(MATRIX_MAGIC + len(header).to_bytes(8, "little") + header)
+            for name, a in arrays.items():
+                f.seek(start + specs[name]["offset"])
+                f.write(np.ascontiguousarray(a).tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp, path)
+        telemetry.count(rows_out=len(df), bytes_written=telemetry.path_bytes(path))
+    print(f"[store] wrote {len(df)} x {len(columns)} float32 matrix → {path}")
+
+
+class FeatureMatrix:
+    """
+    Read-only view of a file from write_matrix. Opening it reads only the header; X
+    (rows x columns, float32), date, code, future and the target arrays are NumPy
+    views into one memory map, so every process reading the file shares a single
+    page-cache copy.
+    """
+
+    def __init__(self, path=MATRIX_PATH):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            if f.read(len(MATRIX_MAGIC)) != MATRIX_MAGIC:
+                raise ValueError(f"{path} is not a feature matrix file")
+            size = int.from_bytes(f.read(8), "little")
+            self.header = json.loads(f.read(size))
+        start = -(-(len(MATRIX_MAGIC) + 8 + size) // MATRIX_ALIGN) * MATRIX_ALIGN
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+        self._arrays = {}
+        for name, spec in self.header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            lo = start + spec["offset"]
+            view = self._map[lo:lo + int(np.prod(spec["shape"])) * dtype.itemsize].view(dtype)
+            self._arrays[name] = view.reshape(spec["shape"])
+        self.X, self.date = self._arrays["X"], self._arrays["date"]
+        self.code, self.future = self._arrays["code"], self._arrays["future"]
+        self.columns = self.header["columns"]
+        self.targets = self.header.get("targets", [t for t in ("target",) if t in self._arrays])
+        self.target = self._arrays.get("target")
+        self.instruments = np.array(self.header["instruments"], dtype=object)
+
+    def __len__(self):
+        return self.header["rows"]
+
+    def column(self, name):
+        """One feature column (a strided view)."""
+        return self.X[:, self.columns.index(name)]
+
+    def features(self, columns):
+        """X itself when `columns` are all columns in order, else a contiguous copy of those columns."""
+        if list(columns) == self.columns:
+            return self.X
+        return np.ascontiguousarray(self.X[:, [self.columns.index(c) for c in columns]])
+
+    def label(self, name):
+        """One target array (e.g. "target", "target_4w")."""
+        return self._arrays[name]
+
+    def meta(self, rows=slice(None)):
+        """(Date, index) frame of the rows; index is categorical over all instruments."""
+        return pd.DataFrame({
+            "Date": self.date[rows],
+            "index": pd.Categorical.from_codes(self.code[rows], categories=self.instruments),
+        })
+
+    def frame(self, columns=None, rows=slice(None)):
+        """Rows as a regular long frame (copies): Date, index, columns, targets, is_future_prediction."""
+        df = self.meta(rows)
+        for c in self.columns if columns is None else columns:
+            df[c] = self.column(c)[rows]
+        for t in self.targets:
+            df[t] = self.label(t)[rows]
+        df["is_future_prediction"] = self.future[rows]
+        return df
+
+
+def open_matrix(path=MATRIX_PATH, newer_than=()):
+    """
+    The FeatureMatrix at path, mapped once per file version; None when it is missing
+    or older than any of the `newer_than` files (e.g. a features.parquet written since).
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    stat = path.stat()
+    for other in newer_than:
+        if Path(other).exists() and Path(other).stat().st_mtime_ns > stat.st_mtime_ns:
+            print(f"[store] {path} is older than {other}; not using it")
+            return None
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _MATRICES.get(str(path))
+    if cached is None or cached[0] != key:
+        cached = _MATRICES[str(path)] = (key, FeatureMatrix(path))
+    return cached[1]
@@ -0,0 +1,127 @@
+# sweep.py
+import os
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+
+import backtest
+from utils import save_data
+
+OUT_PATH = "./data/sweep_results.csv"
+MODEL_PATHS = ["./models/lgbm.pkl", "./models/elasticnet.pkl"]
+
+DEFAULT_SPANS = [4, 8, 16]
+DEFAULT_THRESHOLDS = [0.25, 0.5, 1.0]
+DEFAULT_COSTS = [0.0005, 0.001, 0.002]
+
+# Worker-side views onto the shared arrays (set by _attach)
+_SHARED = {}
+_SEGMENTS = []
+
+# ---------------------------------------------------------------------
+# Helper: read-only arrays in shared memory
+# ---------------------------------------------------------------------
+def _share(arrays):
+    """Copy arrays into shared memory once; returns the blocks and a picklable spec."""
+    blocks, spec = [], {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        blocks.append(shm)
+        spec[name] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, spec
+
+
+def _attach(spec):
+    """Pool initializer: map the shared arrays without copying them."""
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        arr.flags.writeable = False
+        _SEGMENTS.append(shm)
+        _SHARED[name] = arr
+
+
+def _evaluate(task):
+    model_i, span, scale, cost = task
+    sim = backtest.simulate(
+        _SHARED["group"], _SHARED["r_1w"], _SHARED["predictions"][model_i],
+        ema_span=span, threshold_scale=scale, transaction_cost=cost,
+    )
+    return backtest.summarize(_SHARED["dates"], sim["Portfolio_Value"], sim["turnover"])
+
+# ---------------------------------------------------------------------
+# Sweep
+# ---------------------------------------------------------------------
+def run_sweep(spans=DEFAULT_SPANS, thresholds=DEFAULT_THRESHOLDS, costs=DEFAULT_COSTS,
+              model_paths=MODEL_PATHS, workers=None, out_path=OUT_PATH):
+    """
+    Evaluate every (model, span, threshold, cost) combination. Features are loaded and
+    each model predicts once; the arrays are shared read-only with the worker pool.
+    """
+    print("[sweep] Loading features...")
+    df, feature_cols, X = backtest.load_backtest_frame()
+
+    model_paths = [p for p in model_paths if Path(p).exists()]
+    if not model_paths:
+        raise FileNotFoundError("❌ No model files found. Run train.py first.")
+
+    print(f"[sweep] Predicting with {len(model_paths)} model(s)...")
+    predictions = np.vstack([
+        backtest.predict_returns(X, p) for p in model_paths
+    ])
+    arrays = {
+        "group": pd.factorize(df["index"])[0].astype(np.int32),
+        "dates": df["Date"].to_numpy().astype("datetime64[ns]").view(np.int64),
+        "r_1w": df["r_1w"].to_numpy(dtype=float),
+        "predictions": predictions,
+    }
+
+    tasks = list(itertools.product(range(len(model_paths)), spans, thresholds, costs))
+    workers = workers or min(len(tasks), os.cpu_count() or 1)
+    print(f"[sweep] Evaluating {len(tasks)} combinations on {workers} worker(s)...")
+
+    if workers == 1:
+        _SHARED.update(arrays)
+        try:
+            results = [_evaluate(t) for t in tasks]
+        finally:
+            _SHARED.clear()
+    else:
+        blocks, spec = _share(arrays)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                     initargs=(spec,)) as pool:
+                results = list(pool.map(_evaluate, tasks, chunksize=max(1, len(tasks) // (4 * workers))))
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+
+    table = pd.DataFrame([
+        {"model": Path(model_paths[m]).stem, "ema_span": span,
+         "threshold_scale": scale, "transaction_cost": cost, **res}
+        for (m, span, scale, cost), res in zip(tasks, results)
+    ])
+    table = table.sort_values("sharpe", ascending=False).reset_index(drop=True)
+    save_data(table, out_path)
+    print(f"[sweep] ✅ Saved sweep summary → {out_path}")
+    print(table.head(10).round(4).to_string(index=False))
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Grid-search backtest parameters in parallel.")
+    parser.add_argument("--spans", type=int, nargs="+", default=DEFAULT_SPANS)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--costs", type=float, nargs="+", default=DEFAULT_COSTS)
+    parser.add_argument("--models", nargs="+", default=MODEL_PATHS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default=OUT_PATH)
+    args = parser.parse_args()
+    run_sweep(args.spans, args.thresholds, args.costs, args.models, args.workers, args.out)
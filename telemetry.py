@@ -0,0 +1,293 @@
+# telemetry.py
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+import functools
+import multiprocessing
+from pathlib import Path
+from datetime import datetime, timezone
+
+import utils
+
+METRICS_DIR = "./data/metrics"
+LOG_PATH = f"{METRICS_DIR}/metrics.jsonl"
+PROM_PATH = f"{METRICS_DIR}/metrics.prom"
+PROFILE_DIR = f"{METRICS_DIR}/profiles"
+PROM_PREFIX = "ods"
+SAMPLE_INTERVAL = 0.01  # seconds between RSS samples while any span is open
+TOP_FUNCTIONS = 30      # rows kept in a profile's text summary
+
+# Opt-in cProfile of stage spans: "1"/"all" profiles every stage, otherwise a
+# comma-separated list of stage names (e.g. ODS_PROFILE=features,backtest).
+PROFILE = os.environ.get("ODS_PROFILE", "")
+
+COUNTERS = ("rows_in", "rows_out", "bytes_read", "bytes_written")
+
+_local = threading.local()   # per-thread stack of open spans
+_lock = threading.Lock()
+_open = set()                # every open span, for the RSS sampler
+_sampler = None
+_totals = {}                 # span path -> aggregated values for the Prometheus file
+
+
+class MemoryCapExceeded(MemoryError):
+    """Raised inside a span's thread once the sampler sees process RSS above its rss_limit_mb."""
+
+# ---------------------------------------------------------------------
+# Spans
+# ---------------------------------------------------------------------
+class Span:
+    """
+    One timed stage or sub-step. Wall time, process CPU time and peak RSS are
+    measured while it is open; rows and bytes are added with count(). Counters
+    roll up into the enclosing span when it closes. With rss_limit_mb, the RSS
+    sampler raises MemoryCapExceeded in the span's thread (at its next Python
+    bytecode) as soon as process RSS goes over the limit.
+    """
+
+    def __init__(self, name, stage=False, rss_limit_mb=None, **labels):
+        self.name = name
+        self.stage = stage
+        self.rss_limit_mb = rss_limit_mb
+        self.labels = labels
+        self.path = name
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.peak_rss_mb = 0.0
+        self.wall_s = self.cpu_s = 0.0
+        self.status = "ok"
+        self._profile = None
+
+    def count(self, **values):
+        for k, v in values.items():
+            self.counts[k] = self.counts.get(k, 0) + int(v or 0)
+
+    def __enter__(self):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.path = f"{parent.path}/{self.name}" if parent else self.name
+        stack.append(self)
+        if self.stage and _wants_profile(self.name) and not any(s._profile for s in stack[:-1]):
+            self._profile = cProfile.Profile()
+        self.peak_rss_mb = utils.rss_mb()
+        self.thread_id = threading.get_ident()
+        _watch(self)
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self._profile:
+            try:
+                self._profile.enable()
+            except ValueError:  # another profiler is active (e.g. a concurrent stage on 3.12+)
+                self._profile = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profile:
+            self._profile.disable()
+        self.wall_s = time.perf_counter() - self._wall
+        self.cpu_s = time.process_time() - self._cpu
+        _unwatch(self)
+        self.peak_rss_mb = max(self.peak_rss_mb, utils.rss_mb())
+        if exc_type is not None:
+            self.status = "error"
+
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].count(**self.counts)
+            stack[-1].peak_rss_mb = max(stack[-1].peak_rss_mb, self.peak_rss_mb)
+        try:
+            self._record()
+            if self._profile:
+                save_profile(self._profile, self.path)
+            if not stack and multiprocessing.parent_process() is None:
+                export_prometheus()  # pool workers only append JSON lines
+        except OSError as e:
+            print(f"[telemetry] could not write metrics: {e}")
+        return False
+
+    def _record(self):
+        record = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "span": self.path,
+            "stage": self.stage,
+            "status": self.status,
+            "wall_s": round(self.wall_s, 6),
+            "cpu_s": round(self.cpu_s, 6),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            **self.counts,
+            "pid": os.getpid(),
+            **({"labels": self.labels} if self.labels else {}),
+        }
+        with _lock:
+            total = _totals.setdefault(self.path, {"calls": 0, "errors": 0, "wall_s": 0.0, "cpu_s": 0.0,
+                                                   "peak_rss_mb": 0.0, **dict.fromkeys(COUNTERS, 0)})
+            total["calls"] += 1
+            total["errors"] += self.status == "error"
+            total["wall_s"] += self.wall_s
+            total["cpu_s"] += self.cpu_s
+            total["peak_rss_mb"] = max(total["peak_rss_mb"], self.peak_rss_mb)
+            for k in COUNTERS:
+                total[k] += self.counts.get(k, 0)
+            Path(LOG_PATH).parent.mkdir(parents=True, exist_ok=True)
+            with open(LOG_PATH, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def span(name, stage=False, rss_limit_mb=None, **labels):
+    """Context manager timing one stage (stage=True) or sub-step."""
+    return Span(name, stage=stage, rss_limit_mb=rss_limit_mb, **labels)
+
+
+class PeakRSS:
+    """Peak process RSS over a block from the shared sampler, without recording a span; read .peak_rss_mb."""
+
+    rss_limit_mb = None
+
+    def __enter__(self):
+        self.peak_rss_mb = utils.rss_mb()
+        _watch(self)
+        return self
+
+    def __exit__(self, *exc):
+        _unwatch(self)
+        self.peak_rss_mb = max(self.peak_rss_mb, utils.rss_mb())
+        return False
+
+
+def instrument(name=None, stage=True):
+    """Decorator form of span() for stage functions."""
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with Span(name or func.__name__, stage=stage):
+                return func(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(**values):
+    """Add rows_in / rows_out / bytes_read / bytes_written to this thread's innermost span."""
+    stack = _stack()
+    if stack:
+        stack[-1].count(**values)
+
+
+def current():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def path_bytes(path):
+    """Size of a file, or of every file under a directory."""
+    p = Path(path)
+    try:
+        if p.is_dir():
+            return sum(f.stat().st_size for f in p.rglob("*") if f.is_file())
+        return p.stat().st_size
+    except OSError:
+        return 0
+
+# ---------------------------------------------------------------------
+# Helper: peak RSS sampling (one thread for all open spans and memory limits)
+# ---------------------------------------------------------------------
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def _watch(s):
+    global _sampler
+    with _lock:
+        _open.add(s)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample, daemon=True, name="metrics-rss")
+            _sampler.start()
+
+
+def _unwatch(s):
+    with _lock:
+        _open.discard(s)
+
+
+def _sample():
+    global _sampler
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        rss = utils.rss_mb()
+        with _lock:
+            if not _open:
+                _sampler = None  # the next span starts a new sampler
+                return
+            for s in _open:
+                if rss > s.peak_rss_mb:
+                    s.peak_rss_mb = rss
+                if s.rss_limit_mb is not None and rss > s.rss_limit_mb and not getattr(s, "stopped", False):
+                    s.stopped = True
+                    _raise_in(s.thread_id, MemoryCapExceeded)
+
+
+def _raise_in(thread_id, exc_type):
+    """Raise exc_type asynchronously in another thread (CPython's PyThreadState_SetAsyncExc)."""
+    import ctypes
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread_id), ctypes.py_object(exc_type))
+
+# ---------------------------------------------------------------------
+# Exports
+# ---------------------------------------------------------------------
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def export_prometheus(path=PROM_PATH):
+    """Write every span's totals in the Prometheus text format (textfile-collector style)."""
+    families = [
+        ("calls_total", "counter", "Times the span ran.", "calls", 1),
+        ("errors_total", "counter", "Times the span raised.", "errors", 1),
+        ("wall_seconds_total", "counter", "Wall-clock seconds spent in the span.", "wall_s", 1),
+        ("cpu_seconds_total", "counter", "Process CPU seconds spent in the span.", "cpu_s", 1),
+        ("peak_rss_bytes", "gauge", "Highest process RSS seen while the span was open.", "peak_rss_mb", 2**20),
+        ("rows_in_total", "counter", "Rows loaded in the span.", "rows_in", 1),
+        ("rows_out_total", "counter", "Rows saved in the span.", "rows_out", 1),
+        ("read_bytes_total", "counter", "Bytes of files read in the span.", "bytes_read", 1),
+        ("written_bytes_total", "counter", "Bytes of files written in the span.", "bytes_written", 1),
+    ]
+    with _lock:
+        totals = {k: dict(v) for k, v in _totals.items()}
+    lines = []
+    for name, kind, doc, key, scale in families:
+        metric = f"{PROM_PREFIX}_span_{name}"
+        lines += [f"# HELP {metric} {doc}", f"# TYPE {metric} {kind}"]
+        for span_path, total in sorted(totals.items()):
+            value = total[key] * scale
+            lines.append(f'{metric}{{span="{_label(span_path)}"}} {value:.6g}' if isinstance(value, float)
+                         else f'{metric}{{span="{_label(span_path)}"}} {value}')
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    tmp.write_text("\n".join(lines) + "\n")
+    os.replace(tmp, path)  # scrapers never see a half-written file
+
+
+def _wants_profile(name):
+    value = PROFILE.strip().lower()
+    if value in ("", "0", "false", "no"):
+        return False
+    return value in ("1", "all", "true", "yes") or name.lower() in {v.strip() for v in value.split(",")}
+
+
+def save_profile(profile, span_path, top=TOP_FUNCTIONS):
+    """Save the raw cProfile stats (.prof) and the top functions by cumulative time (.txt)."""
+    out = Path(PROFILE_DIR)
+    out.mkdir(parents=True, exist_ok=True)
+    stem = out / span_path.replace("/", "__")
+    profile.dump_stats(f"{stem}.prof")
+    text = io.StringIO()
+    stats = pstats.Stats(profile, stream=text).strip_dirs().sort_stats("cumulative")
+    stats.print_stats(top)
+    Path(f"{stem}.txt").write_text(text.getvalue())
+    print(f"[telemetry] profile of {span_path} → {stem}.txt")
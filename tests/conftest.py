@@ -0,0 +1,44 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Run every test in a scratch directory: stages write ./data (metrics, store) relative to it."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_panel(n_weeks=80, seed=1):
+    """
+    Long (Date, index, price, r_1w, flow) weekly panel: instruments with staggered
+    starts, a few missing cells, and one instrument that only appears at the end.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2022-01-07", periods=n_weeks, freq="W-FRI")
+    parts = []
+    for i, name in enumerate(["Alpha", "Beta", "Gamma", "Delta"]):
+        d = dates[i * 3:]
+        parts.append(pd.DataFrame({
+            "Date": d, "index": name,
+            "price": 100 + rng.normal(size=len(d)).cumsum(),
+            "r_1w": rng.normal(0, 0.02, len(d)),
+            "flow": rng.normal(size=len(d)),
+        }))
+    parts.append(pd.DataFrame({"Date": dates[-3:], "index": "Late", "price": [10.0, 10.5, 10.2],
+                               "r_1w": [0.0, 0.05, -0.03], "flow": [1.0, -2.0, 0.5]}))
+    panel = pd.concat(parts, ignore_index=True)
+    panel.loc[rng.choice(len(panel), 10, replace=False), "flow"] = np.nan
+    return panel
+
+
+@pytest.fixture
+def panel():
+    return make_panel()
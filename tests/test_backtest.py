@@ -0,0 +1,40 @@
+# tests/test_backtest.py
+import numpy as np
+import pandas as pd
+
+import backtest
+
+
+def reference_states(signal, upper, lower, group):
+    """build_position_for_group applied per group (the loop regime_states replaces)."""
+    df = pd.DataFrame({"group": group, "signal_smooth": signal})
+    return np.concatenate([
+        backtest.build_position_for_group(g, upper[g.index[0]], lower[g.index[0]]).to_numpy()
+        for _, g in df.groupby("group", sort=False)
+    ])
+
+
+def test_regime_states_match_per_group_loop():
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        sizes = rng.integers(1, 40, size=rng.integers(1, 8))
+        group = np.repeat(np.arange(len(sizes)), sizes)
+        signal = rng.normal(size=len(group))
+        band = np.repeat(rng.uniform(0, 1.5, len(sizes)), sizes)  # per-group thresholds
+        start = backtest.group_starts(group)
+        got = backtest.regime_states(signal, band, -band, start)
+        np.testing.assert_array_equal(got, reference_states(signal, band, -band, group))
+
+
+def test_regime_step_continues_regime_states():
+    rng = np.random.default_rng(1)
+    signal = rng.normal(size=(30, 5))
+    upper, lower = 0.5, -0.5
+    state = np.zeros(5, dtype=np.int8)
+    stepped = []
+    for row in signal:
+        state = backtest.regime_step(state, row, upper, lower)
+        stepped.append(state)
+    group = np.repeat(np.arange(5), 30)
+    flat = backtest.regime_states(signal.ravel(order="F"), upper, lower, backtest.group_starts(group))
+    np.testing.assert_array_equal(np.array(stepped).ravel(order="F"), flat)
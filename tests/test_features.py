@@ -0,0 +1,59 @@
+# tests/test_features.py
+import warnings
+
+import numpy as np
+import pytest
+
+import features
+
+COLUMNS = ["price", "flow", "r_1w", "r_4w", "r_12w", "vol_4w", "flow_z", "target"]
+
+
+def _sorted(df):
+    return df.sort_values(["index", "Date"], kind="stable").reset_index(drop=True)
+
+
+def assert_frames_close(left, right, columns, atol=1e-6):
+    assert len(left) == len(right)
+    assert (left["Date"].to_numpy() == right["Date"].to_numpy()).all()
+    assert (left["index"].astype(str).to_numpy() == right["index"].astype(str).to_numpy()).all()
+    for c in columns:
+        np.testing.assert_allclose(left[c].to_numpy(float), right[c].to_numpy(float),
+                                   atol=atol, rtol=0, equal_nan=True, err_msg=c)
+
+
+def test_build_features_matches_reference(panel):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # the reference uses deprecated groupby.apply
+        ref = _sorted(features.build_features_reference(panel))
+    fast = features.build_features(panel, low_memory=False)
+    assert_frames_close(fast, ref, COLUMNS)
+    assert (fast["is_future_prediction"].to_numpy() == ref["is_future_prediction"].to_numpy()).all()
+
+
+def test_horizon_targets_compound_forward_returns(panel):
+    feats = features.build_features(panel, low_memory=False)
+    for h in (4, 12):
+        col = features.target_column(h)
+        expected = []
+        for _, g in feats.groupby("index", observed=True, sort=False):
+            r = g["r_1w"].to_numpy()
+            expected += [np.prod(1 + r[i + 1:i + h + 1]) - 1 if i + h < len(r) else np.nan
+                         for i in range(len(r))]
+        np.testing.assert_allclose(feats[col].to_numpy(float), expected, atol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize("low_memory", [False, True])
+def test_incremental_update_matches_full_build(panel, low_memory):
+    dates = np.sort(panel["Date"].unique())
+    cut = dates[-6]
+    feats, state = features.build_features(panel[panel["Date"] < cut], return_state=True,
+                                           low_memory=low_memory)
+    updated, _ = features.update_features(panel[panel["Date"] >= dates[-7]], feats, state)
+    full = features.build_features(panel, low_memory=low_memory)
+
+    atol = 1e-5 if low_memory else 1e-9
+    assert_frames_close(_sorted(updated), _sorted(full),
+                        [*COLUMNS, *features.target_columns([4, 12])], atol=atol)
+    assert (_sorted(updated)["is_future_prediction"].to_numpy()
+            == _sorted(full)["is_future_prediction"].to_numpy()).all()
@@ -0,0 +1,27 @@
+# tests/test_telemetry.py
+import time
+import numpy as np
+import pytest
+
+import telemetry
+import utils
+
+
+def test_rss_limit_stops_span_while_running():
+    base = utils.rss_mb()
+    bufs = []
+    with pytest.raises(telemetry.MemoryCapExceeded):
+        with telemetry.span("hog", rss_limit_mb=base + 200):
+            for _ in range(100):
+                bufs.append(np.ones(10_000_000))
+                time.sleep(0.02)
+    assert len(bufs) < 100
+
+
+def test_peak_rss_tracks_block():
+    base = utils.rss_mb()
+    with telemetry.PeakRSS() as rss:
+        x = np.ones(20_000_000)
+        time.sleep(0.05)
+    assert rss.peak_rss_mb - base > 100
+    del x
@@ -0,0 +1,19 @@
+# tests/test_vix.py
+import vix
+
+
+def test_partial_trailing_line_is_left_for_next_run(tmp_path):
+    path = tmp_path / "vix.csv"
+    rows = [f"2024-01-0{d} 10:00:00,1{d},1{d},1{d},1{d}.5\n" for d in range(1, 5)]
+    path.write_text("date,open,high,low,close\n" + "".join(rows[:3]) + rows[3][:12])
+
+    chunks = list(vix.iter_minute_chunks(path, chunk_bytes=40))
+    assert sum(len(b) for b, _ in chunks) == 3
+    offset = chunks[-1][1]
+
+    with open(path, "a") as f:
+        f.write(rows[3][12:])
+    rest = list(vix.iter_minute_chunks(path, offset))
+    assert [len(b) for b, _ in rest] == [1]
+    assert rest[0][0]["close"].tolist() == [14.5]
+    assert rest[-1][1] == path.stat().st_size
@@ -1,66 +1,457 @@
+import os
+import json
+import argparse
+import numpy as np
 import pandas as pd
-import joblib
-import lightgbm as lgb
-from sklearn.linear_model import ElasticNet
-from sklearn.model_selection import train_test_split
-from utils import ensure_data_dir, seed_all, load_data
-from lightgbm import early_stopping, log_evaluation
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from utils import ensure_data_dir, seed_all, save_data
+from store import load_frame, open_matrix, FeatureMatrix
+from features import target_column, target_columns
+import config
+import telemetry
+
+# lightgbm, sklearn and joblib take seconds to import: they load inside the
+# functions that fit or save models, so --help and data-only paths stay fast.
 
 FEAT_PATH = "./data/features.parquet"
+FEAT_COLS = ["r_1w","r_4w","r_12w","flow_z","vol_4w"]
 MODEL_DIR = "./models"
+WALK_FORWARD_DIR = f"{MODEL_DIR}/walk_forward"
+OOS_PATH = "./data/oos_predictions.parquet"
+N_FOLDS = 5
+TUNED_PATH = "./data/tune/best_params.json"  # written by tune.py; used when present
+
+LGB_PARAMS = {
+    "objective": "regression",
+    "metric": "rmse",
+    "learning_rate": 0.05,
+    "num_leaves": 31,
+    "verbose": -1,
+}
+NUM_BOOST_ROUND = 200
+ELASTIC_PARAMS = {"alpha": 0.1, "l1_ratio": 0.5}
+
+# Warm-start refresh (config.MODEL_REFRESH / --refresh)
+VERSIONS_DIR = f"{MODEL_DIR}/versions"   # <model>/<version>.pkl + .json, newest KEEP_VERSIONS kept
+KEEP_VERSIONS = 20
+REFRESH_WEEKS = 52      # recent labelled weeks LightGBM keeps boosting on
+REFRESH_ROUNDS = 20     # trees added per refresh
+MAX_REFRESHES = 12      # refreshes in a row before a full retrain
+DRIFT_TOLERANCE = 0.25  # full retrain when RMSE on unseen weeks > (1 + tol) x validation RMSE
 
 def load_feats():
-    df = load_data(FEAT_PATH)
+    """
+    In low-memory mode, the memory-mapped float32 feature matrix (store.FeatureMatrix)
+    when it is current, so X is never decoded or copied; otherwise the float64 feature
+    frame from the store / parquet.
+    """
+    fm = open_matrix(newer_than=[FEAT_PATH]) if config.LOW_MEMORY else None
+    if fm is not None and set(FEAT_COLS) <= set(fm.columns) and set(target_columns()) <= set(fm.targets):
+        return fm
+    df = load_frame("features", FEAT_PATH,
+                    columns=["Date", "index", *FEAT_COLS, *target_columns(), "is_future_prediction"])
     if df is None:
         raise FileNotFoundError("features.parquet missing. Run features.py first.")
     return df
 
-def prepare_xy(df):
-    feat_cols = ["r_1w","r_4w","r_12w","flow_z","vol_4w"]
-    feat_cols = [c for c in feat_cols if c in df.columns]
+def prepare_xy(df, target="target"):
+    feat_cols = [c for c in FEAT_COLS if c in df.columns]
+    if isinstance(df, FeatureMatrix):
+        return df.features(feat_cols), df.label(target), df.meta()
     X = df[feat_cols].values
-    y = df["target"].values
+    y = df[target].values
     return X, y, df[["Date","index"]]
 
-def train_elastic(X, y):
-    model = ElasticNet(alpha=0.1, l1_ratio=0.5)
-    model.fit(X, y)
+def tuned_params(model, path=TUNED_PATH):
+    """Best parameters tune.py found for model ("lgbm" / "elasticnet"), or None."""
+    try:
+        with open(path) as f:
+            return json.load(f).get(model)
+    except (OSError, ValueError):
+        return None
+
+def elastic_params(horizon=1):
+    """ElasticNet parameters; tune.py searches the 1-week target only, so longer horizons keep the defaults."""
+    tuned = tuned_params("elasticnet") if horizon == 1 else None
+    return (tuned or {}).get("params", ELASTIC_PARAMS)
+
+def lgb_params(horizon=1):
+    """
+    LightGBM parameters and boosting rounds: LGB_PARAMS with tune.py's best on top
+    for the 1-week target (the one tune.py searches); LGB_PARAMS for longer horizons.
+    """
+    tuned = (tuned_params("lgbm") if horizon == 1 else None) or {}
+    return {**LGB_PARAMS, **tuned.get("params", {})}, tuned.get("num_boost_round")
+
+def train_elastic(X, y, params=None):
+    from sklearn.linear_model import ElasticNet
+    model = ElasticNet(**(elastic_params() if params is None else params))
+    model.fit(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64))
     return model
 
-def train_lgb(X, y):
-    dtrain, dval, ytrain, yval = train_test_split(X, y, test_size=0.2, random_state=42)
+def time_ordered_split(X, y, dates, val_frac=0.2, horizon=1):
+    """
+    Hold out the latest val_frac of dates instead of a random sample. For an h-week
+    target, training rows in the h-1 weeks before the cut are purged: their target
+    windows run into the validation weeks.
+    """
+    from sklearn.model_selection import train_test_split
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    unique = np.unique(dates)
+    cut = unique[min(len(unique) - 1, int(len(unique) * (1 - val_frac)))]
+    val = dates >= cut
+    train = dates < cut - np.timedelta64(7 * (horizon - 1), "D")
+    if val.all() or not train.any():
+        return train_test_split(X, y, test_size=val_frac, random_state=42)
+    return X[train], X[val], y[train], y[val]
+
+def train_lgb(X, y, dates=None, num_threads=None, params=None, num_boost_round=None, horizon=1):
+    import lightgbm as lgb
+    from lightgbm import early_stopping, log_evaluation
+    from sklearn.model_selection import train_test_split
+    if dates is not None:
+        dtrain, dval, ytrain, yval = time_ordered_split(X, y, dates, horizon=horizon)
+    else:
+        dtrain, dval, ytrain, yval = train_test_split(X, y, test_size=0.2, random_state=42)
     dtrain = lgb.Dataset(dtrain, label=ytrain)
     dval = lgb.Dataset(dval, label=yval)
-    params = {
-        "objective": "regression",
-        "metric": "rmse",
-        "learning_rate": 0.05,
-        "num_leaves": 31,
-        "verbose": -1,
-    }
+    if params is None:
+        params, tuned_rounds = lgb_params()
+        num_boost_round = num_boost_round or tuned_rounds
+    params = dict(params)
+    if num_threads:
+        params["num_threads"] = num_threads
     bst = lgb.train(
         params,
         dtrain,
-        num_boost_round=200,
+        num_boost_round=num_boost_round or NUM_BOOST_ROUND,
         valid_sets=[dtrain, dval],
         callbacks=[early_stopping(20), log_evaluation(0)]
     )
     return bst
 
-def main():
+# ---------------------------------------------------------------------
+# Walk-forward training
+# ---------------------------------------------------------------------
+def walk_forward_splits(dates, n_folds=N_FOLDS, window=None):
+    """
+    (train_mask, test_mask) pairs over unique sorted dates, like TimeSeriesSplit:
+    the test blocks tile the end of history and each fold trains on all earlier
+    dates (expanding) or on the last `window` dates before its test block (rolling).
+    """
+    dates = np.asarray(dates, dtype="datetime64[ns]")
+    unique = np.unique(dates)
+    test_size = len(unique) // (n_folds + 1)
+    if test_size == 0:
+        raise ValueError(f"Not enough dates ({len(unique)}) for {n_folds} folds")
+
+    splits = []
+    for k in range(n_folds):
+        start = len(unique) - (n_folds - k) * test_size
+        stop = start + test_size if k < n_folds - 1 else len(unique)
+        train_from = unique[max(0, start - window)] if window else unique[0]
+        train = (dates >= train_from) & (dates < unique[start])
+        test = (dates >= unique[start]) & (dates <= unique[stop - 1])
+        splits.append((train, test))
+    return splits
+
+def _fit_fold(fold, X_train, y_train, d_train, X_test, num_threads):
+    seed_all(42)
+    elastic = train_elastic(X_train, y_train)
+    lgbm = train_lgb(X_train, y_train, dates=d_train, num_threads=num_threads)
+    preds = {
+        "elasticnet": elastic.predict(X_test),
+        "lgbm": lgbm.predict(X_test, num_threads=num_threads),
+    }
+    return fold, elastic, lgbm, preds
+
+def train_walk_forward(df, n_folds=N_FOLDS, window=None, workers=None):
+    """
+    Fit one ElasticNet + LightGBM pair per fold in parallel and save the fold models
+    plus out-of-sample predictions (Date, index, fold, elasticnet, lgbm) for backtest.py.
+    """
+    import joblib
+    X, y, meta = prepare_xy(df)
+    dates = pd.to_datetime(meta["Date"]).to_numpy()
+    # future rows carry a filled-in placeholder target: never train on them
+    labelled = labelled_rows(df)
+
+    splits = walk_forward_splits(dates, n_folds, window)
+    workers = workers or min(n_folds, os.cpu_count() or 1)
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    print(f"[train] walk-forward: {n_folds} folds, {workers} worker(s) x {num_threads} thread(s)")
+
+    Path(WALK_FORWARD_DIR).mkdir(parents=True, exist_ok=True)
+    oos = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        jobs = [
+            pool.submit(_fit_fold, k, X[train & labelled], y[train & labelled],
+                        dates[train & labelled], X[test], num_threads)
+            for k, (train, test) in enumerate(splits)
+        ]
+        for job in jobs:
+            fold, elastic, lgbm, preds = job.result()
+            joblib.dump(elastic, f"{WALK_FORWARD_DIR}/fold{fold}_elasticnet.pkl")
+            joblib.dump(lgbm, f"{WALK_FORWARD_DIR}/fold{fold}_lgbm.pkl")
+            part = meta[splits[fold][1]].copy()
+            part["fold"] = fold
+            for name, values in preds.items():
+                part[name] = values
+            oos.append(part)
+            print(f"[train] fold {fold}: trained on {int((splits[fold][0] & labelled).sum())} rows, "
+                  f"predicted {len(part)} rows.")
+
+    oos = pd.concat(oos, ignore_index=True)
+    save_data(oos, OOS_PATH)
+    print(f"[train] saved out-of-sample predictions → {OOS_PATH}")
+    return oos
+
+# ---------------------------------------------------------------------
+# Model versions and warm-start refresh
+# ---------------------------------------------------------------------
+def model_info(name, model_dir=MODEL_DIR):
+    """Metadata saved next to models/<name>.pkl (version, mode, trained_through, ...), or None."""
+    try:
+        with open(f"{model_dir}/{name}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_model(model, name, info, model_dir=MODEL_DIR):
+    """
+    Save a new version under versions/<name>/ and make it current: models/<name>.pkl
+    is replaced atomically, so readers never see a half-written pickle.
+    """
+    import joblib
+    now = datetime.now()
+    version = f"{now:%Y%m%d-%H%M%S-%f}-{info['mode']}"
+    info = {**info, "model": name, "version": version, "saved_at": now.isoformat(timespec="seconds")}
+    vdir = Path(model_dir) / "versions" / name
+    vdir.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, vdir / f"{version}.pkl")
+    (vdir / f"{version}.json").write_text(json.dumps(info, indent=2))
+
+    current = Path(model_dir) / f"{name}.pkl"
+    joblib.dump(model, f"{current}.tmp")
+    os.replace(f"{current}.tmp", current)
+    (Path(model_dir) / f"{name}.json").write_text(json.dumps(info, indent=2))
+    for old in sorted(vdir.glob("*.pkl"))[:-KEEP_VERSIONS]:
+        old.unlink()
+        old.with_suffix(".json").unlink(missing_ok=True)
+    print(f"[train] saved {name} ({info['mode']}, version {version}).")
+    return info
+
+def labelled_rows(df):
+    """Rows with a real target (future-prediction rows carry a placeholder)."""
+    if isinstance(df, FeatureMatrix):
+        return ~df.future
+    if "is_future_prediction" in df:
+        return ~df["is_future_prediction"].to_numpy(dtype=bool)
+    return np.ones(len(df), bool)
+
+def _rmse(pred, y):
+    return float(np.sqrt(np.mean((np.asarray(pred) - np.asarray(y)) ** 2)))
+
+def model_name(model, horizon=1):
+    """Saved name of a model per target horizon: "lgbm" (1 week), "lgbm_4w", ..."""
+    return model if horizon == 1 else f"{model}_{horizon}w"
+
+def _refresh_blocker(name, info, feat_cols, params, model_dir=MODEL_DIR, max_refreshes=None):
+    """Why the saved model cannot be refreshed (so a full fit is due), or None."""
+    if info is None or not Path(f"{model_dir}/{name}.pkl").exists():
+        return "no saved model"
+    if info.get("features") != feat_cols:
+        return "feature columns changed"
+    if info.get("params") != params:
+        return "parameters changed"
+    if max_refreshes is not None and info.get("refreshes", 0) >= max_refreshes:
+        return f"{max_refreshes} refreshes since the last full fit"
+    return None
+
+def elastic_val_rmse(X, y, dates, params, horizon=1):
+    """Validation RMSE of an ElasticNet fit on time_ordered_split's training part (the drift baseline)."""
+    X_train, X_val, y_train, y_val = time_ordered_split(X, y, dates, horizon=horizon)
+    if len(y_train) == 0 or len(y_val) == 0:
+        return None
+    return _rmse(train_elastic(X_train, y_train, params).predict(np.asarray(X_val, dtype=np.float64)), y_val)
+
+def _drift(info, unseen_rmse):
+    """Reason for a full refit when the RMSE on unseen weeks is DRIFT_TOLERANCE above validation, else None."""
+    if info.get("val_rmse") and unseen_rmse > (1 + DRIFT_TOLERANCE) * info["val_rmse"]:
+        return f"drift: RMSE {unseen_rmse:.5f} on unseen weeks vs {info['val_rmse']:.5f} validation"
+    return None
+
+def refresh_elastic(X, y, labelled, dates, feat_cols, name="elasticnet", horizon=1, model_dir=MODEL_DIR):
+    """
+    Refit the saved ElasticNet on all labelled rows starting from its coefficients
+    (warm_start): coordinate descent only moves as far as the new weeks require.
+    The same drift check as refresh_lgb runs first. Returns (model, info), or
+    (None, reason) when a full fit is due.
+    """
+    import joblib
+    params = elastic_params(horizon)
+    info = model_info(name, model_dir)
+    reason = _refresh_blocker(name, info, feat_cols, params, model_dir)
+    if reason:
+        return None, reason
+    through = np.datetime64(info["trained_through"])
+    unseen = labelled & (dates > through)
+    model = joblib.load(f"{model_dir}/{name}.pkl")
+    if not unseen.any():
+        return model, {**info, "mode": "unchanged"}
+
+    unseen_rmse = _rmse(model.predict(np.asarray(X[unseen], dtype=np.float64)), y[unseen])
+    reason = _drift(info, unseen_rmse)
+    if reason:
+        return None, reason
+
+    model.set_params(warm_start=True)
+    model.fit(np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64))
+    model.set_params(warm_start=False)
+    return model, {**info, "mode": "refresh", "refreshes": info.get("refreshes", 0) + 1,
+                   "unseen_rmse": unseen_rmse, "iterations": int(model.n_iter_)}
+
+def refresh_lgb(X, y, labelled, dates, feat_cols, name="lgbm", horizon=1, model_dir=MODEL_DIR):
+    """
+    Continue boosting the saved booster (LightGBM init_model) for REFRESH_ROUNDS trees
+    on the latest REFRESH_WEEKS labelled weeks. The drift check scores the saved model
+    on weeks it has never seen first: an RMSE more than DRIFT_TOLERANCE above its
+    validation RMSE means a full retrain. Returns (model, info) or (None, reason).
+    """
+    import joblib
+    import lightgbm as lgb
+    params, _ = lgb_params(horizon)
+    info = model_info(name, model_dir)
+    reason = _refresh_blocker(name, info, feat_cols, params, model_dir, MAX_REFRESHES)
+    if reason:
+        return None, reason
+    through = np.datetime64(info["trained_through"])
+    unseen = labelled & (dates > through)
+    saved = joblib.load(f"{model_dir}/{name}.pkl")
+    if not unseen.any():
+        return saved, {**info, "mode": "unchanged"}
+
+    # only the trees predict() used (up to best_iteration) are continued
+    booster = lgb.Booster(model_str=saved.model_to_string())
+    unseen_rmse = _rmse(booster.predict(X[unseen]), y[unseen])
+    reason = _drift(info, unseen_rmse)
+    if reason:
+        return None, reason
+
+    weeks = np.unique(dates[labelled])
+    recent = labelled & (dates >= weeks[max(0, len(weeks) - REFRESH_WEEKS)])
+    model = lgb.train(params, lgb.Dataset(X[recent], label=y[recent]),
+                      num_boost_round=REFRESH_ROUNDS, init_model=booster)
+    return model, {**info, "mode": "refresh", "refreshes": info.get("refreshes", 0) + 1,
+                   "unseen_rmse": unseen_rmse, "trees": model.num_trees()}
+
+def _fit_info(dates, labelled, feat_cols, params, horizon, **extra):
+    return {
+        "mode": "full",
+        "horizon_weeks": horizon,
+        "trained_through": str(dates[labelled].max()) if labelled.any() else None,
+        "rows": int(len(dates)),
+        "features": feat_cols,
+        "params": params,
+        "refreshes": 0,
+        **extra,
+    }
+
+@telemetry.instrument("train")
+def main(walk_forward=False, n_folds=N_FOLDS, window=None, workers=None, refresh=None):
     ensure_data_dir("./models")
     seed_all(42)
 
     df = load_feats()
-    X, y, meta = prepare_xy(df)
+    if walk_forward:
+        train_walk_forward(df, n_folds, window, workers)
+        return
+
+    fit_elastic(df, refresh)
+    fit_lgbm(df, refresh)
+
+def _horizon_xy(df, horizon):
+    """
+    X, y, dates and labelled mask for one target horizon, keeping only rows whose
+    target has played out: future rows carry a filled-in placeholder 1-week target,
+    and the latest weeks of a multi-week target are NaN.
+    """
+    X, y, meta = prepare_xy(df, target_column(horizon))
+    dates, labelled = meta["Date"].to_numpy(dtype="datetime64[ns]"), labelled_rows(df)
+    known = labelled & ~np.isnan(y)
+    if not known.all():
+        X, y, dates, labelled = X[known], y[known], dates[known], labelled[known]
+    return X, y, dates, labelled
+
+@telemetry.instrument()
+def fit_elastic(df=None, refresh=None, horizons=None):
+    """
+    Fit (or, with refresh, warm-start) and save one ElasticNet per target horizon
+    (config.TARGET_HORIZONS; a pipeline stage on its own).
+    """
+    ensure_data_dir(MODEL_DIR)
+    df = load_feats() if df is None else df
+    feat_cols = [c for c in FEAT_COLS if c in df.columns]
+    for h in config.TARGET_HORIZONS if horizons is None else horizons:
+        name = model_name("elasticnet", h)
+        X, y, dates, labelled = _horizon_xy(df, h)
+        if config.MODEL_REFRESH if refresh is None else refresh:
+            model, info = refresh_elastic(X, y, labelled, dates, feat_cols, name, h)
+            if model is not None:
+                if info["mode"] == "unchanged":
+                    print(f"[train] {name} is up to date, nothing to refresh.")
+                    continue
+                info.update(trained_through=str(dates[labelled].max()), rows=int(len(y)))
+                save_model(model, name, info)
+                continue
+            print(f"[train] {name}: full fit ({info})")
+
+        params = elastic_params(h)
+        elastic = train_elastic(X, y, params)
+        save_model(elastic, name, _fit_info(dates, labelled, feat_cols, params, h,
+                                            val_rmse=elastic_val_rmse(X, y, dates, params, h)))
 
-    elastic = train_elastic(X, y)
-    joblib.dump(elastic, f"{MODEL_DIR}/elasticnet.pkl")
-    print("[train] saved elasticnet.")
+@telemetry.instrument()
+def fit_lgbm(df=None, refresh=None, horizons=None):
+    """
+    Fit (or, with refresh, keep boosting) and save one LightGBM model per target
+    horizon (config.TARGET_HORIZONS; a pipeline stage on its own).
+    """
+    ensure_data_dir(MODEL_DIR)
+    df = load_feats() if df is None else df
+    feat_cols = [c for c in FEAT_COLS if c in df.columns]
+    for h in config.TARGET_HORIZONS if horizons is None else horizons:
+        seed_all(42)
+        name = model_name("lgbm", h)
+        X, y, dates, labelled = _horizon_xy(df, h)
+        if config.MODEL_REFRESH if refresh is None else refresh:
+            model, info = refresh_lgb(X, y, labelled, dates, feat_cols, name, h)
+            if model is not None:
+                if info["mode"] == "unchanged":
+                    print(f"[train] {name} is up to date, nothing to refresh.")
+                    continue
+                info.update(trained_through=str(dates[labelled].max()), rows=int(len(y)))
+                save_model(model, name, info)
+                continue
+            print(f"[train] {name}: full retrain ({info})")
 
-    lgbm = train_lgb(X, y)
-    joblib.dump(lgbm, f"{MODEL_DIR}/lgbm.pkl")
-    print("[train] saved lgbm.")
+        params, rounds = lgb_params(h)
+        lgbm = train_lgb(X, y, dates=dates, params=params, num_boost_round=rounds, horizon=h)
+        val_rmse = lgbm.best_score.get("valid_1", {}).get("rmse")
+        save_model(lgbm, name, _fit_info(dates, labelled, feat_cols, params, h,
+                                         val_rmse=val_rmse, trees=lgbm.num_trees()))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Train ElasticNet and LightGBM models.")
+    parser.add_argument("--walk-forward", action="store_true",
+                        help="train per-fold models and save out-of-sample predictions")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--window", type=int, default=None,
+                        help="rolling train window in weeks (default: expanding)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--refresh", action="store_true",
+                        help="warm-start from the saved models; full retrain on drift (config.MODEL_REFRESH)")
+    args = parser.parse_args()
+    main(args.walk_forward, args.folds, args.window, args.workers, args.refresh or None)
@@ -0,0 +1,356 @@
+# tune.py
+import os
+import json
+import math
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import train
+from utils import seed_all
+
+TUNE_DIR = "./data/tune"
+LOG_PATH = f"{TUNE_DIR}/trials.jsonl"
+BEST_PATH = train.TUNED_PATH
+MODELS = ["lgbm", "elasticnet"]
+
+N_TRIALS = 40
+MAX_ROUNDS = 500          # boosting-round budget of a full trial
+MIN_ROUNDS = 25           # first successive-halving rung
+ETA = 3                   # halving keeps the best 1/ETA of each rung
+EARLY_STOP_ROUNDS = 20
+PRUNE_EVERY = 10          # rounds between pruning checkpoints
+PRUNE_MIN_TRIALS = 5      # finished trials needed before pruning kicks in
+
+# Bin-construction parameters are fixed for the whole search: they are baked into
+# the saved Dataset. feature_pre_filter=False lets trials vary min_data_in_leaf.
+DATASET_PARAMS = {"max_bin": 255, "feature_pre_filter": False, "verbose": -1}
+
+# Worker-side data, loaded once per process (set by _load)
+_DATA = {}
+
+# ---------------------------------------------------------------------
+# Search space
+# ---------------------------------------------------------------------
+def _log_uniform(rng, low, high):
+    return float(np.exp(rng.uniform(np.log(low), np.log(high))))
+
+
+def sample_params(model, rng):
+    """One random configuration for model."""
+    if model == "lgbm":
+        bagging = float(rng.uniform(0.5, 1.0))
+        params = {
+            "learning_rate": _log_uniform(rng, 0.01, 0.2),
+            "num_leaves": int(round(_log_uniform(rng, 7, 127))),
+            "min_data_in_leaf": int(round(_log_uniform(rng, 10, 200))),
+            "feature_fraction": float(rng.uniform(0.5, 1.0)),
+            "bagging_fraction": bagging,
+            "bagging_freq": 1 if bagging < 0.95 else 0,
+            "lambda_l2": _log_uniform(rng, 1e-3, 10.0),
+        }
+    elif model == "elasticnet":
+        params = {
+            "alpha": _log_uniform(rng, 1e-4, 1.0),
+            "l1_ratio": float(rng.uniform(0.05, 1.0)),
+        }
+    else:
+        raise ValueError(f"Unknown model {model!r}; choose from {MODELS}")
+    return {k: float(f"{v:.6g}") if isinstance(v, float) else v for k, v in params.items()}
+
+
+def sample_trials(model, n_trials, seed):
+    """The search's configurations; the same seed regenerates them on resume."""
+    rng = np.random.default_rng([seed, MODELS.index(model)])
+    return [sample_params(model, rng) for _ in range(n_trials)]
+
+# ---------------------------------------------------------------------
+# Helper: data built once per search
+# ---------------------------------------------------------------------
+def _signature(*arrays):
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.shape, arr.dtype.str)).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()[:16]
+
+
+def prepare_data(df, tune_dir=TUNE_DIR):
+    """
+    Time-ordered train/validation split of the labelled rows (the latest 20% of
+    dates validate, as in train_lgb). The LightGBM bins are built once and saved
+    as binary Datasets, and the raw arrays as .npy files for ElasticNet; the files
+    are reused while the data is unchanged. Returns the data signature.
+    """
+    import lightgbm as lgb
+    X, y, meta = train.prepare_xy(df)
+    labelled = train.labelled_rows(df)
+    dates = pd.to_datetime(meta["Date"]).to_numpy()[labelled]
+    X_train, X_val, y_train, y_val = train.time_ordered_split(X[labelled], y[labelled], dates)
+    signature = _signature(X_train, y_train, X_val, y_val)
+
+    tune_dir = Path(tune_dir)
+    tune_dir.mkdir(parents=True, exist_ok=True)
+    spec_path = tune_dir / "dataset.json"
+    spec = {"signature": signature, "dataset_params": DATASET_PARAMS,
+            "train_rows": len(y_train), "valid_rows": len(y_val)}
+    try:
+        current = json.loads(spec_path.read_text())
+    except (OSError, ValueError):
+        current = None
+    if current == spec and (tune_dir / "train.bin").exists() and (tune_dir / "valid.bin").exists():
+        print(f"[tune] reusing binned datasets in {tune_dir}")
+        return signature
+
+    start = time.perf_counter()
+    for name in ("train.bin", "valid.bin"):
+        (tune_dir / name).unlink(missing_ok=True)  # save_binary does not overwrite
+    dtrain = lgb.Dataset(X_train, label=y_train, params=DATASET_PARAMS)
+    dval = lgb.Dataset(X_val, label=y_val, reference=dtrain, params=DATASET_PARAMS)
+    dtrain.save_binary(str(tune_dir / "train.bin"))
+    dval.save_binary(str(tune_dir / "valid.bin"))
+    for name, arr in (("X_train", X_train), ("y_train", y_train), ("X_val", X_val), ("y_val", y_val)):
+        np.save(tune_dir / f"{name}.npy", np.ascontiguousarray(arr))
+    spec_path.write_text(json.dumps(spec))
+    print(f"[tune] binned {len(y_train)} train / {len(y_val)} validation rows "
+          f"in {time.perf_counter() - start:.2f}s")
+    return signature
+
+
+def _load(tune_dir):
+    """Pool initializer: open the saved Datasets (already binned) and arrays once."""
+    import lightgbm as lgb
+    tune_dir = Path(tune_dir)
+    dtrain = lgb.Dataset(str(tune_dir / "train.bin"), params=DATASET_PARAMS)
+    _DATA["lgb_train"] = dtrain
+    _DATA["lgb_valid"] = lgb.Dataset(str(tune_dir / "valid.bin"), reference=dtrain, params=DATASET_PARAMS)
+    for name in ("X_train", "y_train", "X_val", "y_val"):
+        _DATA[name] = np.load(tune_dir / f"{name}.npy", mmap_mode="r")
+
+# ---------------------------------------------------------------------
+# Trials
+# ---------------------------------------------------------------------
+class _Pruned(Exception):
+    pass
+
+
+def _pruning_callback(reference):
+    """Stop a trial whose validation RMSE at a checkpoint is above the median of
+    the finished trials at the same checkpoint (reference: round -> median)."""
+    def _callback(env):
+        rounds = env.iteration + 1
+        if rounds % PRUNE_EVERY or rounds not in reference:
+            return
+        score = env.evaluation_result_list[0][2]
+        if score > reference[rounds]:
+            raise _Pruned(rounds)
+    _callback.order = 40  # after record_evaluation and early stopping
+    return _callback
+
+
+def _run_lgbm(params, rounds, reference, num_threads):
+    import lightgbm as lgb
+    evals = {}
+    full = {**train.LGB_PARAMS, **params, "num_threads": num_threads, "seed": 42}
+    status = "complete"
+    try:
+        lgb.train(full, _DATA["lgb_train"], num_boost_round=rounds,
+                  valid_sets=[_DATA["lgb_valid"]], valid_names=["valid"],
+                  callbacks=[lgb.record_evaluation(evals), lgb.early_stopping(EARLY_STOP_ROUNDS, verbose=False),
+                             _pruning_callback(reference)])
+    except _Pruned:
+        status = "pruned"
+    curve = evals["valid"]["rmse"]
+    best = int(np.argmin(curve))
+    return {
+        "status": status,
+        "val_rmse": float(curve[best]),
+        "best_iteration": best + 1,
+        "rounds_trained": len(curve),
+        "checkpoints": [float(v) for v in curve[PRUNE_EVERY - 1::PRUNE_EVERY]],
+    }
+
+
+def _run_elasticnet(params):
+    from sklearn.linear_model import ElasticNet
+    model = ElasticNet(**params).fit(_DATA["X_train"], _DATA["y_train"])
+    resid = model.predict(_DATA["X_val"]) - _DATA["y_val"]
+    return {"status": "complete", "val_rmse": float(np.sqrt(np.mean(resid ** 2)))}
+
+
+def _evaluate(task):
+    model, params, rounds, reference, num_threads = task
+    seed_all(42)
+    start = time.perf_counter()
+    if model == "lgbm":
+        result = _run_lgbm(params, rounds, reference, num_threads)
+    else:
+        result = _run_elasticnet(params)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+# ---------------------------------------------------------------------
+# Trial log
+# ---------------------------------------------------------------------
+def load_log(path=LOG_PATH, search_id=None):
+    """Finished trials of a search: (model, trial, rounds) -> record."""
+    done = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted write
+                if search_id is None or rec.get("search") == search_id:
+                    done[(rec["model"], rec["trial"], rec.get("rounds"))] = rec
+    except OSError:
+        pass
+    return done
+
+
+def _append(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+        f.flush()
+
+
+def _reference(done, model, rounds):
+    """Median validation RMSE per checkpoint over finished trials of one budget."""
+    curves = [r["checkpoints"] for (m, _, b), r in done.items()
+              if m == model and b == rounds and r["status"] == "complete"]
+    reference = {}
+    for k in range(max(map(len, curves), default=0)):
+        values = [c[k] for c in curves if len(c) > k]
+        if len(values) >= PRUNE_MIN_TRIALS:
+            reference[(k + 1) * PRUNE_EVERY] = float(np.median(values))
+    return reference
+
+# ---------------------------------------------------------------------
+# Search
+# ---------------------------------------------------------------------
+def halving_rungs(min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, eta=ETA):
+    rungs = [min_rounds]
+    while rungs[-1] * eta < max_rounds:
+        rungs.append(rungs[-1] * eta)
+    if rungs[-1] < max_rounds:
+        rungs.append(max_rounds)
+    return rungs
+
+
+def _run_batch(pool, workers, tasks, done, search_id, num_threads, prune, log_path):
+    """
+    Run (model, trial, params, rounds) tasks not yet in the log. At most one task
+    per worker is in flight, so each new trial is pruned against the latest medians.
+    """
+    pending = [t for t in tasks if (t[0], t[1], t[3]) not in done]
+    if len(pending) < len(tasks):
+        print(f"[tune] resuming: {len(tasks) - len(pending)} of {len(tasks)} trials already in the log")
+    running = {}
+    while pending or running:
+        while pending and len(running) < workers:
+            model, trial, params, rounds = pending.pop(0)
+            reference = _reference(done, model, rounds) if prune and model == "lgbm" else {}
+            future = pool.submit(_evaluate, (model, params, rounds, reference, num_threads))
+            running[future] = (model, trial, params, rounds)
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            model, trial, params, rounds = running.pop(future)
+            record = {"search": search_id, "model": model, "trial": trial, "rounds": rounds,
+                      "params": params, **future.result()}
+            done[(model, trial, rounds)] = record
+            _append(log_path, record)
+            print(f"[tune] {model:<10} trial {trial:>3}"
+                  f"{f' @ {rounds} rounds' if rounds else ''}: val RMSE {record['val_rmse']:.6f} "
+                  f"({record['status']}, {record['seconds']:.2f}s)")
+
+
+def search(df, strategy="random", n_trials=N_TRIALS, models=MODELS, workers=None,
+           threads=1, seed=42, prune=True, tune_dir=TUNE_DIR, log_path=LOG_PATH, best_path=BEST_PATH):
+    """
+    Random search (every LightGBM trial gets MAX_ROUNDS with early stopping and
+    median pruning) or successive halving (all trials start at MIN_ROUNDS and the
+    best 1/ETA move up each rung). ElasticNet has no round budget, so each of its
+    trials is a single fit. Finished trials are appended to the log as they
+    complete; rerunning the same search skips them. Best parameters go to best_path.
+    """
+    if strategy not in ("random", "halving"):
+        raise ValueError(f"Unknown strategy {strategy!r}; choose 'random' or 'halving'")
+    signature = prepare_data(df, tune_dir)
+    search_id = _signature(np.frombuffer(json.dumps(
+        [signature, strategy, n_trials, sorted(models), seed, prune, MAX_ROUNDS, MIN_ROUNDS, ETA]).encode(), np.uint8))
+    done = load_log(log_path, search_id)
+
+    workers = workers or max(1, (os.cpu_count() or 1) // threads)
+    print(f"[tune] {strategy} search {search_id}: {n_trials} trial(s) x {models}, "
+          f"{workers} worker(s) x {threads} thread(s)")
+    trials = {m: sample_trials(m, n_trials, seed) for m in models}
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load, initargs=(tune_dir,)) as pool:
+        try:
+            if "elasticnet" in trials:
+                _run_batch(pool, workers, [("elasticnet", i, p, None) for i, p in enumerate(trials["elasticnet"])],
+                           done, search_id, threads, prune, log_path)
+            if "lgbm" in trials:
+                alive = list(range(n_trials))
+                rungs = halving_rungs() if strategy == "halving" else [MAX_ROUNDS]
+                for k, rounds in enumerate(rungs):
+                    _run_batch(pool, workers, [("lgbm", i, trials["lgbm"][i], rounds) for i in alive],
+                               done, search_id, threads, prune, log_path)
+                    if k < len(rungs) - 1:
+                        # pruned trials rank last; their RMSE is from a shorter run
+                        ranked = sorted(alive, key=lambda i: (done[("lgbm", i, rounds)]["status"] != "complete",
+                                                              done[("lgbm", i, rounds)]["val_rmse"]))
+                        alive = ranked[:max(1, math.ceil(len(alive) / ETA))]
+                        print(f"[tune] rung {rounds} rounds: keeping {len(alive)} trial(s)")
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(f"\n[tune] interrupted; finished trials are in {log_path}, rerun to resume.")
+            raise
+
+    best = best_trials(done, models)
+    Path(best_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(best_path, "w") as f:
+        json.dump(best, f, indent=2)
+    for model, rec in best.items():
+        print(f"[tune] best {model}: val RMSE {rec['val_rmse']:.6f} {rec['params']}")
+    print(f"[tune] ✅ saved best parameters → {best_path} (train.py uses them)")
+    return best
+
+
+def best_trials(done, models=MODELS):
+    """Per model, the lowest validation RMSE among completed trials at the largest budget."""
+    best = {}
+    for model in models:
+        recs = [r for (m, _, _), r in done.items() if m == model and r["status"] == "complete"]
+        if not recs:
+            continue
+        top = max(r["rounds"] or 0 for r in recs)
+        rec = min((r for r in recs if (r["rounds"] or 0) == top), key=lambda r: r["val_rmse"])
+        best[model] = {"params": rec["params"], "val_rmse": rec["val_rmse"], "trial": rec["trial"]}
+        if model == "lgbm":
+            best[model]["num_boost_round"] = rec["best_iteration"]
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hyperparameter search for the LightGBM and ElasticNet models.")
+    parser.add_argument("--strategy", choices=["random", "halving"], default="random")
+    parser.add_argument("--trials", type=int, default=N_TRIALS)
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=MODELS)
+    parser.add_argument("--workers", type=int, default=None, help="trial processes (default: cpus / threads)")
+    parser.add_argument("--threads", type=int, default=1, help="LightGBM threads per trial")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-prune", action="store_true", help="disable median pruning of bad trials")
+    parser.add_argument("--fresh", action="store_true", help="ignore the trial log and start over")
+    args = parser.parse_args()
+
+    if args.fresh:
+        Path(LOG_PATH).unlink(missing_ok=True)
+    search(train.load_feats(), args.strategy, args.trials, args.models, args.workers,
+           args.threads, args.seed, not args.no_prune)
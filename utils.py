@@ -1,17 +1,30 @@
-import pandas as pd
 from pathlib import Path
+import telemetry
 
-def load_data(path: str):
-    """Safely load a CSV or Parquet file if it exists, else return None."""
+# pandas and NumPy are imported inside the helpers that use them, so light
+# entry points (run.py --help, the runner, telemetry) start without them.
+
+def load_data(path: str, **kwargs):
+    """Safely load a CSV or Parquet file if it exists, else return None.
+    Extra keyword arguments (e.g. columns, filters) go to the pandas reader."""
+    with telemetry.span("load_data", path=str(path)):
+        df = _load_data(path, **kwargs)
+        if df is not None:
+            telemetry.count(rows_in=len(df), bytes_read=telemetry.path_bytes(path))
+        return df
+
+
+def _load_data(path, **kwargs):
+    import pandas as pd
     try:
         path_obj = Path(path)
         if not path_obj.exists():
             print(f"[utils] could not load {path}: file not found.")
             return None
         if path_obj.suffix in [".csv", ".txt"]:
-            df = pd.read_csv(path_obj)
+            df = pd.read_csv(path_obj, **kwargs)
         elif path_obj.suffix in [".parquet"]:
-            df = pd.read_parquet(path_obj)
+            df = pd.read_parquet(path_obj, **kwargs)
         else:
             print(f"[utils] Unsupported file type for {path}")
             return None
@@ -22,8 +35,15 @@ def load_data(path: str):
         return None
 
 
-def save_data(df: pd.DataFrame, path: str):
+def save_data(df: "pd.DataFrame", path: str):
     """Save DataFrame as Parquet or CSV, depending on extension."""
+    with telemetry.span("save_data", path=str(path)):
+        written = _save_data(df, path)
+        if written:
+            telemetry.count(rows_out=len(df), bytes_written=telemetry.path_bytes(written))
+
+
+def _save_data(df, path):
     try:
         path_obj = Path(path)
         path_obj.parent.mkdir(exist_ok=True)
@@ -32,12 +52,15 @@ def save_data(df: pd.DataFrame, path: str):
         elif path_obj.suffix == ".parquet":
             df.to_parquet(path_obj)
         else:
-            df.to_csv(str(path_obj) + ".csv", index=False)
+            path_obj = Path(str(path_obj) + ".csv")
+            df.to_csv(path_obj, index=False)
         print(f"[utils] saved → {path}")
+        return path_obj
     except Exception as e:
         print(f"[utils] could not save {path}: {e}")
+        return None
 
-import os, random, numpy as np
+import os, random
 
 def ensure_data_dir(path="./data"):
     """Ensure data directory exists."""
@@ -45,6 +68,7 @@ def ensure_data_dir(path="./data"):
 
 def load_csv_safe(path):
     """Safely load CSV or return None if not found."""
+    import pandas as pd
     try:
         if os.path.exists(path):
             return pd.read_csv(path)
@@ -57,5 +81,22 @@ def load_csv_safe(path):
 
 def seed_all(seed=42):
     """Set all random seeds for reproducibility."""
+    import numpy as np
     random.seed(seed)
     np.random.seed(seed)
+
+def downcast_floats(df):
+    """Convert float64 columns to float32 in place (low-memory mode)."""
+    for c in df.columns[df.dtypes == "float64"]:
+        df[c] = df[c].astype("float32")
+    return df
+
+def rss_mb():
+    """Current resident set size in MB (lifetime peak where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import sys, resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
@@ -0,0 +1,164 @@
+# vix.py
+import io
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+from config import VIX_FILE, PUBLICATION_TIME, WEEKDAY_CUTOFF
+from utils import load_data, save_data
+
+WEEKLY_PATH = "./data/vix_weekly.parquet"
+STATE_PATH = "./data/vix_weekly.json"   # high-water mark + byte offset into VIX_FILE
+CHUNK_BYTES = 64 * 1024 * 1024          # bounded read size per chunk
+
+WEEKDAYS = ["MONDAY", "TUESDAY", "WEDNESDAY", "THURSDAY", "FRIDAY", "SATURDAY", "SUNDAY"]
+TIME_COLUMNS = ["date", "datetime", "timestamp", "time"]
+OUT_COLS = ["vix_open", "vix_high", "vix_low", "vix_close", "vix_rv"]
+MIN_RV_RETURNS = 60                     # minute returns a week needs for vix_rv (about an hour)
+
+# ---------------------------------------------------------------------
+# Helper: streaming CSV reader
+# ---------------------------------------------------------------------
+def iter_minute_chunks(path, offset=0, chunk_bytes=CHUNK_BYTES):
+    """
+    Yield (bars, end_offset) for complete lines of the minute CSV, starting at byte
+    `offset` (0 = just after the header). Memory stays bounded by chunk_bytes. A
+    trailing line without its newline (a write in progress) is left for the next
+    run: end_offset never moves past the last newline.
+    """
+    with open(path, "rb") as f:
+        header = f.readline().decode().strip()
+        names = [c.strip().lower() for c in header.split(",")]
+        ts_col = next((c for c in TIME_COLUMNS if c in names), names[0])
+        f.seek(max(offset, f.tell()))
+
+        carry = b""
+        while True:
+            block = f.read(chunk_bytes)
+            data = carry + block
+            cut = data.rfind(b"\n") + 1
+            carry = data[cut:]
+            if cut:
+                bars = pd.read_csv(io.BytesIO(data[:cut]), header=None, names=names,
+                                   usecols=[ts_col, "open", "high", "low", "close"])
+                bars = bars.rename(columns={ts_col: "ts"})
+                bars["ts"] = pd.to_datetime(bars["ts"])
+                yield bars, f.tell() - len(carry)
+            if not block:
+                break
+
+
+def week_end(ts, cutoff=PUBLICATION_TIME, weekday=WEEKDAY_CUTOFF):
+    """The weekly cut-off (e.g. Friday 15:30) each timestamp falls into; bars at the cut-off count."""
+    cut = pd.to_timedelta(f"{cutoff}:00")
+    day = (ts - cut - pd.Timedelta(1, "ns")).dt.normalize() + pd.Timedelta(1, "D")
+    ahead = (WEEKDAYS.index(weekday.upper()) - day.dt.weekday) % 7
+    return day + pd.to_timedelta(ahead, unit="D") + cut
+
+
+def weekly_partials(bars, prev_close=np.nan, prev_week=pd.NaT):
+    """
+    Per-week partial aggregates of one chunk of minute bars (sorted by time).
+    Log returns between consecutive bars of the same week feed realized volatility.
+    """
+    bars = bars.dropna(subset=["ts", "close"]).sort_values("ts", kind="stable")
+    week = week_end(bars["ts"])
+    close = bars["close"].to_numpy(dtype=float)
+    prev = np.r_[prev_close, close[:-1]]
+    weeks = week.to_numpy()
+    prev_weeks = np.concatenate([pd.Series([prev_week], dtype="datetime64[ns]").to_numpy(), weeks[:-1]])
+    same_week = weeks == prev_weeks
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.where(same_week, np.log(close / prev), np.nan)
+
+    parts = pd.DataFrame({
+        "Date": weeks, "open": bars["open"].to_numpy(), "high": bars["high"].to_numpy(),
+        "low": bars["low"].to_numpy(), "close": close, "ssq": np.nan_to_num(r ** 2), "n": ~np.isnan(r),
+        "last_minute": bars["ts"].to_numpy(),
+    }).groupby("Date", sort=True).agg(
+        vix_open=("open", "first"), vix_high=("high", "max"), vix_low=("low", "min"),
+        vix_close=("close", "last"), rv_ssq=("ssq", "sum"), rv_n=("n", "sum"),
+        last_minute=("last_minute", "max"),
+    )
+    return parts.reset_index()
+
+
+def combine_partials(parts, min_returns=MIN_RV_RETURNS):
+    """
+    Merge partial aggregates for the same week (chunks are in time order). vix_rv is
+    NaN for weeks with fewer than min_returns intraday returns, where it is mostly noise.
+    """
+    weekly = pd.concat(parts, ignore_index=True).groupby("Date", sort=True).agg(
+        vix_open=("vix_open", "first"), vix_high=("vix_high", "max"), vix_low=("vix_low", "min"),
+        vix_close=("vix_close", "last"), rv_ssq=("rv_ssq", "sum"), rv_n=("rv_n", "sum"),
+        last_minute=("last_minute", "max"),
+    ).reset_index()
+    weekly["vix_rv"] = np.sqrt(weekly["rv_ssq"]).where(weekly["rv_n"] >= min_returns)
+    return weekly
+
+# ---------------------------------------------------------------------
+# Cached weekly VIX
+# ---------------------------------------------------------------------
+def update_vix_weekly(path=VIX_FILE, weekly_path=WEEKLY_PATH, state_path=STATE_PATH):
+    """
+    Resample the minute VIX file to weekly bars at the Friday cut-off, parsing only
+    the bytes appended since the cached high-water mark. Returns the weekly frame
+    (Date = cut-off timestamp) or None when the minute file is missing.
+    """
+    src = Path(path)
+    if not src.exists():
+        print(f"[vix] minute file not found: {path}")
+        return None
+
+    cached = load_data(weekly_path) if Path(weekly_path).exists() else None
+    try:
+        state = json.loads(Path(state_path).read_text())
+    except (FileNotFoundError, ValueError):
+        state = {}
+    resumable = (
+        cached is not None and state.get("source") == str(src)
+        and state.get("offset", 0) <= src.stat().st_size
+    )
+    if not resumable:
+        cached, state = None, {"source": str(src), "offset": 0, "hwm": None}
+
+    hwm = pd.Timestamp(state["hwm"]) if state.get("hwm") else None
+    prev_close, prev_week = np.nan, pd.NaT
+    if cached is not None and len(cached):
+        prev_close, prev_week = cached["vix_close"].iloc[-1], cached["Date"].iloc[-1]
+
+    parts = [] if cached is None else [cached]
+    offset, n_bars = state["offset"], 0
+    for bars, offset in iter_minute_chunks(src, state["offset"]):
+        if hwm is not None:
+            bars = bars[bars["ts"] > hwm]
+        if bars.empty:
+            continue
+        part = weekly_partials(bars, prev_close, prev_week)
+        prev_close, prev_week = part["vix_close"].iloc[-1], part["Date"].iloc[-1]
+        parts.append(part)
+        n_bars += len(bars)
+
+    if not parts:
+        print("[vix] no minute bars found.")
+        return None
+    weekly = combine_partials(parts)
+    save_data(weekly, weekly_path)
+    state.update(offset=offset, hwm=str(weekly["last_minute"].max()))
+    Path(state_path).write_text(json.dumps(state))
+    print(f"[vix] parsed {n_bars} new minute bars → {len(weekly)} weekly rows")
+    return weekly
+
+
+def join_vix(panel, weekly):
+    """As-of join: each long panel row gets the latest weekly VIX whose cut-off has passed."""
+    left = panel.assign(Date=pd.to_datetime(panel["Date"])).sort_values("Date", kind="stable")
+    right = weekly[["Date", *OUT_COLS]].sort_values("Date")
+    return pd.merge_asof(left, right, on="Date", direction="backward")
+
+
+if __name__ == "__main__":
+    import argparse
+    argparse.ArgumentParser(description="Update the weekly India VIX series from the minute file.").parse_args()
+    update_vix_weekly()